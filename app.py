@@ -1,30 +1,74 @@
 import asyncio
+import hmac
 import json
+import os
+import socket
+import threading
+import time
 from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import List, Optional
+from typing import Optional
 
+import anyio
 import uvicorn
 from fastapi import (
-    BackgroundTasks,
     FastAPI,
-    File,
     Form,
+    Request,
     Response,
-    UploadFile,
     WebSocket,
     WebSocketDisconnect,
     status,
 )
 from fastapi.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.websockets import WebSocketState
 
 import schema
-from core.models import BartModel, Llama31Model, MinillmModel
+from core.models import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    BartModel,
+    GenerationScheduler,
+    Llama31Model,
+    MinillmModel,
+    OllamaBackendPool,
+    ScheduledText2Text,
+    SchedulerRejected,
+)
 from service.agent import Agent
+from service.ingestion import create_ingestion_service
+from tools.accounting import UsageAccountant
 from tools.connect_handler import ConnectHandler
-from tools.logger import config_logger
+from tools.job_queue import CHAT_BUSY_SIGNAL, PRIORITY_INGEST, PRIORITY_REINDEX
+from tools.logger import config_logger, get_log_stats
+from tools.metrics import (
+    CHAT_STREAMS,
+    UPLOAD_FILES,
+    PrometheusMiddleware,
+    mark_process_dead,
+    refresh_gauges,
+    register_gauge,
+    render_metrics,
+)
+from tools.profiler import ProfilerBusy, SamplingProfiler
+from tools.progress_bus import ProgressBus
+from tools.task_store import TaskTracker, create_task_store
+from tools.tracing import span_stats
+from tools.upload_session import (
+    UploadSessionBusy,
+    UploadSessionError,
+    UploadSessionHandler,
+    UploadSessionNotFound,
+)
 from tools.user_register import UserHandler
-from utils import async_write_multi_files
+from utils import (
+    StagedFile,
+    UploadFormatError,
+    UploadTooLargeError,
+    async_stream_multi_files,
+    commit_staged_files,
+)
 
 # init log
 logger = config_logger(
@@ -38,31 +82,44 @@ logger = config_logger(
 # Instantiation
 user_handler = UserHandler()
 connect_handler = ConnectHandler()
-gen_text_model = Llama31Model(host=connect_handler.OLLAMA_HOST)
-text_emb_model = MinillmModel(host=connect_handler.OLLAMA_HOST)
+ollama_backends = OllamaBackendPool.from_hosts(hosts=connect_handler.OLLAMA_HOSTS)
+gen_text_model = Llama31Model(backends=ollama_backends)
+text_emb_model = MinillmModel(backends=ollama_backends)
 topics_classifier_model = BartModel(host=connect_handler.BART_HOST)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Init model
-    gen_text_model._load_model()
-    logger.info(
-        f"Success init model to Gen text. model name = '{gen_text_model.model_name}'"
-    )
-    text_emb_model._load_model()
-    logger.info(
-        f"Success init model to Embedding text. model name = '{text_emb_model.model_name}'"
-    )
-    topics_classifier_model._load_model()
-    logger.info(
-        f"Success init model to Topics classifier. model name = '{topics_classifier_model.model_name}'"
-    )
+    progress_bus.bind(loop=asyncio.get_running_loop())
+    ollama_backends.start_health_check()
+    cleanup_task = asyncio.create_task(cleanup_tasks_status())
+    sessions_task = asyncio.create_task(cleanup_upload_sessions())
+    if connect_handler.INGEST_WORKER_MODE == "inprocess":
+        ingestion_task = asyncio.create_task(ingestion_service.run())
+
+    # Warm the models in the background, the worker serves `/health` at once
+    # and `/ready` turns green when every model is loaded.
+    warmup_task = asyncio.create_task(warmup_models())
+    gauges_task = asyncio.create_task(refresh_gauges_loop())
+    usage_task = asyncio.create_task(flush_usage_loop())
+    chat_busy_task = asyncio.create_task(publish_chat_busy_loop())
 
     yield
 
+    warmup_task.cancel()
+    gauges_task.cancel()
+    usage_task.cancel()
+    chat_busy_task.cancel()
+    await asyncio.to_thread(accountant.flush)
+    cleanup_task.cancel()
+    sessions_task.cancel()
+    if connect_handler.INGEST_WORKER_MODE == "inprocess":
+        ingestion_service.stop()
+        await ingestion_task
+    ollama_backends.stop_health_check()
     gen_text_model._release_model()
     text_emb_model._release_model()
+    mark_process_dead()
 
 
 topics = [
@@ -74,48 +131,463 @@ topics = [
 ]
 logger.info(f"Setting topics.'{topics}'")
 
-tasks_status = dict()
-logger.info("Success create 'tasks_status' dict.")
+progress_bus = ProgressBus()
+task_tracker = TaskTracker(
+    store=create_task_store(url=connect_handler.TASK_STORE_URL), bus=progress_bus
+)
+logger.info(f"Success create task store: '{connect_handler.TASK_STORE_URL}'")
+
+ingestion_service = create_ingestion_service(
+    connect_handler=connect_handler,
+    tracker=task_tracker,
+    is_chat_busy=lambda: active_chats > 0,
+)
+logger.info(f"Ingestion worker mode: '{connect_handler.INGEST_WORKER_MODE}'")
+
+accountant = UsageAccountant(path=connect_handler.USAGE_STORE_PATH)
+logger.info(f"Success create usage store: '{connect_handler.USAGE_STORE_PATH}'")
 
-CHUNK_SIZE = 1024 * 1024 * 5
-logger.info(f"Chunk size: {CHUNK_SIZE}")
+active_chats = 0
+active_chats_lock = threading.Lock()
+# Seconds between two renewals of the chat busy signal.
+CHAT_BUSY_INTERVAL = 1.0
+
+STREAM_STALL_TIMEOUT = 30.0
+STREAM_KEEPALIVE = 5.0
+logger.info(
+    f"Stream stall timeout: {STREAM_STALL_TIMEOUT}, keep-alive: {STREAM_KEEPALIVE}"
+)
+
+TASK_TTL = 60 * 60 * 24
+TASK_REFRESH = 1.0
+logger.info(f"Task ttl: {TASK_TTL}, refresh: {TASK_REFRESH}")
 
 SAVE_PATH = "upload_pdf"
 logger.info(f"Save path: {SAVE_PATH}")
 
+MAX_UPLOAD_FILE_SIZE = 1024 * 1024 * 200
+MAX_UPLOAD_REQUEST_SIZE = 1024 * 1024 * 1024
+logger.info(
+    f"Upload limit: file={MAX_UPLOAD_FILE_SIZE}, request={MAX_UPLOAD_REQUEST_SIZE}"
+)
+
+# A session carries one file, it gets the same limit as `/upload/` files.
+upload_session_handler = UploadSessionHandler(
+    root=Path(__file__).resolve().parent / SAVE_PATH / ".sessions",
+    max_file_size=MAX_UPLOAD_FILE_SIZE,
+)
+logger.info(f"Upload session part size: {upload_session_handler.part_size}")
+
+# Waiters block a threadpool thread (~40 by default), keep the queue small
+# so waiting chats never starve the other sync endpoints.
+generation_scheduler = GenerationScheduler(
+    max_concurrency=4,
+    max_queue=8,
+    queue_timeout=30.0,
+    shares={PRIORITY_INTERACTIVE: 4, PRIORITY_BACKGROUND: 1},
+)
+logger.info(
+    f"Generation scheduler: concurrency={generation_scheduler.max_concurrency}, queue={generation_scheduler.max_queue}, timeout={generation_scheduler.queue_timeout}, shares={generation_scheduler.shares}"
+)
+
 # init Service
 agent = Agent(
-    gen_text_model=gen_text_model,
+    gen_text_model=ScheduledText2Text(
+        model=gen_text_model, scheduler=generation_scheduler
+    ),
     text_emb_model=text_emb_model,
     topics_classifier_service=topics_classifier_model,
     topics=topics,
 )
 logger.info("Success init Agent")
 
+
+WARMUP_RETRY = 2.0
+WARMUP_MAX_RETRY = 30.0
+warmup_models_status = {
+    "gen_text": {"model_name": gen_text_model.model_name, "ready": False},
+    "text_emb": {"model_name": text_emb_model.model_name, "ready": False},
+    "topics_classifier": {
+        "model_name": topics_classifier_model.model_name,
+        "ready": False,
+    },
+}
+
+
+async def warmup_model(name: str, model) -> None:
+    """
+    Load one model, retrying with backoff until its server answers.
+    """
+    delay = WARMUP_RETRY
+    start_time = time.monotonic()
+    while True:
+        try:
+            await asyncio.to_thread(model._load_model)
+            break
+        except Exception as e:
+            warmup_models_status[name]["error"] = str(e) or type(e).__name__
+            logger.warning(f"Can not load model '{model.model_name}', retry in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARMUP_MAX_RETRY)
+
+    warmup_models_status[name].pop("error", None)
+    warmup_models_status[name]["ready"] = True
+    warmup_models_status[name]["load_seconds"] = time.monotonic() - start_time
+    logger.info(
+        f"Success init model '{model.model_name}' in {warmup_models_status[name]['load_seconds']:.1f}s"
+    )
+
+
+async def warmup_models() -> None:
+    await asyncio.gather(
+        warmup_model(name="gen_text", model=gen_text_model),
+        warmup_model(name="text_emb", model=text_emb_model),
+        warmup_model(name="topics_classifier", model=topics_classifier_model),
+    )
+
+
+def models_ready() -> bool:
+    return all(model["ready"] for model in warmup_models_status.values())
+
+
+async def cleanup_tasks_status():
+    while True:
+        try:
+            removed = await asyncio.to_thread(task_tracker.store.cleanup, TASK_TTL)
+            if removed:
+                logger.info(f"Remove {removed} finished tasks from task store")
+        except Exception as e:
+            logger.error(f"Can not clean up task store: {str(e)}")
+        await asyncio.sleep(TASK_TTL / 24)
+
+
+async def publish_chat_busy_loop():
+    # Ingestion workers of other processes read this signal, it expires by
+    # itself if this worker dies.
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    busy = False
+    while True:
+        try:
+            if active_chats > 0:
+                await asyncio.to_thread(
+                    ingestion_service.queue.signal,
+                    CHAT_BUSY_SIGNAL,
+                    owner,
+                    CHAT_BUSY_INTERVAL * 3,
+                )
+                busy = True
+            elif busy:
+                await asyncio.to_thread(
+                    ingestion_service.queue.signal, CHAT_BUSY_SIGNAL, owner, 0
+                )
+                busy = False
+        except Exception as e:
+            logger.error(f"Can not publish chat busy signal: {str(e)}")
+        await asyncio.sleep(CHAT_BUSY_INTERVAL)
+
+
+async def cleanup_upload_sessions():
+    while True:
+        try:
+            removed = await asyncio.to_thread(upload_session_handler.cleanup)
+            if removed:
+                logger.info(f"Remove {removed} expired upload sessions")
+        except Exception as e:
+            logger.error(f"Can not clean up upload sessions: {str(e)}")
+        await asyncio.sleep(upload_session_handler.expire_seconds / 24)
+
+
+def count_active_chat(iterator):
+    global active_chats
+    with active_chats_lock:
+        active_chats += 1
+    CHAT_STREAMS.inc()
+    try:
+        yield from iterator
+    finally:
+        CHAT_STREAMS.dec()
+        with active_chats_lock:
+            active_chats -= 1
+
+
+async def stream_until_disconnect(request: Request, iterator):
+    """
+    Stream a blocking generator and close it as soon as the client is gone.
+
+    Chunks are pulled one at a time, only after the previous one was sent,
+    so a slow reader slows down the upstream generation instead of piling
+    up data. A reader stalling longer than `STREAM_STALL_TIMEOUT` on one
+    chunk is dropped.
+    """
+    try:
+        async for chunk in iterate_in_threadpool(iterator):
+            if await request.is_disconnected():
+                logger.info("Client disconnected, stop streaming")
+                break
+            start_time = time.monotonic()
+            yield chunk
+            if time.monotonic() - start_time > STREAM_STALL_TIMEOUT:
+                logger.warning("Client too slow, stop streaming")
+                break
+    finally:
+        # Also runs when the response task is cancelled on disconnect.
+        with anyio.CancelScope(shield=True):
+            await run_in_threadpool(iterator.close)
+
+
+STREAM_MEDIA_TYPES = {
+    "text": "text/plain",
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+
+def encode_event(stream: str, event: str, **data) -> str:
+    if stream == "sse":
+        if event == "ping":
+            # A comment line, ignored by EventSource but keeps proxies open.
+            return ": ping\n\n"
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return json.dumps({"event": event, **data}, ensure_ascii=False) + "\n"
+
+
+_STREAM_END = object()
+
+
+def next_chunk(iterator):
+    try:
+        return next(iterator)
+    except StopIteration:
+        return _STREAM_END
+
+
+async def stream_events(request: Request, create_iterator, stream: str):
+    """
+    Stream a blocking chat generator as typed events.
+
+    The response starts at once with a `start` event, then `stage` events
+    report the context gathering, `token` events carry the answer and `ping`
+    events are sent every `STREAM_KEEPALIVE` seconds without output. The
+    stream ends with `done`, or `error`. Like `stream_until_disconnect`, the
+    next chunk is only pulled after the previous one was sent.
+
+    Args:
+        request (Request): The request, checked for disconnection.
+        create_iterator (Callable): Called with the `on_stage` callback, returns the chat generator.
+        stream (str): "ndjson" or "sse".
+    """
+    loop = asyncio.get_running_loop()
+    stages = asyncio.Queue()
+
+    def on_stage(stage: str, **detail) -> None:
+        loop.call_soon_threadsafe(stages.put_nowait, {"stage": stage, **detail})
+
+    iterator = create_iterator(on_stage)
+    pending = None
+    yield encode_event(stream, "start")
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(run_in_threadpool(next_chunk, iterator))
+            stage = asyncio.ensure_future(stages.get())
+            done, _ = await asyncio.wait(
+                {pending, stage},
+                timeout=STREAM_KEEPALIVE,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not stage.done():
+                stage.cancel()
+            if await request.is_disconnected():
+                logger.info("Client disconnected, stop streaming")
+                break
+
+            if stage.done() and not stage.cancelled():
+                event = ("stage", stage.result())
+            elif pending.done():
+                chunk, pending = pending.result(), None
+                if chunk is _STREAM_END:
+                    yield encode_event(stream, "done")
+                    break
+                event = ("token", {"content": chunk})
+            else:
+                event = ("ping", {})
+
+            start_time = time.monotonic()
+            yield encode_event(stream, event[0], **event[1])
+            if time.monotonic() - start_time > STREAM_STALL_TIMEOUT:
+                logger.warning("Client too slow, stop streaming")
+                break
+    except Exception as e:
+        logger.error(f"Chat stream failed: {str(e)}")
+        yield encode_event(stream, "error", messages=str(e))
+    finally:
+        with anyio.CancelScope(shield=True):
+            # A generator can not be closed while a thread runs it.
+            if pending is not None:
+                await asyncio.wait({pending})
+            await run_in_threadpool(iterator.close)
+
+
+USAGE_FLUSH = 30.0
+
+
+async def flush_usage_loop():
+    while True:
+        await asyncio.sleep(USAGE_FLUSH)
+        try:
+            await asyncio.to_thread(accountant.flush)
+        except Exception as e:
+            logger.error(f"Can not flush usage: {str(e)}")
+
+
+GAUGES_REFRESH = 5.0
+
+
+async def refresh_gauges_loop():
+    # Every worker publishes its own gauges, `/metrics` merges them.
+    while True:
+        await asyncio.to_thread(refresh_gauges)
+        await asyncio.sleep(GAUGES_REFRESH)
+
+
+register_gauge(
+    "scheduler_in_flight",
+    "Generations running per priority class.",
+    lambda: {
+        (priority,): generation_scheduler.class_in_flight[priority]
+        for priority in generation_scheduler.priorities
+    },
+    labelnames=("priority",),
+)
+register_gauge(
+    "scheduler_queue_depth",
+    "Generations waiting for a slot per priority class.",
+    lambda: {
+        (priority,): generation_scheduler.stats()[priority]["queue_depth"]
+        for priority in generation_scheduler.priorities
+    },
+    labelnames=("priority",),
+)
+register_gauge(
+    "ollama_backend_outstanding",
+    "Requests running on each Ollama backend.",
+    lambda: {(backend["url"],): backend["outstanding"] for backend in ollama_backends.stats()},
+    labelnames=("backend",),
+)
+register_gauge(
+    "ollama_backend_healthy",
+    "1 when the Ollama backend is in the pool.",
+    lambda: {(backend["url"],): int(backend["healthy"]) for backend in ollama_backends.stats()},
+    labelnames=("backend",),
+    multiprocess_mode="livemin",
+)
+register_gauge(
+    "single_flight_running",
+    "Shared generations running.",
+    lambda: agent.single_flight.stats()["running"],
+)
+register_gauge(
+    "circuit_breaker_open",
+    "1 when the dependency answers with its fallback.",
+    lambda: {(name,): int(breaker.degraded) for name, breaker in agent.breakers.items()},
+    labelnames=("dependency",),
+    multiprocess_mode="livemax",
+)
+register_gauge(
+    "token_budget",
+    "Current max_tokens per generation profile.",
+    lambda: {(name,): budget["budget"] for name, budget in agent.token_budget.stats().items()},
+    labelnames=("profile",),
+    multiprocess_mode="liveall",
+)
+register_gauge(
+    "log_queue_dropped",
+    "Log records dropped because the log queue was full.",
+    lambda: get_log_stats()["dropped"],
+)
+
+profiler = SamplingProfiler()
+
+
+def is_admin(request: Request) -> bool:
+    token = request.headers.get("x-admin-token", "")
+    return bool(connect_handler.ADMIN_TOKEN) and hmac.compare_digest(
+        token.encode("utf-8"), connect_handler.ADMIN_TOKEN.encode("utf-8")
+    )
+
+
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(PrometheusMiddleware)
 
 
 @app.post("/chat/", tags=["Chat"])
 def chat(
+    request: Request,
     username: str = Form(...),
     department: str = Form(...),
     prompt: Optional[str] = Form(None),
     friendly: Optional[str] = Form(None),
+    stream: str = Form("text"),
 ):
     request_data = schema.PostChat(
-        username=username, department=department, prompt=prompt, friendly=friendly
+        username=username,
+        department=department,
+        prompt=prompt,
+        friendly=friendly,
+        stream=stream,
     )
     logger.info(f"user prompt : {prompt}")
 
-    return StreamingResponse(
-        content=agent.chat(
-            log=user_handler.get(
-                username=request_data.username, department=request_data.department
+    if not models_ready():
+        return Response(
+            content=json.dumps({"messages": "Models are still loading."}),
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": "5"},
+            media_type="application/json",
+        )
+
+    try:
+        generation_scheduler.check_queue_space()
+    except SchedulerRejected as e:
+        logger.warning(f"Reject chat: {str(e)}")
+        return Response(
+            content=json.dumps({"messages": str(e)}),
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": "5"},
+            media_type="application/json",
+        )
+
+    log = user_handler.get(
+        username=request_data.username, department=request_data.department
+    )
+
+    def create_iterator(on_stage=None):
+        return accountant.track(
+            count_active_chat(
+                agent.chat(
+                    log=log,
+                    prompt=request_data.prompt,
+                    friendly=request_data.friendly,
+                    on_stage=on_stage,
+                )
             ),
-            prompt=request_data.prompt,
-            friendly=request_data.friendly,
-        ),
-        media_type="text/plain",
+            department=request_data.department,
+            username=request_data.username,
+        )
+
+    if request_data.stream == "text":
+        content = stream_until_disconnect(request=request, iterator=create_iterator())
+        headers = None
+    else:
+        content = stream_events(
+            request=request, create_iterator=create_iterator, stream=request_data.stream
+        )
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+    return StreamingResponse(
+        content=content,
+        headers=headers,
+        media_type=STREAM_MEDIA_TYPES[request_data.stream],
     )
 
 
@@ -191,7 +663,7 @@ def report(request_data: schema.PostReport):
         log = user_handler.get(
             username=request_data.username, department=request_data.department
         )
-        log.info(f"User feedback : '{request_data.feedback}'")
+        log.feedback("User feedback : '%s'", request_data.feedback)
     except BaseException as e:
         return Response(
             content=json.dumps({"messages": str(e)}),
@@ -210,8 +682,15 @@ def report(request_data: schema.PostReport):
 
 
 @app.get("/status/", tags=["Status"])
-async def get_status(_id: str):
-    progress = tasks_status.get(_id)
+async def get_status(_id: str, wait: float = 0):
+    with progress_bus.subscribe(task_id=_id) as queue:
+        progress = await asyncio.to_thread(task_tracker.get, _id)
+        if wait > 0 and progress and progress.get("task") is not True:
+            try:
+                progress = await asyncio.wait_for(queue.get(), timeout=wait)
+            except TimeoutError:
+                pass
+
     if not progress:
         progress = dict()
     return Response(
@@ -221,28 +700,352 @@ async def get_status(_id: str):
     )
 
 
-@app.post("/upload/", tags=["Upload"])
-async def upload(
-    background_tasks: BackgroundTasks,
-    files: List[UploadFile] = File(...),
-    username: str = Form(...),
-    department: str = Form(...),
+@app.get("/health", tags=["Status"])
+def get_health():
+    # Liveness: the process serves requests, models may still be loading.
+    return Response(
+        content=json.dumps({"status": "alive"}),
+        status_code=status.HTTP_200_OK,
+        media_type="application/json",
+    )
+
+
+@app.get("/ready", tags=["Status"])
+def get_ready():
+    # Readiness: every model is loaded and chats can be served.
+    # Degraded dependencies do not make the worker unready, chats still
+    # answer with their fallbacks.
+    ready = models_ready()
+    return Response(
+        content=json.dumps(
+            {
+                "ready": ready,
+                "models": warmup_models_status,
+                "degraded": agent.degraded(),
+            }
+        ),
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        media_type="application/json",
+    )
+
+
+@app.get("/scheduler/", tags=["Status"])
+def get_scheduler_status():
+    return Response(
+        content=json.dumps(
+            {
+                **generation_scheduler.stats(),
+                "single_flight": agent.single_flight.stats(),
+                "token_budget": agent.token_budget.stats(),
+            }
+        ),
+        status_code=status.HTTP_200_OK,
+        media_type="application/json",
+    )
+
+
+@app.get("/breakers/", tags=["Status"])
+def get_breakers_status():
+    return Response(
+        content=json.dumps(
+            {name: breaker.stats() for name, breaker in agent.breakers.items()}
+        ),
+        status_code=status.HTTP_200_OK,
+        media_type="application/json",
+    )
+
+
+@app.get("/metrics", tags=["Status"])
+def get_metrics():
+    content, media_type = render_metrics()
+    return Response(content=content, status_code=status.HTTP_200_OK, media_type=media_type)
+
+
+@app.get("/traces/", tags=["Status"])
+def get_traces_status():
+    # Per stage latency, empty while TRACING is off.
+    return Response(
+        content=json.dumps(span_stats()),
+        status_code=status.HTTP_200_OK,
+        media_type="application/json",
+    )
+
+
+@app.get("/backends/", tags=["Status"])
+def get_backends_status():
+    return Response(
+        content=json.dumps(ollama_backends.stats()),
+        status_code=status.HTTP_200_OK,
+        media_type="application/json",
+    )
+
+
+@app.get("/admin/profile", tags=["Admin"])
+async def profile(
+    request: Request, seconds: float = 10.0, mode: str = "wall", interval: float = 0.01
+):
+    if not is_admin(request):
+        return Response(
+            content=json.dumps({"messages": "Admin token required."}),
+            status_code=status.HTTP_403_FORBIDDEN,
+            media_type="application/json",
+        )
+
+    try:
+        result = await asyncio.to_thread(
+            profiler.run, seconds, mode, interval, asyncio.get_running_loop()
+        )
+    except ValueError as e:
+        return Response(
+            content=json.dumps({"messages": str(e)}),
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            media_type="application/json",
+        )
+    except ProfilerBusy as e:
+        return Response(
+            content=json.dumps({"messages": str(e)}),
+            status_code=status.HTTP_409_CONFLICT,
+            media_type="application/json",
+        )
+
+    return Response(
+        content=result["collapsed"],
+        status_code=status.HTTP_200_OK,
+        headers={
+            "Content-Disposition": f'attachment; filename="profile-{mode}-{os.getpid()}.collapsed"',
+            "X-Profile-Samples": str(result["samples"]),
+        },
+        media_type="text/plain",
+    )
+
+
+@app.get("/admin/usage", tags=["Admin"])
+def usage(
+    request: Request,
+    department: str | None = None,
+    username: str | None = None,
+    days: int = 7,
+    group_by: str = "department",
 ):
-    request_data = schema.PostUpload(
-        files=files, username=username, department=department
+    if not is_admin(request):
+        return Response(
+            content=json.dumps({"messages": "Admin token required."}),
+            status_code=status.HTTP_403_FORBIDDEN,
+            media_type="application/json",
+        )
+
+    # Usage of the other workers is at most `USAGE_FLUSH` seconds old.
+    accountant.flush()
+    try:
+        result = accountant.query(
+            department=department, username=username, days=days, group_by=group_by
+        )
+    except ValueError as e:
+        return Response(
+            content=json.dumps({"messages": str(e)}),
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            media_type="application/json",
+        )
+
+    return Response(
+        content=json.dumps(result),
+        status_code=status.HTTP_200_OK,
+        media_type="application/json",
+    )
+
+
+@app.post("/upload/", tags=["Upload"])
+async def upload(request: Request):
+    upload_root = Path(__file__).resolve().parent / SAVE_PATH
+
+    try:
+        staged = await async_stream_multi_files(
+            request=request,
+            staging_dir=upload_root / ".incoming",
+            max_file_size=MAX_UPLOAD_FILE_SIZE,
+            max_request_size=MAX_UPLOAD_REQUEST_SIZE,
+        )
+    except UploadTooLargeError as e:
+        UPLOAD_FILES.labels("too_large").inc()
+        return Response(
+            content=json.dumps({"messages": str(e)}),
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            media_type="application/json",
+        )
+    except UploadFormatError as e:
+        UPLOAD_FILES.labels("invalid").inc()
+        return Response(
+            content=json.dumps({"messages": str(e)}),
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            media_type="application/json",
+        )
+
+    try:
+        if not staged.fields.get("username") or not staged.fields.get("department"):
+            raise UploadFormatError("Form fields 'username' and 'department' are required.")
+        request_data = schema.PostUploadStream(
+            username=staged.fields["username"], department=staged.fields["department"]
+        )
+    except UploadFormatError as e:
+        for file in staged.files:
+            file.path.unlink(missing_ok=True)
+        return Response(
+            content=json.dumps({"messages": str(e)}),
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            media_type="application/json",
+        )
+    except BaseException:
+        for file in staged.files:
+            file.path.unlink(missing_ok=True)
+        raise
+
+    save_dir = upload_root / f"{request_data.department}_{request_data.username}"
+    await asyncio.to_thread(commit_staged_files, staged.files, save_dir, task_tracker)
+    accountant.record(
+        department=request_data.department,
+        username=request_data.username,
+        upload_bytes=sum(file.size for file in staged.files),
+    )
+    logger.info(f"Upload {len(staged.files)} files to '{save_dir.name}'")
+
+    return Response(
+        content=json.dumps({"task_id": f"{save_dir.name}"}),
+        status_code=status.HTTP_200_OK,
+        media_type="application/json",
     )
 
-    current_file_path = Path(__file__).resolve().parent
+
+@app.post("/upload/session/", tags=["Upload"])
+def upload_session_init(request_data: schema.PostUploadInit):
+    try:
+        session = upload_session_handler.init(
+            username=request_data.username,
+            department=request_data.department,
+            filename=request_data.filename,
+            size=request_data.size,
+            sha256=request_data.sha256,
+        )
+    except UploadSessionError as e:
+        return Response(
+            content=json.dumps({"messages": str(e)}),
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            media_type="application/json",
+        )
+
+    return Response(
+        content=json.dumps(session),
+        status_code=status.HTTP_200_OK,
+        media_type="application/json",
+    )
+
+
+@app.get("/upload/session/{upload_id}", tags=["Upload"])
+def upload_session_status(upload_id: str):
+    try:
+        session = upload_session_handler.status(upload_id=upload_id)
+    except UploadSessionBusy as e:
+        return Response(
+            content=json.dumps({"messages": str(e)}),
+            status_code=status.HTTP_409_CONFLICT,
+            media_type="application/json",
+        )
+    except UploadSessionError as e:
+        return Response(
+            content=json.dumps({"messages": str(e)}),
+            status_code=status.HTTP_404_NOT_FOUND,
+            media_type="application/json",
+        )
+
+    return Response(
+        content=json.dumps(session),
+        status_code=status.HTTP_200_OK,
+        media_type="application/json",
+    )
+
+
+@app.put("/upload/session/{upload_id}/{index}", tags=["Upload"])
+async def upload_session_part(upload_id: str, index: int, request: Request):
+    sha256 = request.headers.get("x-part-sha256")
+    if not sha256:
+        return Response(
+            content=json.dumps({"messages": "Header 'X-Part-SHA256' is required."}),
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            media_type="application/json",
+        )
+
+    try:
+        part = await upload_session_handler.write_part(
+            upload_id=upload_id, index=index, stream=request.stream(), sha256=sha256
+        )
+    except UploadSessionNotFound as e:
+        return Response(
+            content=json.dumps({"messages": str(e)}),
+            status_code=status.HTTP_404_NOT_FOUND,
+            media_type="application/json",
+        )
+    except UploadSessionBusy as e:
+        return Response(
+            content=json.dumps({"messages": str(e)}),
+            status_code=status.HTTP_409_CONFLICT,
+            media_type="application/json",
+        )
+    except UploadSessionError as e:
+        return Response(
+            content=json.dumps({"messages": str(e)}),
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            media_type="application/json",
+        )
+
+    return Response(
+        content=json.dumps(part),
+        status_code=status.HTTP_200_OK,
+        media_type="application/json",
+    )
+
+
+@app.post("/upload/session/{upload_id}/complete", tags=["Upload"])
+async def upload_session_complete(upload_id: str):
+    try:
+        session, path, sha256 = await asyncio.to_thread(
+            upload_session_handler.complete, upload_id
+        )
+    except UploadSessionNotFound as e:
+        return Response(
+            content=json.dumps({"messages": str(e)}),
+            status_code=status.HTTP_404_NOT_FOUND,
+            media_type="application/json",
+        )
+    except UploadSessionBusy as e:
+        return Response(
+            content=json.dumps({"messages": str(e)}),
+            status_code=status.HTTP_409_CONFLICT,
+            media_type="application/json",
+        )
+    except UploadSessionError as e:
+        return Response(
+            content=json.dumps({"messages": str(e)}),
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            media_type="application/json",
+        )
+
     save_dir = (
-        current_file_path
+        Path(__file__).resolve().parent
         / SAVE_PATH
-        / f"{request_data.department}_{request_data.username}"
+        / f"{session['department']}_{session['username']}"
     )
-    save_dir.mkdir(parents=True, exist_ok=True)
-
-    background_tasks.add_task(
-        async_write_multi_files, request_data.files, save_dir, CHUNK_SIZE
+    staged = StagedFile(
+        filename=session["filename"], path=path, size=session["size"], sha256=sha256
+    )
+    try:
+        await asyncio.to_thread(commit_staged_files, [staged], save_dir, task_tracker)
+    finally:
+        upload_session_handler.discard(upload_id=upload_id)
+    accountant.record(
+        department=session["department"],
+        username=session["username"],
+        upload_bytes=session["size"],
     )
+    logger.info(f"Complete upload session '{upload_id}' to '{save_dir.name}'")
 
     return Response(
         content=json.dumps({"task_id": f"{save_dir.name}"}),
@@ -251,30 +1054,81 @@ async def upload(
     )
 
 
+@app.post("/ingest/", tags=["Upload"])
+def ingest(request_data: schema.PostIngest):
+    task_id = f"{request_data.department}_{request_data.username}"
+    if not (Path(__file__).resolve().parent / SAVE_PATH / task_id).is_dir():
+        return Response(
+            content=json.dumps({"messages": f"Task '{task_id}' has no uploaded files."}),
+            status_code=status.HTTP_404_NOT_FOUND,
+            media_type="application/json",
+        )
+
+    job_id = ingestion_service.enqueue(
+        task_id=task_id,
+        tenant=request_data.department,
+        recreate=request_data.recreate,
+        priority=PRIORITY_REINDEX if request_data.reindex else PRIORITY_INGEST,
+    )
+    return Response(
+        content=json.dumps({"task_id": task_id, "job_id": job_id}),
+        status_code=status.HTTP_200_OK,
+        media_type="application/json",
+    )
+
+
 @app.websocket("/ws/{task_id}")
 async def websocket(websocket: WebSocket, task_id: str):
     await websocket.accept()
-    previous_filename = None
 
+    receive = None
     try:
-        while True:
-            progress = tasks_status.get(task_id)
-            if progress is None:
-                break
-            if progress["filename"] != previous_filename:
-                try:
-                    await websocket.send_json(progress)
-                    previous_filename = progress["filename"]
-                except BaseException:
+        with progress_bus.subscribe(task_id=task_id) as queue:
+            progress = await asyncio.to_thread(task_tracker.get, task_id)
+            while progress is not None:
+                await websocket.send_json(progress)
+                if progress["task"] is True:
                     break
-            if progress["task"] is True:
-                break
 
-            await asyncio.sleep(0.1)
+                # Wake up on the next update, or when the client goes away. Tasks
+                # run by another worker are not on this bus, re-read them from the
+                # store every `TASK_REFRESH` seconds. Client messages are only
+                # keep-alives and are ignored.
+                latest = None
+                while latest is None:
+                    update = asyncio.ensure_future(queue.get())
+                    if receive is None:
+                        receive = asyncio.ensure_future(websocket.receive())
+                    done, _ = await asyncio.wait(
+                        {update, receive},
+                        timeout=TASK_REFRESH,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    if update not in done:
+                        update.cancel()
+                    if receive in done:
+                        message = receive.result()
+                        receive = None
+                        if message["type"] == "websocket.disconnect":
+                            return
+                    if update in done:
+                        latest = update.result()
+                    elif not done:
+                        latest = await asyncio.to_thread(task_tracker.get, task_id)
+                        if latest is None:
+                            return
+                        if latest["update_time"] == progress["update_time"]:
+                            latest = None
+                progress = latest
     except WebSocketDisconnect:
-        print(f"WebSocket connection closed for task: {task_id}")
+        logger.info(f"WebSocket connection closed for task: {task_id}")
+    except Exception as e:
+        logger.warning(f"WebSocket for task '{task_id}' stopped: {str(e)}")
     finally:
-        await websocket.close()
+        if receive is not None:
+            receive.cancel()
+        if websocket.client_state != WebSocketState.DISCONNECTED:
+            await websocket.close()
 
 
 if __name__ == "__main__":
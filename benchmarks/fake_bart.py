@@ -0,0 +1,62 @@
+"""
+Stand-in for the BART topic classification server.
+
+`/model` reports the model as loaded, `/topic` answers after a fixed
+latency with the first `top_k` topics, rotated by a hash of the sentence.
+
+Usage:
+    python -m benchmarks.fake_bart --port 8887 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import hashlib
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+class FakeSettings:
+    model_name: str = "bart"
+    latency: float = 0.05
+
+
+settings = FakeSettings()
+app = FastAPI()
+
+
+@app.get("/model")
+async def model():
+    return JSONResponse({"name": settings.model_name, "is_loaded": True})
+
+
+@app.post("/topic")
+async def topic(request: Request):
+    data = await request.json()
+    topics = data.get("topics", [])
+    top_k = data.get("top_k", 3)
+    await asyncio.sleep(settings.latency)
+    if not topics:
+        return JSONResponse({"topics": []})
+    digest = hashlib.sha256(data.get("sentence", "").encode("utf-8")).digest()
+    shift = digest[0] % len(topics)
+    ranked = topics[shift:] + topics[:shift]
+    return JSONResponse({"topics": ranked[:top_k]})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8887)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--model-name", default="bart")
+    args = parser.parse_args()
+
+    settings.latency = args.latency
+    settings.model_name = args.model_name
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Stand-in for the Ollama api, to load test the service without GPUs.
+
+`/api/chat` and `/api/generate` stream tokens at a fixed rate after a
+prefill delay, `/api/embed` returns deterministic embeddings, `/api/pull`
+and `/api/tags` fake the model registry. The final chunk carries the same
+`eval_count` / `eval_duration` / `done_reason` fields as Ollama, so token
+budgets and tracing see realistic values.
+
+Usage:
+    python -m benchmarks.fake_ollama --port 11434 --tokens-per-second 40 --ttft 0.3
+    python -m benchmarks.fake_ollama --write-seed benchmarks/seed.json --seed-docs 500
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+from datetime import UTC, datetime
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+EMBEDDING_DIMENSION = 384
+WORDS = (
+    "the industrial SSD supports wide temperature operation and power loss "
+    "protection with a three year warranty contact sales for volume pricing"
+).split()
+
+
+class FakeSettings:
+    tokens_per_second: float = 40.0
+    ttft: float = 0.3
+    answer_tokens: int = 200
+    embed_latency: float = 0.01
+    pull_seconds: float = 0.5
+
+
+settings = FakeSettings()
+# Filled by `/api/pull`, so the warmup goes through the pull path too.
+models = set()
+app = FastAPI()
+
+
+def fake_embedding(text: str, dimension: int = EMBEDDING_DIMENSION) -> list:
+    """
+    A unit vector derived from the text, the same text always gives the same vector.
+
+    Args:
+        text (str): The text to embed.
+        dimension (int, optional): The vector size. Defaults to 384.
+
+    Returns:
+        list: The embedding.
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimension)]
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector]
+
+
+def _model_name(name: str) -> str:
+    return name if ":" in name else f"{name}:latest"
+
+
+def _now() -> str:
+    return datetime.now(UTC).isoformat()
+
+
+def _num_predict(data: dict) -> int:
+    options = data.get("options") or {}
+    return min(settings.answer_tokens, options.get("num_predict", settings.answer_tokens))
+
+
+def _prompt_tokens(data: dict) -> int:
+    text = data.get("prompt", "") + "".join(
+        message.get("content", "") for message in data.get("messages", [])
+    )
+    return max(1, len(text) // 4)
+
+
+def _final(data: dict, eval_count: int, eval_duration: float) -> dict:
+    return {
+        "model": data.get("model"),
+        "created_at": _now(),
+        "done": True,
+        # Answers shorter than the natural length were cut by `num_predict`.
+        "done_reason": "length" if eval_count < settings.answer_tokens else "stop",
+        "total_duration": int((settings.ttft + eval_duration) * 1e9),
+        "prompt_eval_count": _prompt_tokens(data),
+        "prompt_eval_duration": int(settings.ttft * 1e9),
+        "eval_count": eval_count,
+        "eval_duration": int(eval_duration * 1e9),
+    }
+
+
+async def _tokens(data: dict, field: str):
+    """
+    Yield the ndjson chunks of one generation, paced like a real model.
+    """
+    await asyncio.sleep(settings.ttft)
+    count = _num_predict(data)
+    interval = 1.0 / settings.tokens_per_second
+    start_time = time.perf_counter()
+    for index in range(count):
+        word = WORDS[index % len(WORDS)] + " "
+        if field == "message":
+            chunk = {"message": {"role": "assistant", "content": word}}
+        else:
+            chunk = {"response": word}
+        yield json.dumps(
+            {"model": data.get("model"), "created_at": _now(), **chunk, "done": False}
+        ) + "\n"
+        # Sleep until the planned time of the next token so the rate holds.
+        delay = start_time + (index + 1) * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    final = _final(data, count, time.perf_counter() - start_time)
+    if field == "message":
+        final["message"] = {"role": "assistant", "content": ""}
+    else:
+        final["response"] = ""
+    yield json.dumps(final) + "\n"
+
+
+async def _generation(request: Request, field: str):
+    data = await request.json()
+    # A call without prompt only loads or unloads the model.
+    if field == "response" and not data.get("prompt"):
+        return JSONResponse(
+            {"model": data.get("model"), "created_at": _now(), "response": "", "done": True}
+        )
+    if data.get("stream", True):
+        return StreamingResponse(
+            _tokens(data, field), media_type="application/x-ndjson"
+        )
+
+    content = ""
+    final = None
+    async for line in _tokens(data, field):
+        chunk = json.loads(line)
+        if chunk["done"]:
+            final = chunk
+        else:
+            content += chunk[field]["content"] if field == "message" else chunk[field]
+    if field == "message":
+        final["message"]["content"] = content
+    else:
+        final["response"] = content
+    return JSONResponse(final)
+
+
+@app.post("/api/chat")
+async def chat(request: Request):
+    return await _generation(request, "message")
+
+
+@app.post("/api/generate")
+async def generate(request: Request):
+    return await _generation(request, "response")
+
+
+@app.post("/api/embed")
+async def embed(request: Request):
+    data = await request.json()
+    inputs = data.get("input", "")
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    await asyncio.sleep(settings.embed_latency * len(inputs))
+    return JSONResponse(
+        {"model": data.get("model"), "embeddings": [fake_embedding(text) for text in inputs]}
+    )
+
+
+@app.post("/api/embeddings")
+async def embeddings(request: Request):
+    data = await request.json()
+    await asyncio.sleep(settings.embed_latency)
+    return JSONResponse({"embedding": fake_embedding(data.get("prompt", ""))})
+
+
+@app.post("/api/pull")
+async def pull(request: Request):
+    data = await request.json()
+    name = _model_name(data.get("name") or data.get("model", ""))
+
+    async def progress():
+        yield json.dumps({"status": "pulling manifest"}) + "\n"
+        await asyncio.sleep(settings.pull_seconds)
+        models.add(name)
+        yield json.dumps({"status": "success"}) + "\n"
+
+    return StreamingResponse(progress(), media_type="application/x-ndjson")
+
+
+@app.get("/api/tags")
+async def tags():
+    return JSONResponse(
+        {"models": [{"name": name, "model": name} for name in sorted(models)]}
+    )
+
+
+@app.get("/api/version")
+async def version():
+    return JSONResponse({"version": "0.0.0-fake"})
+
+
+def write_seed(path: str, count: int) -> None:
+    """
+    Write documents embedded like `/api/embed` for `VECTOR_STORE_SEED`.
+
+    Args:
+        path (str): The JSON file to write.
+        count (int): Number of documents.
+    """
+    rng = random.Random(0)
+    documents = []
+    for index in range(count):
+        content = " ".join(rng.choice(WORDS) for _ in range(60))
+        documents.append(
+            {
+                "id": f"seed-{index}",
+                "content": content,
+                "embedding": fake_embedding(content),
+                "meta": {"privacy": "0", "source": f"seed-{index % 10}.pdf"},
+            }
+        )
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(documents, f)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--ttft", type=float, default=0.3, help="Prefill delay in seconds.")
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--embed-latency", type=float, default=0.01)
+    parser.add_argument("--write-seed", help="Write a vector store seed file and exit.")
+    parser.add_argument("--seed-docs", type=int, default=500)
+    args = parser.parse_args()
+
+    if args.write_seed:
+        write_seed(path=args.write_seed, count=args.seed_docs)
+        return
+
+    settings.tokens_per_second = args.tokens_per_second
+    settings.ttft = args.ttft
+    settings.answer_tokens = args.answer_tokens
+    settings.embed_latency = args.embed_latency
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
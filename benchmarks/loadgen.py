@@ -0,0 +1,290 @@
+"""
+Drive the service with concurrent clients and report latency as JSON.
+
+Every scenario runs `--concurrency` clients in a loop for `--duration`
+seconds:
+    chat: POST /chat/ and read the streamed answer, records TTFT and latency.
+    upload: POST /upload/ with a small PDF.
+    ws: upload a task, then follow its live progress on /ws/{task_id} until
+        it reports done (the upload is not part of the latency).
+
+The report has p50 / p95 / p99 latency, TTFT and RPS per scenario, with the
+git commit, so runs can be compared between commits. With `--baseline` the
+relative change against an earlier report is added.
+
+Run the service against the stand-ins for an offline benchmark:
+    python -m benchmarks.fake_ollama --write-seed benchmarks/seed.json
+    python -m benchmarks.fake_ollama --port 11434 &
+    python -m benchmarks.fake_bart --port 8887 &
+    OLLAMA_HOSTS=127.0.0.1:11434 BART_HOST=127.0.0.1 VECTOR_STORE=memory \\
+        VECTOR_STORE_SEED=benchmarks/seed.json uvicorn app:app --port 8007 &
+
+Usage:
+    python -m benchmarks.loadgen --url http://127.0.0.1:8007 --scenarios chat,upload,ws --concurrency 8 --duration 30 --output report.json
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import time
+
+import httpx
+import websockets
+
+PROMPTS = [
+    "What is 3TE7?",
+    "How long is the warranty of the industrial SSD?",
+    "Who can I contact for volume pricing?",
+    "Does it support power loss protection?",
+    "Which temperature range does it support?",
+]
+PDF_BYTES = b"%PDF-1.4\n1 0 obj<<>>endobj\ntrailer<<>>\n%%EOF\n" + b"0" * 1024 * 64
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class Recorder:
+    """
+    Latency samples and errors of one scenario.
+    """
+
+    def __init__(self) -> None:
+        self.latencies = []
+        self.ttfts = []
+        self.errors = dict()
+
+    def error(self, reason: str) -> None:
+        self.errors[reason] = self.errors.get(reason, 0) + 1
+
+    def report(self, elapsed: float) -> dict:
+        result = {
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "rps": len(self.latencies) / elapsed if elapsed else 0.0,
+        }
+        for name, values in (("latency", self.latencies), ("ttft", self.ttfts)):
+            if values:
+                result[name] = {
+                    "p50": percentile(values, 0.50),
+                    "p95": percentile(values, 0.95),
+                    "p99": percentile(values, 0.99),
+                    "max": max(values),
+                }
+        return result
+
+
+async def register(client: httpx.AsyncClient, user: dict) -> None:
+    response = await client.post("/submit/", json=user)
+    response.raise_for_status()
+
+
+async def chat_once(
+    client: httpx.AsyncClient, user: dict, index: int, recorder: Recorder
+) -> None:
+    data = {**user, "prompt": PROMPTS[index % len(PROMPTS)], "stream": "text"}
+    start_time = time.perf_counter()
+    ttft = None
+    async with client.stream("POST", "/chat/", data=data) as response:
+        if response.status_code != 200:
+            await response.aread()
+            recorder.error(f"status_{response.status_code}")
+            return
+        async for chunk in response.aiter_text():
+            if ttft is None and chunk.strip():
+                ttft = time.perf_counter() - start_time
+            if "Error occurred:" in chunk:
+                recorder.error("stream_error")
+                return
+    recorder.latencies.append(time.perf_counter() - start_time)
+    if ttft is not None:
+        recorder.ttfts.append(ttft)
+
+
+async def upload_once(
+    client: httpx.AsyncClient, user: dict, index: int, recorder: Recorder
+) -> str:
+    start_time = time.perf_counter()
+    response = await client.post(
+        "/upload/",
+        data=user,
+        files={"files": (f"bench-{index}.pdf", PDF_BYTES, "application/pdf")},
+    )
+    if response.status_code != 200:
+        recorder.error(f"status_{response.status_code}")
+        return None
+    recorder.latencies.append(time.perf_counter() - start_time)
+    return response.json()["task_id"]
+
+
+async def ws_once(ws_url: str, task_id: str, recorder: Recorder) -> None:
+    start_time = time.perf_counter()
+    async with websockets.connect(f"{ws_url}/ws/{task_id}") as ws:
+        first = True
+        async for message in ws:
+            if first:
+                first = False
+                recorder.ttfts.append(time.perf_counter() - start_time)
+            if json.loads(message).get("task") is True:
+                recorder.latencies.append(time.perf_counter() - start_time)
+                return
+    recorder.error("closed_early")
+
+
+async def run_scenario(
+    url: str, scenario: str, concurrency: int, duration: float, timeout: float
+) -> dict:
+    """
+    Run one scenario with concurrent clients.
+
+    Args:
+        url (str): Base url of the service.
+        scenario (str): "chat", "upload" or "ws".
+        concurrency (int): Number of clients.
+        duration (float): Seconds to run.
+        timeout (float): Timeout of one request in seconds.
+
+    Returns:
+        dict: The scenario report.
+    """
+    recorder = Recorder()
+    ws_url = url.replace("http://", "ws://", 1)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        users = [
+            {"username": f"bench{index}", "department": f"bench{index}"}
+            for index in range(concurrency)
+        ]
+        await asyncio.gather(*(register(client, user) for user in users))
+
+        # Uploads made to feed the ws scenario, not part of its report.
+        setup = Recorder()
+        deadline = time.monotonic() + duration
+
+        async def worker(number: int) -> None:
+            index = 0
+            while time.monotonic() < deadline:
+                try:
+                    if scenario == "chat":
+                        await chat_once(client, users[number], index, recorder)
+                    elif scenario == "upload":
+                        await upload_once(client, users[number], index, recorder)
+                    else:
+                        # A fresh task per iteration: a finished task only
+                        # sends its final snapshot, not the live progress.
+                        task_id = await upload_once(client, users[number], index, setup)
+                        if task_id is None:
+                            recorder.error("upload_failed")
+                        else:
+                            await asyncio.wait_for(
+                                ws_once(ws_url, task_id, recorder), timeout
+                            )
+                except (httpx.HTTPError, OSError, websockets.WebSocketException) as e:
+                    recorder.error(type(e).__name__)
+                except TimeoutError:
+                    recorder.error("timeout")
+                index += 1
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*(worker(number) for number in range(concurrency)))
+        elapsed = time.perf_counter() - start_time
+
+    return {"concurrency": concurrency, "duration": elapsed, **recorder.report(elapsed)}
+
+
+async def wait_ready(url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url, timeout=5.0) as client:
+        while True:
+            try:
+                if (await client.get("/ready")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Service not ready after {timeout}s")
+            await asyncio.sleep(1.0)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    """
+    Relative change of RPS and p95 latency / TTFT against a baseline report.
+    """
+    change = dict()
+    for scenario, result in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(scenario)
+        if not base:
+            continue
+        change[scenario] = dict()
+        if base.get("rps"):
+            change[scenario]["rps"] = result["rps"] / base["rps"] - 1
+        for name in ("latency", "ttft"):
+            if result.get(name) and base.get(name) and base[name]["p95"]:
+                change[scenario][f"{name}_p95"] = result[name]["p95"] / base[name]["p95"] - 1
+    return change
+
+
+async def run(args) -> dict:
+    await wait_ready(url=args.url, timeout=args.ready_timeout)
+    report = {
+        "commit": git_commit(),
+        "url": args.url,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scenarios": dict(),
+    }
+    for scenario in args.scenarios.split(","):
+        scenario = scenario.strip()
+        if scenario not in ("chat", "upload", "ws"):
+            raise ValueError(f"Unknown scenario '{scenario}'")
+        report["scenarios"][scenario] = await run_scenario(
+            url=args.url,
+            scenario=scenario,
+            concurrency=args.concurrency,
+            duration=args.duration,
+            timeout=args.timeout,
+        )
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8007")
+    parser.add_argument("--scenarios", default="chat,upload,ws")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--ready-timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="Also write the report to this file.")
+    parser.add_argument("--baseline", help="An earlier report to compare with.")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["change"] = compare(report=report, baseline=json.load(f))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Micro-benchmarks of the CPU work done on every chat request.
+
+Each case is timed with `timeit` (best of `--repeat` runs) on payloads of
+production size: prompt rendering, the `schema.py` validators, parsing a
+recorded Ollama stream with `Llama31Model.chat_stream`, log formatting and joining the retrieved documents. A case
+slower than its entry in `micro_thresholds.json` fails the run, so a CPU
+regression is caught before it costs cores.
+
+Usage:
+    python -m benchmarks.micro
+    python -m benchmarks.micro --filter prompt --repeat 7
+    python -m benchmarks.micro --update-thresholds
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import timeit
+from contextlib import nullcontext
+from pathlib import Path
+
+import httpx
+from haystack import Document
+from jinja2 import Template
+
+import schema
+from core.models.llama import Llama31Model
+from core.prompt import main as prompt_main
+from core.prompt.main import PromptEngineerService
+from tools.logger import config_logger
+
+THRESHOLDS_PATH = Path(__file__).with_name("micro_thresholds.json")
+# Thresholds written by `--update-thresholds` are the measured time times this.
+THRESHOLD_HEADROOM = 3.0
+
+# Sizes seen in production: a summary of a few turns, 10 retrieved chunks of
+# ~1 KB, and a 350 token answer streamed as one line per token.
+HISTORY = (
+    "The user introduces himself as jay and asks whether the assistant can help. "
+    "Jay sells 3TE7 industrial SSDs and asks about the warranty, the temperature "
+    "range and who to contact for volume pricing. "
+) * 5
+RETRIEVED = [
+    Document(
+        content=(
+            f"Chunk {index}: the 3TE7 industrial SSD supports wide temperature "
+            "operation from -40 to 85 C, power loss protection and a three year "
+            "warranty. Contact sales for volume pricing and project support. "
+        )
+        * 6,
+        meta={"privacy": "0", "source": f"datasheet-{index}.pdf"},
+    )
+    for index in range(10)
+]
+CHAT_HISTORY = {
+    topic: [
+        {"user": f"Question {turn} about {topic}?", "bot": HISTORY[:300]}
+        for turn in range(3)
+    ]
+    for topic in ("Product Information", "Pricing and Promotions", "After-sales Service")
+}
+STREAM_LINES = [
+    json.dumps(
+        {
+            "model": "llama3.1",
+            "created_at": "2024-08-01T08:00:00.000000Z",
+            "message": {"role": "assistant", "content": " token"},
+            "done": False,
+        }
+    )
+    for _ in range(350)
+] + [
+    json.dumps(
+        {
+            "model": "llama3.1",
+            "created_at": "2024-08-01T08:00:12.000000Z",
+            "message": {"role": "assistant", "content": ""},
+            "done": True,
+            "done_reason": "stop",
+            "prompt_eval_count": 900,
+            "eval_count": 350,
+            "eval_duration": 9_000_000_000,
+        }
+    )
+]
+STREAM_BODY = ("\n".join(STREAM_LINES) + "\n").encode("utf-8")
+CHAT_FORM = {
+    "username": "jay",
+    "department": "sales-team",
+    "prompt": "How long is the warranty of the 3TE7?",
+    "friendly": None,
+    "stream": "ndjson",
+}
+
+
+class _ReplayModel(Llama31Model):
+    """
+    Llama31Model reading a recorded Ollama stream instead of the network,
+    everything after the connection is the production code.
+    """
+
+    def _open_stream(self, backend, request_data: dict):
+        return nullcontext(
+            httpx.Response(
+                200, headers={"Transfer-Encoding": "chunked"}, content=STREAM_BODY
+            )
+        )
+
+
+def _quiet(logger: logging.Logger) -> None:
+    # Keep the console handler but send it nowhere, its formatting still counts.
+    for handler in logger.handlers:
+        if type(handler) is logging.StreamHandler:
+            handler.setStream(open(os.devnull, "w"))
+
+
+def setup_cases(log_folder: str) -> dict:
+    """
+    Build the benchmark cases.
+
+    Args:
+        log_folder (str): Folder of the log files written by the logging cases.
+
+    Returns:
+        dict: Case name to a function without arguments.
+    """
+    _quiet(prompt_main.LOGGER)
+    prompt_engineer = PromptEngineerService()
+    chat_template = prompt_engineer.registry.get("chat")
+    retrieval = "".join(doc.content for doc in RETRIEVED)
+
+    logger = config_logger(
+        log_name="micro.log",
+        logger_name="micro",
+        default_folder=log_folder,
+        write_mode="w",
+        level="debug",
+    )
+    _quiet(logger)
+    user_prompt = prompt_engineer.generate(
+        history=HISTORY, retrieval=retrieval, prompt=CHAT_FORM["prompt"]
+    )
+
+    replay_model = _ReplayModel(host="replay")
+    chat_request = {"model": "llama3.1", "messages": [], "stream": True}
+    chat_form = schema.PostChat(**CHAT_FORM)
+
+    def parse_stream() -> str:
+        return "".join(replay_model.chat_stream(request_data=chat_request))
+
+    return {
+        "prompt.generate": lambda: prompt_engineer.generate(
+            history=HISTORY, retrieval=retrieval, prompt=CHAT_FORM["prompt"]
+        ),
+        "prompt.summary_history": lambda: prompt_engineer.summary_history(
+            chat_history=CHAT_HISTORY
+        ),
+        "jinja.compile": lambda: Template(chat_template.source),
+        "jinja.render": lambda: chat_template.render(
+            instruction=None,
+            conversation_history=HISTORY,
+            retriever_info=retrieval,
+            question=CHAT_FORM["prompt"],
+        ),
+        "prompt.messages": lambda: prompt_engineer.messages(
+            user_prompt=user_prompt, friendly="Say hello to jay."
+        ),
+        "schema.post_chat": lambda: schema.PostChat(**CHAT_FORM),
+        "schema.post_chat_check": chat_form.check,
+        "stream.parse_answer": parse_stream,
+        "logging.prompt": lambda: logger.info("Get generate answer prompt : %s", user_prompt),
+        "logging.short": lambda: logger.info("User prompt: 'How long is the warranty?'."),
+        "retrieval.join": lambda: "".join(doc.content for doc in RETRIEVED),
+    }
+
+
+def measure(func, repeat: int) -> float:
+    """
+    Best time of one call in microseconds.
+
+    Args:
+        func (Callable): The case.
+        repeat (int): Number of timing runs.
+
+    Returns:
+        float: Microseconds per call.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", default="", help="Only run cases containing this text.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--update-thresholds", action="store_true")
+    parser.add_argument("--output", help="Also write the report to this file.")
+    args = parser.parse_args()
+
+    thresholds = (
+        json.loads(THRESHOLDS_PATH.read_text()) if THRESHOLDS_PATH.exists() else {}
+    )
+    report = {"cases": dict(), "regressions": []}
+    with tempfile.TemporaryDirectory() as log_folder:
+        for name, func in setup_cases(log_folder=log_folder).items():
+            if args.filter not in name:
+                continue
+            us = measure(func=func, repeat=args.repeat)
+            report["cases"][name] = {"us": round(us, 3), "threshold_us": thresholds.get(name)}
+            if name in thresholds and us > thresholds[name]:
+                report["regressions"].append(name)
+            if args.update_thresholds:
+                thresholds[name] = round(us * THRESHOLD_HEADROOM, 1)
+
+    if args.update_thresholds:
+        THRESHOLDS_PATH.write_text(json.dumps(thresholds, indent=2, sort_keys=True) + "\n")
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+    if report["regressions"] and not args.update_thresholds:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Compare the prefill time of the prompt layouts against a running Ollama.
+
+Every layout replays the same multi-turn conversation through `/api/chat`
+and records `prompt_eval_count` / `prompt_eval_duration` of each turn. With
+the "cache" layout Ollama reuses the KV cache of the static prefix, so the
+evaluated prompt tokens and the prefill time of the later turns drop.
+
+Usage:
+    python -m benchmarks.prompt_prefix --host 127.0.0.1 --port 11434 --turns 5
+"""
+
+import argparse
+import json
+import statistics
+
+import httpx
+
+from core.prompt.main import PromptEngineerService
+
+# The friendly message is chosen by the client and changes between requests.
+FRIENDLY = "Say hello to the user at first, the user name is {name}."
+NAMES = ["jay", "amy", "leo"]
+QUESTIONS = [
+    "What is 3TE7?",
+    "Who can I contact to buy it?",
+    "How long is the warranty?",
+    "Can it run on a fanless box?",
+    "Summarize what we talked about.",
+]
+RETRIEVAL = "3TE7 is an industrial SSD. Contact sales@example.com. Warranty is 3 years."
+
+
+def run_layout(
+    url: str, model: str, layout: str, turns: int, num_ctx: int, max_tokens: int
+) -> list:
+    """
+    Replay the conversation with one layout.
+
+    Args:
+        url (str): Base url of the Ollama api.
+        model (str): The model name.
+        layout (str): "cache" or "legacy".
+        turns (int): Number of turns.
+        num_ctx (int): Context size, the same for every call.
+        max_tokens (int): Tokens generated per turn.
+
+    Returns:
+        list: Per turn prefill metrics.
+    """
+    prompt_engineer = PromptEngineerService()
+    history = []
+    results = []
+    for turn in range(turns):
+        question = QUESTIONS[turn % len(QUESTIONS)]
+        user_prompt = prompt_engineer.generate(
+            history=" ".join(history) or False,
+            retrieval=RETRIEVAL,
+            prompt=question,
+        )
+        messages = prompt_engineer.messages(
+            user_prompt=user_prompt,
+            friendly=FRIENDLY.format(name=NAMES[turn % len(NAMES)]),
+            layout=layout,
+        )
+        response = httpx.post(
+            url=url + "chat",
+            json={
+                "model": model,
+                "messages": messages,
+                "stream": False,
+                "keep_alive": -1,
+                "options": {"num_predict": max_tokens, "num_ctx": num_ctx},
+            },
+            timeout=300,
+        )
+        response.raise_for_status()
+        data = response.json()
+        history.append(f"User ask: {question} Bot answer: {data['message']['content']}")
+        results.append(
+            {
+                "turn": turn,
+                "prompt_eval_count": data.get("prompt_eval_count", 0),
+                "prompt_eval_ms": data.get("prompt_eval_duration", 0) / 1e6,
+            }
+        )
+    return results
+
+
+def summarize(results: list) -> dict:
+    # The first turn is cold for both layouts, only the following turns can hit the cache.
+    warm = results[1:] or results
+    return {
+        "turns": results,
+        "prompt_eval_count_avg": statistics.mean(r["prompt_eval_count"] for r in warm),
+        "prompt_eval_ms_avg": statistics.mean(r["prompt_eval_ms"] for r in warm),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--model", default="llama3.1")
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--num-ctx", type=int, default=8192)
+    parser.add_argument("--max-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    url = f"http://{args.host}:{args.port}/api/"
+    report = {}
+    for layout in ("legacy", "cache"):
+        report[layout] = summarize(
+            run_layout(
+                url=url,
+                model=args.model,
+                layout=layout,
+                turns=args.turns,
+                num_ctx=args.num_ctx,
+                max_tokens=args.max_tokens,
+            )
+        )
+    legacy_ms = report["legacy"]["prompt_eval_ms_avg"]
+    report["prefill_speedup"] = (
+        legacy_ms / report["cache"]["prompt_eval_ms_avg"]
+        if report["cache"]["prompt_eval_ms_avg"]
+        else None
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+"""
+Evaluate retrieval quality and latency of several configurations in one run.
+
+Every query of a labeled set is embedded with `TextEmb` and searched with
+`Operator.search`, as `RetrieverService` does, for each configuration. The
+report has per configuration:
+    quality: recall@k, MRR and nDCG@k against the labeled documents.
+    latency: p50 / p95 / p99 of the embedding, the search and both, in ms.
+    prompt_tokens: estimated tokens the retrieved documents add to the prompt.
+
+Labeled set, JSON lines (or a JSON list) of:
+    {"query": "...", "relevant": ["seed-3", "seed-8"], "grades": {"seed-3": 2}}
+`relevant` holds document keys, the document id or a meta field chosen with
+`--relevance-key` (e.g. `meta.source` to label whole files). `grades` is
+optional, unlisted relevant documents have grade 1. Queries without a
+relevant document are skipped and counted in the report.
+
+Configurations, a JSON list of:
+    {"name": "minilm-k5", "model": "all-minilm:latest", "top_k": 5,
+     "store": "memory", "vector_function": "cosine_similarity",
+     "search_strategy": "hnsw", "table_name": "haystack_documents"}
+Only `name` is required. With `--corpus` (a `VECTOR_STORE_SEED` JSON file)
+every configuration indexes the corpus with its own model first; a
+"pgvector" configuration then needs its own `table_name`, which is
+recreated. Without `--corpus` "pgvector" configurations search the existing
+table. A "memory" configuration searches exactly with "cosine_similarity"
+or "inner_product", it can not take another `vector_function` or a
+`search_strategy`.
+
+Usage:
+    python -m benchmarks.retrieval_eval --labels labels.jsonl --corpus benchmarks/seed.json --configs configs.json
+    python -m benchmarks.retrieval_eval --labels labels.jsonl --configs configs.json --k 1,5,10 --workers 8 --format table
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from haystack import Document
+
+from benchmarks.loadgen import git_commit, percentile
+from core.handler.embedding.text_embedding import TextEmb
+from core.models.backend import OllamaBackendPool
+from core.models.minillm import MinillmModel
+from core.prompt.registry import estimate_tokens
+
+DEFAULT_CONFIG = {
+    "model": "all-minilm:latest",
+    "top_k": 10,
+    "store": "memory",
+    "vector_function": "cosine_similarity",
+    "search_strategy": "hnsw",
+    "table_name": "haystack_documents",
+}
+
+# Vector functions the in-memory store computes, see `Operator`.
+MEMORY_VECTOR_FUNCTIONS = ("cosine_similarity", "inner_product")
+
+
+def read_records(path: str) -> list:
+    """
+    Read a JSON list or a JSON lines file.
+
+    Args:
+        path (str): The file.
+
+    Returns:
+        list: The records.
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def split_labels(labels: list) -> tuple:
+    """
+    Separate the labeled queries that can be scored.
+
+    Args:
+        labels (list): The labeled queries.
+
+    Returns:
+        tuple: (queries with a query text and relevant documents, number of skipped queries).
+    """
+    usable = [label for label in labels if label.get("query") and label.get("relevant")]
+    return usable, len(labels) - len(usable)
+
+
+def check_config(config: dict) -> None:
+    """
+    Reject configuration keys the store would silently ignore or change.
+
+    Args:
+        config (dict): The configuration, before the defaults are added.
+
+    Raises:
+        ValueError: If a "memory" configuration sets an unsupported key.
+    """
+    if config.get("store", DEFAULT_CONFIG["store"]) != "memory":
+        return
+    vector_function = config.get("vector_function", DEFAULT_CONFIG["vector_function"])
+    if vector_function not in MEMORY_VECTOR_FUNCTIONS:
+        raise ValueError(
+            f"Config '{config['name']}': the memory store does not support "
+            f"vector_function '{vector_function}'"
+        )
+    if "search_strategy" in config:
+        raise ValueError(
+            f"Config '{config['name']}': the memory store searches exactly, "
+            "remove search_strategy"
+        )
+
+
+def relevance_key(doc: Document, key: str) -> str:
+    """
+    The key a document is labeled with.
+
+    Args:
+        doc (Document): The document.
+        key (str): "id" or "meta.<field>".
+
+    Returns:
+        str: The document key.
+    """
+    if key == "id":
+        return doc.id
+    return str(doc.meta.get(key.split(".", 1)[1]))
+
+
+def score(ranked: list, relevant: list, grades: dict, ks: list) -> dict:
+    """
+    Quality of one ranked result.
+
+    Args:
+        ranked (list): Document keys in rank order, without duplicates.
+        relevant (list): Keys of the relevant documents.
+        grades (dict): Grade per relevant key, 1 when missing.
+        ks (list): Cut-offs of recall and nDCG.
+
+    Returns:
+        dict: "recall@k", "ndcg@k" and "mrr".
+
+    Raises:
+        ValueError: If `relevant` is empty.
+    """
+    if not relevant:
+        raise ValueError("A query needs at least one relevant document")
+    gains = {key: grades.get(key, 1) for key in relevant}
+    result = dict()
+    for k in ks:
+        hits = sum(1 for key in ranked[:k] if key in gains)
+        result[f"recall@{k}"] = hits / len(gains)
+    for k in ks:
+        dcg = sum(
+            (2 ** gains[key] - 1) / math.log2(rank + 2)
+            for rank, key in enumerate(ranked[:k])
+            if key in gains
+        )
+        ideal = sorted(gains.values(), reverse=True)[:k]
+        idcg = sum((2**gain - 1) / math.log2(rank + 2) for rank, gain in enumerate(ideal))
+        result[f"ndcg@{k}"] = dcg / idcg if idcg else 0.0
+
+    result["mrr"] = next(
+        (1 / (rank + 1) for rank, key in enumerate(ranked) if key in gains), 0.0
+    )
+    return result
+
+
+def latency(values: list) -> dict:
+    return {
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+    }
+
+
+class Evaluator:
+    """
+    Evaluator class.
+
+    This class runs a labeled query set against retrieval configurations.
+    Corpus embeddings are computed once per model and shared by the
+    configurations that use it.
+
+    Methods:
+        build(config: dict) -> tuple:
+            The embedding handler and the operator of a configuration.
+
+        evaluate(config: dict) -> dict:
+            Run the labeled queries and return the report of a configuration.
+    """
+
+    def __init__(
+        self,
+        backends: OllamaBackendPool,
+        labels: list,
+        corpus: list = None,
+        ks: list = (1, 3, 5, 10),
+        key: str = "id",
+        workers: int = 1,
+    ) -> None:
+        """
+        Initialize the Evaluator class.
+
+        Args:
+            backends (OllamaBackendPool): The Ollama instances embedding the texts.
+            labels (list): The labeled queries.
+            corpus (list, optional): Documents indexed by every configuration. Defaults to None.
+            ks (list, optional): Cut-offs of recall and nDCG. Defaults to (1, 3, 5, 10).
+            key (str, optional): "id" or "meta.<field>", what the labels refer to. Defaults to "id".
+            workers (int, optional): Queries run at the same time. Defaults to 1.
+        """
+        self.backends = backends
+        self.labels = labels
+        self.corpus = corpus
+        self.ks = list(ks)
+        self.key = key
+        self.workers = workers
+        self._corpus_embeddings = dict()
+
+    def _embed_corpus(self, model: MinillmModel) -> list:
+        if model.model_name not in self._corpus_embeddings:
+            start_time = time.perf_counter()
+            embeddings = model.run_batch(data=[doc["content"] for doc in self.corpus])
+            print(
+                f"Embed {len(embeddings)} documents with '{model.model_name}' "
+                f"in {time.perf_counter() - start_time:.1f}s",
+                file=sys.stderr,
+            )
+            self._corpus_embeddings[model.model_name] = embeddings
+        return self._corpus_embeddings[model.model_name]
+
+    def build(self, config: dict) -> tuple:
+        """
+        The embedding handler and the operator of a configuration.
+
+        Args:
+            config (dict): The configuration.
+
+        Returns:
+            tuple: (TextEmb, Operator).
+
+        Raises:
+            ValueError: If the configuration can not be indexed or searched.
+        """
+        from core.vec_db.pgvector.main import Operator
+
+        model = MinillmModel(model_name=config["model"], backends=self.backends)
+        self.backends.ensure_model(model_name=config["model"])
+        text_emb = TextEmb(model=model)
+
+        if config["store"] == "memory" and not self.corpus:
+            raise ValueError(f"Config '{config['name']}' uses the memory store, give a --corpus")
+        if (
+            config["store"] == "pgvector"
+            and self.corpus
+            and config["table_name"] == DEFAULT_CONFIG["table_name"]
+        ):
+            raise ValueError(
+                f"Config '{config['name']}' would recreate the service table, give it a table_name"
+            )
+
+        documents = []
+        if self.corpus:
+            embeddings = self._embed_corpus(model=model)
+            documents = [
+                Document.from_dict({**doc, "embedding": embedding})
+                for doc, embedding in zip(self.corpus, embeddings, strict=True)
+            ]
+        operator = Operator(
+            recreate_table=bool(self.corpus),
+            embedding_dimension=len(documents[0].embedding) if documents else 384,
+            vector_function=config["vector_function"],
+            search_strategy=config["search_strategy"],
+            store=config["store"],
+            table_name=config["table_name"],
+        )
+        if documents:
+            operator.save(documents=documents)
+        operator.set_retriever(top_k=config["top_k"])
+        return text_emb, operator
+
+    def evaluate(self, config: dict) -> dict:
+        """
+        Run the labeled queries and return the report of a configuration.
+
+        Args:
+            config (dict): The configuration.
+
+        Returns:
+            dict: Quality, latency and prompt token cost.
+        """
+        config = {**DEFAULT_CONFIG, **config}
+        text_emb, operator = self.build(config=config)
+
+        def run_query(label: dict) -> dict:
+            start_time = time.perf_counter()
+            query_embedding = text_emb.run(data=label["query"])
+            embedded_time = time.perf_counter()
+            documents = operator.search(query_embedding=query_embedding)["documents"]
+            end_time = time.perf_counter()
+
+            ranked = []
+            for doc in documents:
+                key = relevance_key(doc=doc, key=self.key)
+                if key not in ranked:
+                    ranked.append(key)
+            return {
+                "scores": score(
+                    ranked=ranked,
+                    relevant=label["relevant"],
+                    grades=label.get("grades", {}),
+                    ks=self.ks,
+                ),
+                "embed": (embedded_time - start_time) * 1000,
+                "search": (end_time - embedded_time) * 1000,
+                "total": (end_time - start_time) * 1000,
+                # The retrieved text as `RetrieverService` puts it in the prompt.
+                "tokens": estimate_tokens("".join(doc.content for doc in documents)),
+            }
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(run_query, self.labels))
+        elapsed = time.perf_counter() - start_time
+
+        names = results[0]["scores"].keys() if results else []
+        tokens = [result["tokens"] for result in results]
+        return {
+            "config": config,
+            "queries": len(results),
+            "qps": len(results) / elapsed if elapsed else 0.0,
+            "quality": {
+                name: sum(result["scores"][name] for result in results) / len(results)
+                for name in names
+            },
+            "latency_ms": {
+                name: latency([result[name] for result in results])
+                for name in ("embed", "search", "total")
+            },
+            "prompt_tokens": {
+                "mean": sum(tokens) / len(tokens) if tokens else None,
+                "p95": percentile(tokens, 0.95),
+                "max": max(tokens, default=None),
+            },
+        }
+
+
+def table(report: dict) -> str:
+    """
+    The configurations side by side, one row per metric.
+
+    Args:
+        report (dict): The evaluation report.
+
+    Returns:
+        str: The table.
+    """
+    configs = report["configs"]
+    rows = []
+    first = next(iter(configs.values()), None)
+    if first is None:
+        return ""
+    for group in ("quality", "latency_ms", "prompt_tokens"):
+        for name, value in first[group].items():
+            if isinstance(value, dict):
+                rows.extend(
+                    (f"{group}.{name}.{stat}", [result[group][name][stat] for result in configs.values()])
+                    for stat in value
+                )
+            else:
+                rows.append((f"{group}.{name}", [result[group][name] for result in configs.values()]))
+    rows.append(("qps", [result["qps"] for result in configs.values()]))
+
+    def cell(value) -> str:
+        return "-" if value is None else f"{value:.3f}" if isinstance(value, float) else str(value)
+
+    header = ["metric", *configs]
+    body = [[name, *(cell(value) for value in values)] for name, values in rows]
+    widths = [max(len(row[index]) for row in [header, *body]) for index in range(len(header))]
+    lines = [header, ["-" * width for width in widths], *body]
+    return "\n".join(
+        "  ".join(text.ljust(width) for text, width in zip(line, widths, strict=True)) for line in lines
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--labels", required=True, help="Labeled queries, JSON lines or list.")
+    parser.add_argument("--configs", required=True, help="JSON list of configurations.")
+    parser.add_argument("--corpus", help="Documents to index, a VECTOR_STORE_SEED JSON file.")
+    parser.add_argument("--ollama-hosts", default=os.getenv("OLLAMA_HOSTS", "localhost"))
+    parser.add_argument("--k", default="1,3,5,10", help="Cut-offs of recall and nDCG.")
+    parser.add_argument("--relevance-key", default="id", help='"id" or "meta.<field>".')
+    parser.add_argument("--workers", type=int, default=1, help="Queries run at the same time.")
+    parser.add_argument("--format", choices=("json", "table"), default="json")
+    parser.add_argument("--output", help="Also write the JSON report to this file.")
+    args = parser.parse_args()
+
+    if args.relevance_key != "id" and not args.relevance_key.startswith("meta."):
+        parser.error("--relevance-key must be 'id' or 'meta.<field>'")
+    with open(args.configs, encoding="utf-8") as f:
+        configs = json.load(f)
+    names = [config["name"] for config in configs]
+    if len(set(names)) != len(names):
+        parser.error("Configuration names must be unique")
+    for config in configs:
+        try:
+            check_config(config=config)
+        except ValueError as e:
+            parser.error(str(e))
+    labels, skipped = split_labels(read_records(args.labels))
+    if skipped:
+        print(f"Skip {skipped} queries without relevant documents", file=sys.stderr)
+    if not labels:
+        parser.error(f"No query with relevant documents in '{args.labels}'")
+
+    # The operator module reads these at import: Postgres settings are only
+    # needed by "pgvector" configurations, and the service seed must not mix
+    # into the evaluated corpus.
+    if all(config.get("store", DEFAULT_CONFIG["store"]) == "memory" for config in configs):
+        os.environ.setdefault("VECTOR_STORE", "memory")
+    os.environ.pop("VECTOR_STORE_SEED", None)
+
+    evaluator = Evaluator(
+        backends=OllamaBackendPool.from_hosts(hosts=args.ollama_hosts),
+        labels=labels,
+        corpus=read_records(args.corpus) if args.corpus else None,
+        ks=[int(k) for k in args.k.split(",")],
+        key=args.relevance_key,
+        workers=args.workers,
+    )
+    report = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "labels": args.labels,
+        "skipped_queries": skipped,
+        "corpus": args.corpus,
+        "configs": dict(),
+    }
+    for config in configs:
+        report["configs"][config["name"]] = evaluator.evaluate(config=config)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(table(report) if args.format == "table" else output)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ from typing import Union
 
 from core.handler.pattern import HandlerPattern
 from core.models.pattern import TextEmbedding
+from tools.tracing import traced
 
 
 class TextEmb(HandlerPattern):
@@ -53,6 +54,7 @@ class TextEmb(HandlerPattern):
             f"TextEmb must create by model which type is 'TextEmbedding'! But Input type is '{type(model)}' , More info: model name is '{model.model_name}'."
         )
 
+    @traced("embedding.text")
     def run(self, data: Union[list, str]) -> list:
         """
         Generate an embedding vector for the provided text data.
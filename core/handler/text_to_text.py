@@ -1,6 +1,8 @@
 from collections.abc import Generator
 
 from core.models.pattern import Text2Text
+from core.models.profiles import PROFILE_ANSWER, GenerationProfile, TokenBudget
+from core.models.scheduler import PRIORITY_INTERACTIVE
 
 from .pattern import HandlerPattern
 
@@ -14,24 +16,39 @@ class GenText(HandlerPattern):
 
     Attributes:
         model (Text2Text): The Text2Text model used for text generation.
+        priority (str): The scheduling class of the generations.
+        profile (GenerationProfile): Token budget, temperature and stop sequences of the call site.
+        budget (TokenBudget): Adapts the token budget to the observed output lengths, or None.
 
     Methods:
-        run(prompt: list, max_tokens: int = 350) -> str:
+        run(prompt: list, max_tokens: int = None) -> str:
             Generate text based on the provided prompt and maximum number of tokens.
     """
 
-    def __init__(self, model: Text2Text) -> None:
+    def __init__(
+        self,
+        model: Text2Text,
+        priority: str = PRIORITY_INTERACTIVE,
+        profile: GenerationProfile = PROFILE_ANSWER,
+        budget: TokenBudget = None,
+    ) -> None:
         """
         Initialize the GenText handler with a Text2Text model.
 
         Args:
             model (Text2Text): The Text2Text model to be used for text generation.
+            priority (str, optional): The scheduling class of the generations, interactive or background. Defaults to PRIORITY_INTERACTIVE.
+            profile (GenerationProfile, optional): The generation profile of the call site. Defaults to PROFILE_ANSWER.
+            budget (TokenBudget, optional): Adaptive token budget shared by the handlers, the profile `max_tokens` is used when None. Defaults to None.
 
         Raises:
             TypeError: If the provided model is not an instance of Text2Text.
         """
         super().__init__()
         self.model = self._check(model=model)
+        self.priority = priority
+        self.profile = profile
+        self.budget = budget
 
     def _check(self, model) -> Text2Text:
         """
@@ -52,15 +69,30 @@ class GenText(HandlerPattern):
             f"GenText must create by model which type is 'Text2Text'! But Input type is '{type(model)}' , More info: model name is '{model.model_name}'."
         )
 
-    def run(self, data: list, max_tokens: int = 350) -> Generator[str]:
+    def _observe(self, final: dict) -> None:
+        self.budget.observe(profile=self.profile, final=final)
+
+    def run(self, data: list, max_tokens: int = None) -> Generator[str]:
         """
         Generate text based on the provided prompt and maximum number of tokens.
 
         Args:
             data (list): A list of prompts for text generation.
-            max_tokens (int, optional): The maximum number of tokens for the generated text. Defaults to 350.
+            max_tokens (int, optional): The maximum number of tokens for the generated text. Defaults to the profile budget.
 
         Returns:
             Generator: The generator of text.
         """
-        yield from self.model.run(data=data, max_tokens=max_tokens)
+        if max_tokens is None:
+            max_tokens = (
+                self.budget.get(profile=self.profile)
+                if self.budget
+                else self.profile.max_tokens
+            )
+        yield from self.model.run(
+            data=data,
+            max_tokens=max_tokens,
+            priority=self.priority,
+            options=self.profile.options(),
+            on_done=self._observe if self.budget else None,
+        )
@@ -1,6 +1,7 @@
 import httpx
 
 from core.models.pattern import TopicsClassification
+from tools.tracing import traced
 
 from .pattern import HandlerPattern
 
@@ -56,6 +57,7 @@ class TopicsClassifier(HandlerPattern):
             f"TopicsClassifier must create by model which type is 'TopicsClassification'! But Input type is '{type(model)}' , More info: model name is '{model.model_name}'."
         )
 
+    @traced("topics.classify")
     def run(self, sentence: str, top_k: int = 3) -> list:
         data = {"topics": self.topics, "sentence": sentence, "top_k": top_k}
         with httpx.Client() as client:
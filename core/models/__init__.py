@@ -1,5 +1,35 @@
+from .backend import OllamaBackendPool
 from .bart import BartModel
 from .llama import Llama31Model
 from .minillm import MinillmModel
+from .profiles import (
+    PROFILE_ANSWER,
+    PROFILE_SUMMARY,
+    GenerationProfile,
+    TokenBudget,
+)
+from .scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    GenerationScheduler,
+    ScheduledText2Text,
+    SchedulerRejected,
+    SchedulerTimeout,
+)
 
-__all__ = ["BartModel", "MinillmModel", "Llama31Model"]
+__all__ = [
+    "BartModel",
+    "MinillmModel",
+    "Llama31Model",
+    "OllamaBackendPool",
+    "PROFILE_ANSWER",
+    "PROFILE_SUMMARY",
+    "GenerationProfile",
+    "TokenBudget",
+    "PRIORITY_BACKGROUND",
+    "PRIORITY_INTERACTIVE",
+    "GenerationScheduler",
+    "ScheduledText2Text",
+    "SchedulerRejected",
+    "SchedulerTimeout",
+]
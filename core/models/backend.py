@@ -0,0 +1,344 @@
+import threading
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+
+import httpx
+
+from tools.logger import config_logger
+
+# init log
+LOGGER = config_logger(
+    log_name="backend.log",
+    logger_name="backend",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+# Errors that say something about the backend itself, not about the request.
+BACKEND_ERRORS = (httpx.TransportError, httpx.HTTPStatusError)
+
+
+class OllamaBackend:
+    """
+    One Ollama endpoint and its counters.
+
+    Attributes:
+        url (str): Base url of the Ollama api, ends with '/api/'.
+        outstanding (int): Requests currently running on the backend.
+        healthy (bool): False while the backend is ejected.
+    """
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+        self.latency_seconds = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ejections": self.ejections,
+            "latency_avg": (
+                self.latency_seconds / self.requests if self.requests else 0.0
+            ),
+        }
+
+
+class OllamaBackendPool:
+    """
+    OllamaBackendPool class.
+
+    This class spreads model calls over several Ollama instances. Every call
+    goes to the healthy backend with the least outstanding requests. A
+    backend failing `max_failures` times in a row is ejected, a background
+    health check re-admits it once `/api/version` answers again and every
+    warm up registered with `warm_up()` succeeded on it.
+
+    Methods:
+        acquire():
+            Context manager giving the backend for one call.
+
+        start_health_check() -> None:
+            Start the background health check.
+
+        stop_health_check() -> None:
+            Stop the background health check.
+
+        warm_up(name: str, func: Callable[[OllamaBackend], None]) -> int:
+            Prepare every healthy backend, and each re-admitted one.
+
+        ensure_model(model_name: str, backend: OllamaBackend = None) -> None:
+            Pull a model on the backends that do not have it yet.
+
+        stats() -> list:
+            Per backend metrics.
+    """
+
+    def __init__(
+        self,
+        urls: list,
+        max_failures: int = 3,
+        health_interval: float = 10.0,
+        health_timeout: float = 2.0,
+    ) -> None:
+        """
+        Initialize the OllamaBackendPool class.
+
+        Args:
+            urls (list): Base urls of the Ollama apis, e.g. 'http://ollama:11434/api/'.
+            max_failures (int, optional): Consecutive failures before a backend is ejected. Defaults to 3.
+            health_interval (float, optional): Seconds between two health checks. Defaults to 10.0.
+            health_timeout (float, optional): Timeout of one health check. Defaults to 2.0.
+        """
+        if not urls:
+            raise ValueError("OllamaBackendPool needs at least one backend url!")
+        self.backends = [OllamaBackend(url=url) for url in urls]
+        self.max_failures = max_failures
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread = None
+        self._warmups = dict()
+
+    @classmethod
+    def from_hosts(cls, hosts: str, default_port: int = 11434, **kwargs):
+        """
+        Create a pool from a comma separated 'host[:port]' list.
+
+        Args:
+            hosts (str): e.g. 'ollama-0,ollama-1:11435'. None or empty uses 'localhost', like the models.
+            default_port (int, optional): Port used when a host has none. Defaults to 11434.
+
+        Returns:
+            OllamaBackendPool: The pool.
+        """
+        urls = []
+        for host in (hosts or "localhost").split(","):
+            host = host.strip()
+            if not host:
+                continue
+            if ":" not in host:
+                host = f"{host}:{default_port}"
+            urls.append(f"http://{host}/api/")
+        return cls(urls=urls, **kwargs)
+
+    def _pick(self) -> OllamaBackend:
+        candidates = [backend for backend in self.backends if backend.healthy]
+        if not candidates:
+            # Everything is ejected, keep trying rather than failing every call.
+            candidates = self.backends
+        return min(candidates, key=lambda backend: backend.outstanding)
+
+    @contextmanager
+    def acquire(self):
+        """
+        Give the backend for one call and record its outcome.
+
+        Yields:
+            OllamaBackend: The chosen backend.
+        """
+        with self._lock:
+            backend = self._pick()
+            backend.outstanding += 1
+            backend.requests += 1
+        start_time = time.monotonic()
+
+        try:
+            yield backend
+        except BACKEND_ERRORS:
+            with self._lock:
+                backend.errors += 1
+                backend.failures += 1
+                if backend.healthy and backend.failures >= self.max_failures:
+                    backend.healthy = False
+                    backend.ejections += 1
+                    LOGGER.warning(f"Eject backend '{backend.url}'")
+            raise
+        else:
+            with self._lock:
+                backend.failures = 0
+        finally:
+            with self._lock:
+                backend.outstanding -= 1
+                backend.latency_seconds += time.monotonic() - start_time
+
+    def _eject(self, backend: OllamaBackend, reason: str) -> None:
+        with self._lock:
+            if backend.healthy:
+                backend.healthy = False
+                backend.ejections += 1
+                LOGGER.warning(f"Eject backend '{backend.url}', {reason}")
+
+    def _targets(self) -> list:
+        with self._lock:
+            healthy = [backend for backend in self.backends if backend.healthy]
+        # Everything is ejected, try them all like `_pick`.
+        return healthy or list(self.backends)
+
+    def _warm(
+        self, backend: OllamaBackend, name: str, func: Callable[[OllamaBackend], None]
+    ) -> bool:
+        try:
+            func(backend)
+            return True
+        except Exception as e:
+            LOGGER.warning(f"Can not warm up '{name}' on '{backend.url}': {str(e)}")
+            self._eject(backend=backend, reason=f"'{name}' failed")
+            return False
+
+    def warm_up(self, name: str, func: Callable[[OllamaBackend], None]) -> int:
+        """
+        Prepare every healthy backend, and each re-admitted one.
+
+        `func` runs on each backend separately. A backend it fails on is
+        ejected; the health check runs every registered warm up again
+        before re-admitting it, so it never takes traffic unprepared.
+
+        Args:
+            name (str): Key of the warm up, registering the same name replaces it.
+            func (Callable[[OllamaBackend], None]): Prepares one backend, e.g. pulls and loads a model.
+
+        Returns:
+            int: Number of backends prepared.
+
+        Raises:
+            RuntimeError: If no backend could be prepared.
+        """
+        with self._lock:
+            self._warmups[name] = func
+        prepared = sum(
+            self._warm(backend=backend, name=name, func=func)
+            for backend in self._targets()
+        )
+        if not prepared:
+            raise RuntimeError(f"Can not warm up '{name}' on any backend")
+        return prepared
+
+    def _has_model(self, backend: OllamaBackend, model_name: str) -> bool:
+        response = httpx.get(url=backend.url + "tags", timeout=self.health_timeout)
+        response.raise_for_status()
+        # Ollama adds the ':latest' tag to names pulled without one.
+        if ":" not in model_name:
+            model_name = f"{model_name}:latest"
+        return any(
+            model.get("name") == model_name or model.get("model") == model_name
+            for model in response.json().get("models", [])
+        )
+
+    def ensure_model(self, model_name: str, backend: OllamaBackend = None) -> None:
+        """
+        Pull a model on the backends that do not have it yet.
+
+        The local models are listed with `/api/tags` first, a model already
+        there is not pulled again so a restart does not wait for the registry.
+
+        Args:
+            model_name (str): The model name, e.g. 'llama3.1'.
+            backend (OllamaBackend, optional): Only this backend. Defaults to every healthy backend, see `warm_up()`.
+
+        Raises:
+            httpx.HTTPError: If the model can not be pulled on `backend`.
+            RuntimeError: If no backend has the model.
+        """
+        if backend is None:
+            self.warm_up(
+                name=f"pull {model_name}",
+                func=lambda backend: self.ensure_model(
+                    model_name=model_name, backend=backend
+                ),
+            )
+            return
+
+        if self._has_model(backend=backend, model_name=model_name):
+            LOGGER.info(f"Model '{model_name}' already on '{backend.url}'")
+            return
+
+        LOGGER.info(f"Pull model '{model_name}' on '{backend.url}'")
+        with httpx.stream(
+            "POST",
+            url=backend.url + "pull",
+            json={"name": model_name},
+            timeout=None,
+        ) as response:
+            response.raise_for_status()
+            for chunk in response.iter_lines():
+                LOGGER.info(chunk)
+
+    def _check(self, backend: OllamaBackend) -> bool:
+        try:
+            response = httpx.get(
+                url=backend.url + "version", timeout=self.health_timeout
+            )
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    def check_all(self) -> None:
+        """
+        Health check every backend once, eject or re-admit them.
+        """
+        for backend in self.backends:
+            healthy = self._check(backend=backend)
+            if healthy and not backend.healthy:
+                # Pull and load the models before the backend takes traffic.
+                with self._lock:
+                    warmups = list(self._warmups.items())
+                healthy = all(
+                    self._warm(backend=backend, name=name, func=func)
+                    for name, func in warmups
+                )
+            with self._lock:
+                if healthy and not backend.healthy:
+                    LOGGER.info(f"Re-admit backend '{backend.url}'")
+                    backend.failures = 0
+                elif not healthy and backend.healthy:
+                    LOGGER.warning(
+                        f"Eject backend '{backend.url}', health check failed"
+                    )
+                    backend.ejections += 1
+                backend.healthy = healthy
+
+    def _health_loop(self) -> None:
+        while not self._stop.wait(self.health_interval):
+            self.check_all()
+
+    def start_health_check(self) -> None:
+        """
+        Start the background health check.
+        """
+        if self._health_thread is None:
+            self._stop.clear()
+            self._health_thread = threading.Thread(
+                target=self._health_loop, name="ollama-health", daemon=True
+            )
+            self._health_thread.start()
+
+    def stop_health_check(self) -> None:
+        """
+        Stop the background health check.
+        """
+        self._stop.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+            self._health_thread = None
+
+    def stats(self) -> list:
+        """
+        Per backend metrics.
+
+        Returns:
+            list: One dict per backend.
+        """
+        with self._lock:
+            return [backend.stats() for backend in self.backends]
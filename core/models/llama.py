@@ -1,10 +1,15 @@
 import json
-from collections.abc import Generator
+import time
+from collections.abc import Callable, Generator
 
 import httpx
 
+from tools.accounting import add_usage
+from tools.circuit_breaker import call_cancelled, on_call_cancel
 from tools.logger import config_logger
+from tools.tracing import span
 
+from .backend import OllamaBackend, OllamaBackendPool
 from .pattern import Text2Text
 
 # init log
@@ -17,74 +22,200 @@ LOGGER = config_logger(
 )
 
 
+# No limit on the whole stream (see `max_stream_seconds`), but a dead
+# connection or a stalled backend is detected.
+STREAM_TIMEOUT = httpx.Timeout(connect=10.0, read=120.0, write=30.0, pool=None)
+
+
 class Llama31Model(Text2Text):
     def __init__(
-        self, model_name: str = "llama3.1", host: str = "localhost", port: int = 11434
+        self,
+        model_name: str = "llama3.1",
+        host: str = "localhost",
+        port: int = 11434,
+        backends: OllamaBackendPool = None,
+        num_ctx: int = 8192,
+        keep_alive: int = -1,
     ) -> None:
         super().__init__(model_name)
         self.model_name = model_name
-        self.ollama_url = f"http://{host}:{str(port)}/api/"
-
-        self._pull_model()
-
-    def _pull_model(self):
-        data = {"name": self.model_name}
-
-        with httpx.stream(
-            "POST", url=self.ollama_url + "pull", json=data, timeout=None
-        ) as response:
-            if (
-                response.status_code == 200
-                and response.headers.get("Transfer-Encoding") == "chunked"
-            ):
-                LOGGER.info("Response is a streaming response")
+        # Every request uses the same context size and keep alive as the load
+        # call, otherwise Ollama reloads the model and drops its KV cache.
+        self.num_ctx = num_ctx
+        self.keep_alive = keep_alive
+        # A pool spreads calls over several Ollama instances, `host` and
+        # `port` are only used when no pool is given.
+        self.backends = backends or OllamaBackendPool(
+            urls=[f"http://{host}:{str(port)}/api/"]
+        )
 
-                for chunk in response.iter_lines():
-                    LOGGER.info(chunk)
+    def _pull_model(self, backend: OllamaBackend):
+        # Called by `_load_model` rather than at construction, so creating
+        # the model does not wait for the registry.
+        self.backends.ensure_model(model_name=self.model_name, backend=backend)
 
-    def _load_model(self):
-        data = {"model": self.model_name, "keep_alive": -1}
+    def _load_backend(self, backend: OllamaBackend) -> None:
+        self._pull_model(backend=backend)
+        data = {
+            "model": self.model_name,
+            "keep_alive": self.keep_alive,
+            "options": {"num_ctx": self.num_ctx},
+        }
         with httpx.Client() as client:
             response = client.post(
-                url=self.ollama_url + "generate", json=data, timeout=None
+                url=backend.url + "generate", json=data, timeout=None
             )
 
         if response.status_code != 200:
-            LOGGER.error(f"{self.model_name} can not loaded!")
-            raise RuntimeError
-        LOGGER.info(f"Success init {self.model_name}!")
+            LOGGER.error(f"{self.model_name} can not loaded! ({backend.url})")
+            raise RuntimeError(
+                f"'{self.model_name}' load answered {response.status_code}"
+            )
+
+    def _load_model(self):
+        # Each backend is loaded separately, also when the health check
+        # re-admits it. Ready once one backend has the model.
+        loaded = self.backends.warm_up(
+            name=f"load {self.model_name}", func=self._load_backend
+        )
+        LOGGER.info(f"Success init {self.model_name} on {loaded} backends!")
 
     def _release_model(self):
         data = {"model": self.model_name, "keep_alive": 0}
-        with httpx.Client() as client:
-            response = client.post(
-                url=self.ollama_url + "generate", json=data, timeout=None
-            )
-
-        if response.status_code != 200:
-            LOGGER.error(f"{self.model_name} can not released!")
+        for backend in self.backends.backends:
+            try:
+                with httpx.Client() as client:
+                    response = client.post(
+                        url=backend.url + "generate", json=data, timeout=10.0
+                    )
+            except httpx.HTTPError as e:
+                LOGGER.error(
+                    f"{self.model_name} can not released! ({backend.url}: {str(e)})"
+                )
+                continue
+
+            if response.status_code != 200:
+                LOGGER.error(f"{self.model_name} can not released! ({backend.url})")
         LOGGER.info(f"Success release {self.model_name}!")
 
-    def chat_stream(self, request_data: dict) -> Generator[str]:
+    def chat_stream(
+        self,
+        request_data: dict,
+        max_stream_seconds: float = 300.0,
+        on_done: Callable[[dict], None] = None,
+    ) -> Generator[str]:
+        """
+        Stream the content of an Ollama chat.
+
+        The upstream request is only read as fast as the caller consumes it.
+        Closing the generator (the client went away) closes the connection,
+        which makes Ollama stop generating. A stream running longer than
+        `max_stream_seconds` is cut. `on_done` receives the final chunk
+        (`eval_count`, `done_reason`, durations) of a finished stream.
+
+        Inside a circuit breaker call, the connection is closed as soon as
+        the breaker gives up on the call, even while waiting for a token.
+        """
+        deadline = time.monotonic() + max_stream_seconds
+        start_time = time.perf_counter()
+        first_token = True
+        with span("llm.generate", model=self.model_name) as trace_span:
+            try:
+                with self.backends.acquire() as backend, self._open_stream(
+                    backend=backend, request_data=request_data
+                ) as response, on_call_cancel(response.close):
+                    trace_span.set_attribute("backend", backend.url)
+                    if response.status_code >= 500:
+                        response.read()
+                        response.raise_for_status()
+                    if response.headers.get("Transfer-Encoding") == "chunked":
+                        for chunk in self._iter_lines(response=response):
+                            message = json.loads(chunk)
+                            if first_token and message["message"]["content"]:
+                                first_token = False
+                                trace_span.set_attribute(
+                                    "ttft", time.perf_counter() - start_time
+                                )
+                            yield message["message"]["content"]
+                            if message.get("done"):
+                                self._trace_done(trace_span=trace_span, final=message)
+                                add_usage(
+                                    llm_calls=1,
+                                    prompt_tokens=message.get("prompt_eval_count", 0),
+                                    completion_tokens=message.get("eval_count", 0),
+                                )
+                                if on_done is not None:
+                                    self._call_on_done(on_done=on_done, final=message)
+                                break
+                            if time.monotonic() > deadline:
+                                LOGGER.warning(
+                                    f"Stop stream after {max_stream_seconds}s ({backend.url})"
+                                )
+                                break
+                    else:
+                        raise RuntimeError(json.loads(response.read().decode("utf-8")))
+            except Exception as e:
+                trace_span.set_attribute("error", str(e))
+                yield f"Error occurred: {str(e)}\n\n"
+
+    def _open_stream(self, backend: OllamaBackend, request_data: dict):
+        return httpx.stream(
+            "POST",
+            url=backend.url + "chat",
+            json=request_data,
+            timeout=STREAM_TIMEOUT,
+        )
+
+    def _iter_lines(self, response: httpx.Response) -> Generator[str]:
+        # A cancelled call closes the response from the breaker thread, the
+        # read fails then: end the stream quietly, the backend is healthy.
+        try:
+            for line in response.iter_lines():
+                if call_cancelled():
+                    break
+                yield line
+        except (httpx.HTTPError, httpx.StreamError):
+            if not call_cancelled():
+                raise
+        if call_cancelled():
+            LOGGER.info("Stop stream of an abandoned call")
+
+    def _trace_done(self, trace_span, final: dict) -> None:
+        # Ollama reports durations in nanoseconds.
+        trace_span.set_attribute("eval_count", final.get("eval_count", 0))
+        trace_span.set_attribute("prompt_eval_count", final.get("prompt_eval_count", 0))
+        if final.get("eval_duration"):
+            trace_span.set_attribute(
+                "tokens_per_second",
+                final.get("eval_count", 0) / (final["eval_duration"] / 1e9),
+            )
+
+    def _call_on_done(self, on_done: Callable[[dict], None], final: dict) -> None:
         try:
-            with httpx.stream(
-                "POST", url=self.ollama_url + "chat", json=request_data, timeout=None
-            ) as response:
-                if response.headers.get("Transfer-Encoding") == "chunked":
-                    for chunk in response.iter_lines():
-                        yield json.loads(chunk)["message"]["content"]
-                else:
-                    raise RuntimeError(json.loads(response.read().decode("utf-8")))
-        except BaseException as e:
-            yield f"Error occurred: {str(e)}\n\n"
-
-    def run(self, data: list, max_tokens: int = 350) -> Generator[str]:
+            on_done(final)
+        except Exception as e:
+            LOGGER.error(f"on_done callback failed: {e}")
+
+    def run(
+        self,
+        data: list,
+        max_tokens: int = 350,
+        priority: str = None,
+        options: dict = None,
+        on_done: Callable[[dict], None] = None,
+    ) -> Generator[str]:
+        # `priority` is only used by a scheduler in front of the model.
         LOGGER.info(
-            f"Input: {[entry['content'] for entry in data if entry['role'] == 'user']}"
+            "Input: %s", [entry["content"] for entry in data if entry["role"] == "user"]
         )
         request_data = {
             "model": self.model_name,
             "messages": data,
-            "options": {"num_predict": max_tokens},
+            "keep_alive": self.keep_alive,
+            "options": {
+                **(options or {}),
+                "num_predict": max_tokens,
+                "num_ctx": self.num_ctx,
+            },
         }
-        yield from self.chat_stream(request_data=request_data)
+        yield from self.chat_stream(request_data=request_data, on_done=on_done)
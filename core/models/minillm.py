@@ -1,7 +1,9 @@
 import httpx
 
+from tools.accounting import add_usage
 from tools.logger import config_logger
 
+from .backend import OllamaBackend, OllamaBackendPool
 from .pattern import TextEmbedding
 
 # init log
@@ -20,60 +22,103 @@ class MinillmModel(TextEmbedding):
         model_name: str = "all-minilm:latest",
         host: str = "localhost",
         port: int = 11434,
+        backends: OllamaBackendPool = None,
     ) -> None:
         super().__init__(model_name)
         self.model_name = model_name
-        self.ollama_url = f"http://{host}:{str(port)}/api/"
-
-        self._pull_model()
-
-    def _pull_model(self):
-        data = {"name": self.model_name}
-
-        with httpx.stream(
-            "POST", url=self.ollama_url + "pull", json=data, timeout=None
-        ) as response:
-            if (
-                response.status_code == 200
-                and response.headers.get("Transfer-Encoding") == "chunked"
-            ):
-                LOGGER.info("Response is a streaming response")
-
-                for chunk in response.iter_lines():
-                    LOGGER.info(chunk)
-
-    def _load_model(self):
+        # A pool spreads calls over several Ollama instances, `host` and
+        # `port` are only used when no pool is given.
+        self.backends = backends or OllamaBackendPool(
+            urls=[f"http://{host}:{str(port)}/api/"]
+        )
+
+    def _pull_model(self, backend: OllamaBackend):
+        # Called by `_load_model` rather than at construction, so creating
+        # the model does not wait for the registry.
+        self.backends.ensure_model(model_name=self.model_name, backend=backend)
+
+    def _load_backend(self, backend: OllamaBackend) -> None:
+        self._pull_model(backend=backend)
         data = {"model": self.model_name, "keep_alive": -1}
         with httpx.Client() as client:
             response = client.post(
-                url=self.ollama_url + "embeddings", json=data, timeout=None
+                url=backend.url + "embeddings", json=data, timeout=None
             )
 
         if response.status_code != 200:
-            LOGGER.error(f"{self.model_name} can not loaded!")
-            raise RuntimeError
-        LOGGER.info(f"Success init {self.model_name}!")
+            LOGGER.error(f"{self.model_name} can not loaded! ({backend.url})")
+            raise RuntimeError(
+                f"'{self.model_name}' load answered {response.status_code}"
+            )
+
+    def _load_model(self):
+        # Each backend is loaded separately, also when the health check
+        # re-admits it. Ready once one backend has the model.
+        loaded = self.backends.warm_up(
+            name=f"load {self.model_name}", func=self._load_backend
+        )
+        LOGGER.info(f"Success init {self.model_name} on {loaded} backends!")
 
     def _release_model(self):
         data = {"model": self.model_name, "keep_alive": 0}
-        with httpx.Client() as client:
-            response = client.post(
-                url=self.ollama_url + "embeddings", json=data, timeout=None
-            )
-
-        if response.status_code != 200:
-            LOGGER.error(f"{self.model_name} can not released!")
+        for backend in self.backends.backends:
+            try:
+                with httpx.Client() as client:
+                    response = client.post(
+                        url=backend.url + "embeddings", json=data, timeout=10.0
+                    )
+            except httpx.HTTPError as e:
+                LOGGER.error(
+                    f"{self.model_name} can not released! ({backend.url}: {str(e)})"
+                )
+                continue
+
+            if response.status_code != 200:
+                LOGGER.error(f"{self.model_name} can not released! ({backend.url})")
         LOGGER.info(f"Success release {self.model_name}!")
 
     def run(self, data: str) -> list:
         request_data = {"model": self.model_name, "input": data}
+        add_usage(embedding_calls=1)
 
-        with httpx.Client() as client:
-            response = client.post(
-                url=self.ollama_url + "embed", json=request_data, timeout=None
-            )
+        with self.backends.acquire() as backend:
+            with httpx.Client() as client:
+                response = client.post(
+                    url=backend.url + "embed", json=request_data, timeout=None
+                )
+            if response.status_code >= 500:
+                response.raise_for_status()
 
         if response.status_code == 200:
             content = response.json()
             result = content["embeddings"][0]
         return result
+
+    def run_batch(self, data: list, batch_size: int = 32) -> list:
+        """
+        Embed many texts, `batch_size` texts per request.
+
+        Args:
+            data (list): The texts.
+            batch_size (int, optional): Texts sent in one request. Defaults to 32.
+
+        Returns:
+            list: One embedding per text.
+        """
+        result = []
+        for start in range(0, len(data), batch_size):
+            request_data = {
+                "model": self.model_name,
+                "input": data[start : start + batch_size],
+            }
+            add_usage(embedding_calls=1)
+            with self.backends.acquire() as backend:
+                with httpx.Client() as client:
+                    response = client.post(
+                        url=backend.url + "embed", json=request_data, timeout=None
+                    )
+                if response.status_code >= 500:
+                    response.raise_for_status()
+            response.raise_for_status()
+            result.extend(response.json()["embeddings"])
+        return result
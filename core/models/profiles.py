@@ -0,0 +1,181 @@
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+
+from tools.logger import config_logger
+
+# init log
+LOGGER = config_logger(
+    log_name="profiles.log",
+    logger_name="profiles",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+
+@dataclass(frozen=True)
+class GenerationProfile:
+    """
+    Generation settings of one call site.
+
+    Attributes:
+        name (str): The profile name, also the key of its budget statistics.
+        max_tokens (int): Upper bound of the token budget.
+        min_tokens (int): Lower bound of the adaptive token budget.
+        temperature (float): Sampling temperature, None keeps the model default.
+        stop (tuple): Stop sequences, the generation ends when one is produced.
+        adaptive (bool): Whether `TokenBudget` may lower the budget below `max_tokens`.
+    """
+
+    name: str
+    max_tokens: int
+    min_tokens: int = 32
+    temperature: float = None
+    stop: tuple = field(default_factory=tuple)
+    adaptive: bool = True
+
+    def options(self) -> dict:
+        """
+        Ollama `options` of the profile, without `num_predict`.
+
+        Returns:
+            dict: The options.
+        """
+        options = dict()
+        if self.temperature is not None:
+            options["temperature"] = self.temperature
+        if self.stop:
+            options["stop"] = list(self.stop)
+        return options
+
+
+# The chat template ends with "Question: ... Answer:", a model going on with
+# the next "Question:" is writing tokens nobody reads. The user sees the
+# answer, a longer one than usual must not be cut: its budget stays fixed.
+PROFILE_ANSWER = GenerationProfile(
+    name="answer",
+    max_tokens=350,
+    min_tokens=128,
+    stop=("\nQuestion:",),
+    adaptive=False,
+)
+PROFILE_SUMMARY = GenerationProfile(
+    name="summary",
+    max_tokens=200,
+    min_tokens=64,
+    temperature=0.2,
+    stop=("\nTopic:", "\nUser ask:"),
+)
+
+
+class TokenBudget:
+    """
+    TokenBudget class.
+
+    This class adapts the token budget of every adaptive profile to the
+    observed output lengths, the others keep `max_tokens` and are only
+    measured. The budget is the 95th percentile of the recent
+    `eval_count` values with some headroom, kept between the profile
+    `min_tokens` and `max_tokens`. Outputs cut by the budget report the
+    budget itself as their length, so when too many are cut the percentile
+    reaches the budget and the headroom grows it again.
+
+    Methods:
+        get(profile: GenerationProfile) -> int:
+            The current token budget of a profile.
+
+        observe(profile: GenerationProfile, final: dict) -> None:
+            Record the final chunk of a generation.
+
+        stats() -> dict:
+            Budget and output length metrics per profile.
+    """
+
+    def __init__(
+        self, window: int = 200, min_samples: int = 20, headroom: float = 1.25
+    ) -> None:
+        """
+        Initialize the TokenBudget class.
+
+        Args:
+            window (int, optional): Number of recent generations kept per profile. Defaults to 200.
+            min_samples (int, optional): Generations observed before the budget adapts. Defaults to 20.
+            headroom (float, optional): Factor applied to the 95th percentile. Defaults to 1.25.
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self.headroom = headroom
+        self._lock = threading.Lock()
+        self._profiles = dict()
+        self._lengths = dict()
+        self._truncated = dict()
+
+    def get(self, profile: GenerationProfile) -> int:
+        """
+        The current token budget of a profile.
+
+        Args:
+            profile (GenerationProfile): The profile.
+
+        Returns:
+            int: The `num_predict` to use.
+        """
+        with self._lock:
+            self._profiles.setdefault(profile.name, profile)
+            lengths = sorted(self._lengths.get(profile.name, ()))
+        if not profile.adaptive or len(lengths) < self.min_samples:
+            return profile.max_tokens
+        p95 = lengths[int(len(lengths) * 0.95)]
+        return max(
+            profile.min_tokens, min(profile.max_tokens, int(p95 * self.headroom))
+        )
+
+    def observe(self, profile: GenerationProfile, final: dict) -> None:
+        """
+        Record the final chunk of a generation.
+
+        Args:
+            profile (GenerationProfile): The profile of the generation.
+            final (dict): The last Ollama chunk, with `eval_count` and `done_reason`.
+        """
+        if "eval_count" not in final:
+            return
+        with self._lock:
+            self._profiles.setdefault(profile.name, profile)
+            lengths = self._lengths.setdefault(profile.name, deque(maxlen=self.window))
+            truncated = self._truncated.setdefault(
+                profile.name, deque(maxlen=self.window)
+            )
+            lengths.append(final["eval_count"])
+            truncated.append(final.get("done_reason") == "length")
+        if final.get("done_reason") == "length":
+            LOGGER.info(
+                f"Generation '{profile.name}' cut at {final['eval_count']} tokens"
+            )
+
+    def stats(self) -> dict:
+        """
+        Budget and output length metrics per profile.
+
+        Returns:
+            dict: The metrics.
+        """
+        with self._lock:
+            profiles = list(self._profiles.values())
+        result = dict()
+        for profile in profiles:
+            with self._lock:
+                lengths = sorted(self._lengths.get(profile.name, ()))
+                truncated = list(self._truncated.get(profile.name, ()))
+            result[profile.name] = {
+                "budget": self.get(profile),
+                "samples": len(lengths),
+                "length_p50": lengths[len(lengths) // 2] if lengths else 0,
+                "length_p95": lengths[int(len(lengths) * 0.95)] if lengths else 0,
+                "truncated": sum(truncated),
+                "truncated_ratio": (
+                    sum(truncated) / len(truncated) if truncated else 0.0
+                ),
+            }
+        return result
@@ -0,0 +1,278 @@
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Generator
+from contextlib import contextmanager
+
+from tools.circuit_breaker import call_cancelled
+from tools.logger import config_logger
+
+from .pattern import Text2Text
+
+# init log
+LOGGER = config_logger(
+    log_name="scheduler.log",
+    logger_name="scheduler",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BACKGROUND = "background"
+
+
+class SchedulerRejected(RuntimeError):
+    """Raised when the wait queue is full."""
+
+
+class SchedulerTimeout(RuntimeError):
+    """Raised when a request waited longer than its queue deadline."""
+
+
+class GenerationScheduler:
+    """
+    GenerationScheduler class.
+
+    This class caps the number of generations running on the model at the
+    same time. Extra requests wait in a bounded FIFO queue with a deadline,
+    requests arriving when the queue is full are rejected at once so the
+    caller can answer 503 instead of letting every stream slow down.
+
+    Requests belong to a priority class, interactive (everything a user
+    waits for, answers and history summaries) or background (work nobody
+    waits on). Each class may hold at most its share of the slots, and a
+    free slot always goes to a waiting interactive request first: background
+    work is deferred while users wait.
+
+    A waiting request blocks its thread. Called from the Starlette threadpool,
+    keep `max_queue` well below the threadpool size, or waiters starve every
+    other sync endpoint.
+
+    Methods:
+        check_queue_space(priority: str = PRIORITY_INTERACTIVE) -> None:
+            Advisory check that a new request would be queued now.
+
+        slot(priority: str = PRIORITY_INTERACTIVE, timeout: float = None):
+            Context manager holding one generation slot.
+
+        stats() -> dict:
+            Queue depth, in flight count and wait time metrics.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        max_queue: int = 32,
+        queue_timeout: float = 30.0,
+        shares: dict = None,
+    ) -> None:
+        """
+        Initialize the GenerationScheduler class.
+
+        Args:
+            max_concurrency (int, optional): Maximum generations running at once. Defaults to 4.
+            max_queue (int, optional): Maximum requests waiting for a slot. Defaults to 32.
+            queue_timeout (float, optional): Maximum seconds a request waits for a slot. Defaults to 30.0.
+            shares (dict, optional): Maximum slots per priority class. Defaults to all slots for interactive and a quarter (at least 1) for background.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.shares = shares or {
+            PRIORITY_INTERACTIVE: max_concurrency,
+            PRIORITY_BACKGROUND: max(1, max_concurrency // 4),
+        }
+        self.priorities = list(self.shares)
+
+        self._lock = threading.Lock()
+        self._waiters = {priority: deque() for priority in self.priorities}
+        self.in_flight = 0
+        self.class_in_flight = dict.fromkeys(self.priorities, 0)
+        self.admitted = dict.fromkeys(self.priorities, 0)
+        self.rejected = dict.fromkeys(self.priorities, 0)
+        self.timed_out = dict.fromkeys(self.priorities, 0)
+        self.wait_seconds = {
+            priority: deque(maxlen=1024) for priority in self.priorities
+        }
+
+    def _queue_depth(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def _can_run(self, priority: str) -> bool:
+        return (
+            self.in_flight < self.max_concurrency
+            and self.class_in_flight[priority] < self.shares[priority]
+        )
+
+    def _grant(self, priority: str) -> None:
+        self.in_flight += 1
+        self.class_in_flight[priority] += 1
+        self.admitted[priority] += 1
+
+    def _dispatch(self) -> None:
+        # Classes are listed by precedence, a lower class only gets a slot
+        # when nobody of a higher class is waiting.
+        for priority in self.priorities:
+            waiters = self._waiters[priority]
+            while waiters and self._can_run(priority):
+                self._grant(priority)
+                waiters.popleft().set()
+            if waiters:
+                return
+
+    def check_queue_space(self, priority: str = PRIORITY_INTERACTIVE) -> None:
+        """
+        Advisory check that a new request would be queued now.
+
+        Nothing is reserved: concurrent callers can all pass the check, the
+        queue limit is enforced again when `slot()` waits. It only lets an
+        endpoint answer 503 before starting a stream.
+
+        Args:
+            priority (str, optional): The priority class. Defaults to PRIORITY_INTERACTIVE.
+
+        Raises:
+            SchedulerRejected: If the wait queue is full.
+        """
+        with self._lock:
+            if self._queue_depth() >= self.max_queue:
+                self.rejected[priority] += 1
+                raise SchedulerRejected(
+                    f"Generation queue is full ({self.max_queue} waiting)."
+                )
+
+    def _acquire(self, priority: str, timeout: float) -> float:
+        start_time = time.monotonic()
+        with self._lock:
+            waiting_before = any(
+                self._waiters[p]
+                for p in self.priorities[: self.priorities.index(priority) + 1]
+            )
+            if not waiting_before and self._can_run(priority):
+                self._grant(priority)
+                return 0.0
+            if self._queue_depth() >= self.max_queue:
+                self.rejected[priority] += 1
+                raise SchedulerRejected(
+                    f"Generation queue is full ({self.max_queue} waiting)."
+                )
+            waiter = threading.Event()
+            self._waiters[priority].append(waiter)
+
+        if not waiter.wait(timeout=timeout):
+            with self._lock:
+                # The slot may have been granted right after the timeout.
+                if not waiter.is_set():
+                    self._waiters[priority].remove(waiter)
+                    self.timed_out[priority] += 1
+                    raise SchedulerTimeout(
+                        f"Waited {timeout}s for a {priority} generation slot."
+                    )
+        return time.monotonic() - start_time
+
+    def _release(self, priority: str) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.class_in_flight[priority] -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority: str = PRIORITY_INTERACTIVE, timeout: float = None):
+        """
+        Hold one generation slot.
+
+        Args:
+            priority (str, optional): The priority class. Defaults to PRIORITY_INTERACTIVE.
+            timeout (float, optional): Maximum seconds to wait. Defaults to `queue_timeout`.
+
+        Raises:
+            SchedulerRejected: If the wait queue is full.
+            SchedulerTimeout: If no slot is free before the deadline.
+        """
+        if priority not in self.shares:
+            raise ValueError(f"Not support priority: '{priority}'")
+        wait = self._acquire(
+            priority=priority,
+            timeout=self.queue_timeout if timeout is None else timeout,
+        )
+        self.wait_seconds[priority].append(wait)
+        try:
+            yield wait
+        finally:
+            self._release(priority=priority)
+
+    def stats(self) -> dict:
+        """
+        Queue depth, in flight count and wait time metrics, overall and per priority class.
+
+        Returns:
+            dict: The scheduler metrics.
+        """
+        with self._lock:
+            result = {
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queue_depth": self._queue_depth(),
+            }
+            for priority in self.priorities:
+                waits = sorted(self.wait_seconds[priority])
+                result[priority] = {
+                    "share": self.shares[priority],
+                    "in_flight": self.class_in_flight[priority],
+                    "queue_depth": len(self._waiters[priority]),
+                    "admitted": self.admitted[priority],
+                    "rejected": self.rejected[priority],
+                    "timed_out": self.timed_out[priority],
+                    "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+                    "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                    "wait_max": waits[-1] if waits else 0.0,
+                }
+            return result
+
+
+class ScheduledText2Text(Text2Text):
+    """
+    Text2Text model behind a GenerationScheduler.
+
+    Every `run` holds a scheduler slot for the whole stream, the slot is
+    released as soon as the stream ends or is closed by its consumer.
+    """
+
+    def __init__(self, model: Text2Text, scheduler: GenerationScheduler) -> None:
+        super().__init__(model.model_name)
+        self.model = model
+        self.scheduler = scheduler
+
+    def _load_model(self):
+        return self.model._load_model()
+
+    def _release_model(self):
+        return self.model._release_model()
+
+    def run(
+        self,
+        data: list,
+        max_tokens: int = 350,
+        priority: str = PRIORITY_INTERACTIVE,
+        options: dict = None,
+        on_done: Callable[[dict], None] = None,
+    ) -> Generator[str]:
+        # SchedulerRejected / SchedulerTimeout propagate, an overload must
+        # not reach the user or the memory as if it was an answer.
+        with self.scheduler.slot(priority=priority) as wait:
+            if wait:
+                LOGGER.info(f"Wait {wait:.3f}s for {priority} generation slot")
+            if call_cancelled():
+                # The caller gave up while waiting, give the slot back.
+                LOGGER.info(f"Drop abandoned {priority} generation")
+                return
+            yield from self.model.run(
+                data=data,
+                max_tokens=max_tokens,
+                priority=priority,
+                options=options,
+                on_done=on_done,
+            )
@@ -1,8 +1,9 @@
 from typing import List, Union
 
-from jinja2 import Template
-
 from tools.logger import config_logger
+from tools.tracing import traced
+
+from .registry import Section, TemplateRegistry, get_registry
 
 # init log
 LOGGER = config_logger(
@@ -29,54 +30,21 @@ class PromptEngineerService:
             history: Union[str, bool],
             retrieval: Union[str, bool],
             prompt: str,
-            instruction: Union[List[str], None] = None
+            instruction: Union[List[str], None] = None,
+            budget: int = None
         ) -> List[ChatMessage]:
             Generate a prompt based on conversation history, retrieval information, and user question.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, registry: TemplateRegistry = None) -> None:
         """
-        Initialize the Service with a chat prompt builder and predefined templates.
+        Initialize the Service with the compiled prompt templates.
+
+        Args:
+            registry (TemplateRegistry, optional): The prompt templates. Defaults to the registry shared by the process.
         """
-        # self.builder = PromptTemplate()
-
-        self.template = {
-            "chat": """
-{% if instruction %}
-Instructions:
-{% for inst in instruction %}
-- {{ inst }}
-{% endfor %}
-{% endif %}
-
-{% if conversation_history %}
-Conversation History:
-{{ conversation_history }}
-{% endif %}
-
-{% if retriever_info %}
-Retriever's Information:
-{{ retriever_info }}
-{% endif %}
-
-Question: {{ question }}
-Answer:
-""",
-            "summary": """
-Please provide a concise summary of the following conversation history. Focus on the key points and important details mentioned.
-
-{% for topic, conversations in history.items() %}
-Topic: {{ topic }}
-Conversation History:
-{% for conversation in conversations %}
-User ask: {{ conversation.user }} Bot answer: {{ conversation.bot }}
-{% endfor %}
-{% endfor %}
-
-Overall Summary:
-""",
-        }
-        LOGGER.info("Success init prompt !")
+        self.registry = registry or get_registry()
+        LOGGER.info(f"Success init prompt ! templates: {self.registry.versions()}")
 
     def summary_history(self, chat_history: dict) -> str:
         """
@@ -89,11 +57,44 @@ Overall Summary:
             str: The prompt for summarizing the conversation history.
         """
 
-        template = Template(self.template["summary"])
-        prompt = template.render(history=chat_history)
-        LOGGER.info(f"Get history summary prompt : {prompt}")
+        prompt = self.registry.render("summary", history=chat_history)
+        LOGGER.info("Get history summary prompt : %s", prompt)
         return prompt
 
+    def messages(
+        self, user_prompt: str, friendly: str = None, layout: str = "cache"
+    ) -> list:
+        """
+        Build the chat messages sent to the model.
+
+        Ollama reuses the KV cache of the longest prompt prefix it has already
+        seen. The "cache" layout keeps the static system messages first so
+        every turn shares a byte-stable prefix, the variable parts (friendly
+        message, then the user prompt with history and retrieval) come last.
+        The "legacy" layout puts the friendly message in front.
+
+        Args:
+            user_prompt (str): The prompt made by `generate`.
+            friendly (str, optional): Friendly say hello at first time. Defaults to None.
+            layout (str, optional): "cache" or "legacy". Defaults to "cache".
+
+        Returns:
+            list: The chat messages.
+        """
+        messages = [
+            {"role": "system", "content": content}
+            for content in self.instruction_content()
+        ]
+        if friendly:
+            if layout == "legacy":
+                messages.insert(0, {"role": "system", "content": friendly})
+            elif layout == "cache":
+                messages.append({"role": "system", "content": friendly})
+            else:
+                raise ValueError(f"Not support prompt layout: '{layout}'")
+        messages.append({"role": "user", "content": user_prompt})
+        return messages
+
     def instruction_content(self) -> List[str]:
         return [
             "You are a chatbot which name iVIT-Chatbot",
@@ -101,37 +102,42 @@ Overall Summary:
             "If you don't know just tell user I don't know",
         ]
 
+    @traced("prompt.generate")
     def generate(
         self,
         history: Union[str, bool],
         retrieval: Union[str, bool],
         prompt: str,
         instruction: Union[list, None] = None,
+        budget: int = None,
     ) -> str:
         """
         Generate a prompt based on conversation history, retrieval information, and user question.
 
+        Over `budget`, the retrieved information is cut first, then the history.
+
         Args:
             history (Union[str, bool]): Conversation history.
             retrieval (Union[str, bool]): Information retrieved from a database.
             prompt (str): User question.
             instruction (Union[List[str], None], optional): System instructions. Defaults to None.
+            budget (int, optional): Tokens the prompt may use. Defaults to None, no limit.
 
         Returns:
             str: The generated prompt for answering the user question.
         """
-        template = Template(self.template["chat"])
-        prompt = template.render(
+        prompt = self.registry.render(
+            "chat",
+            budget=budget,
             instruction=instruction,
-            conversation_history=history,
-            retriever_info=retrieval,
+            conversation_history=Section(text=history, priority=1),
+            retriever_info=Section(text=retrieval, priority=0),
             question=prompt,
         )
 
-        LOGGER.info(f"Get generate answer prompt : {prompt}")
+        LOGGER.info("Get generate answer prompt : %s", prompt)
         return prompt
 
-
 if __name__ == "__main__":
     prompt_engineering = PromptEngineerService()
     # summary_prompt = prompt_engineering.summary_history()
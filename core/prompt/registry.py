@@ -0,0 +1,338 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+from jinja2 import Environment, Template
+
+from tools.logger import config_logger
+
+# init log
+LOGGER = config_logger(
+    log_name="prompt_registry.log",
+    logger_name="prompt_registry",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+TEMPLATE_FOLDER = Path(__file__).with_name("templates")
+# Template files are named '<name>.v<version>.j2', e.g. 'chat.v1.j2'.
+TEMPLATE_FILE = re.compile(r"^(?P<name>[a-z_]+)\.v(?P<version>\d+)\.j2$")
+# Comma separated 'name=version' pins, e.g. 'chat=1,summary=2'. A template
+# without pin uses its latest version.
+PROMPT_VERSIONS = os.getenv("PROMPT_VERSIONS", "")
+# Seconds between two checks of the template files, 0 disables hot reload.
+PROMPT_RELOAD_SECONDS = float(os.getenv("PROMPT_RELOAD_SECONDS", "2.0"))
+
+# Rough size of a token in characters, close enough to size prompt sections.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The estimated token count.
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN if text else 0
+
+
+@dataclass(frozen=True)
+class Section:
+    """
+    A variable part of a prompt with a token budget.
+
+    Attributes:
+        text (str): The content, falsy values are rendered unchanged.
+        max_tokens (int): Tokens kept at most, None for no limit.
+        priority (int): Sections with the lowest priority are cut first when the prompt is over budget.
+        keep (str): "head" keeps the beginning of a cut text, "tail" its end.
+    """
+
+    text: str | bool | None
+    max_tokens: int = None
+    priority: int = 0
+    keep: str = "head"
+
+    def fit(self, max_tokens: int = None) -> str | bool | None:
+        """
+        The text cut to `max_tokens`, on a word boundary.
+
+        Args:
+            max_tokens (int, optional): Tokens kept at most. Defaults to the section `max_tokens`.
+
+        Returns:
+            str | bool | None: The cut text.
+        """
+        max_tokens = self.max_tokens if max_tokens is None else max_tokens
+        if not self.text or max_tokens is None or estimate_tokens(self.text) <= max_tokens:
+            return self.text
+        if max_tokens <= 0:
+            return ""
+
+        size = max_tokens * CHARS_PER_TOKEN
+        if self.keep == "tail":
+            text = self.text[-size:]
+            return text.split(maxsplit=1)[-1] if " " in text else text
+        text = self.text[:size]
+        return text.rsplit(maxsplit=1)[0] if " " in text else text
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """
+    A compiled template version.
+
+    Attributes:
+        name (str): The template name.
+        version (int): The template version.
+        sha (str): Hash of the source, changes when the file is edited.
+        source (str): The template source.
+        template (Template): The compiled template.
+    """
+
+    name: str
+    version: int
+    sha: str
+    source: str
+    template: Template
+
+    def render(self, **context) -> str:
+        return self.template.render(**context)
+
+    def stream(self, **context) -> Iterator[str]:
+        return self.template.generate(**context)
+
+
+class TemplateRegistry:
+    """
+    TemplateRegistry class.
+
+    This class compiles the prompt templates of a folder once and shares
+    them between services. Changed files are compiled again on the next use
+    (hot reload), at most every `reload_seconds`.
+
+    Templates are versioned: a prompt change is a new '<name>.v<N>.j2' file,
+    so the prompts of a pinned version stay byte-stable and keep hitting the
+    Ollama prefix cache. Editing a version in place is logged as a warning.
+
+    Methods:
+        get(name: str, version: int = None) -> PromptTemplate:
+            The compiled template.
+
+        render(name: str, version: int = None, budget: int = None, **context) -> str:
+            Render a template, cutting its sections to fit the budget.
+
+        stream(name: str, version: int = None, **context) -> Iterator[str]:
+            Render a template chunk by chunk.
+
+        reload() -> None:
+            Compile the new and changed template files.
+
+        versions() -> dict:
+            Version and hash of the template used per name.
+    """
+
+    def __init__(
+        self,
+        folder: str | Path = TEMPLATE_FOLDER,
+        pinned: dict = None,
+        reload_seconds: float = PROMPT_RELOAD_SECONDS,
+    ) -> None:
+        """
+        Initialize the TemplateRegistry class.
+
+        Args:
+            folder (str | Path, optional): Folder of the template files. Defaults to `core/prompt/templates`.
+            pinned (dict, optional): Version used per template name. Defaults to `PROMPT_VERSIONS`.
+            reload_seconds (float, optional): Seconds between two checks of the files, 0 disables hot reload. Defaults to `PROMPT_RELOAD_SECONDS`.
+        """
+        self.folder = Path(folder)
+        self.pinned = pinned if pinned is not None else self._parse_pins(PROMPT_VERSIONS)
+        self.reload_seconds = reload_seconds
+        # Same options as `jinja2.Template`, so the output does not change.
+        self._env = Environment()
+        self._lock = threading.Lock()
+        self._templates = dict()
+        self._mtimes = dict()
+        self._checked_at = 0.0
+        self.reload()
+
+    @staticmethod
+    def _parse_pins(value: str) -> dict:
+        pins = dict()
+        for item in value.split(","):
+            if "=" in item:
+                name, version = item.split("=", 1)
+                pins[name.strip()] = int(version)
+        return pins
+
+    def reload(self) -> None:
+        """
+        Compile the new and changed template files.
+        """
+        with self._lock:
+            self._checked_at = time.monotonic()
+            templates = dict(self._templates)
+            for path in self.folder.iterdir():
+                match = TEMPLATE_FILE.match(path.name)
+                if not match:
+                    continue
+                mtime = path.stat().st_mtime_ns
+                if self._mtimes.get(path.name) == mtime:
+                    continue
+
+                source = path.read_text(encoding="utf-8")
+                key = (match["name"], int(match["version"]))
+                sha = hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+                if key in templates and templates[key].sha == sha:
+                    self._mtimes[path.name] = mtime
+                    continue
+                try:
+                    template = self._env.from_string(source)
+                except Exception as e:
+                    LOGGER.error(f"Can not compile template '{path.name}': {str(e)}")
+                    continue
+
+                if key in templates:
+                    LOGGER.warning(
+                        f"Template '{path.name}' changed in place, add a new version to keep prompt prefixes stable"
+                    )
+                templates[key] = PromptTemplate(
+                    name=key[0], version=key[1], sha=sha, source=source, template=template
+                )
+                self._mtimes[path.name] = mtime
+                LOGGER.info(f"Compile template '{key[0]}' v{key[1]} ({sha})")
+            self._templates = templates
+
+    def get(self, name: str, version: int = None) -> PromptTemplate:
+        """
+        The compiled template.
+
+        Args:
+            name (str): The template name, e.g. 'chat'.
+            version (int, optional): The version. Defaults to the pinned, else the latest version.
+
+        Returns:
+            PromptTemplate: The template.
+
+        Raises:
+            KeyError: If the template or version does not exist.
+        """
+        if (
+            self.reload_seconds
+            and time.monotonic() - self._checked_at >= self.reload_seconds
+        ):
+            self.reload()
+
+        templates = self._templates
+        version = version or self.pinned.get(name)
+        if version is None:
+            versions = [key[1] for key in templates if key[0] == name]
+            if not versions:
+                raise KeyError(f"Template '{name}' not found in '{self.folder}'")
+            version = max(versions)
+        if (name, version) not in templates:
+            raise KeyError(f"Template '{name}' v{version} not found in '{self.folder}'")
+        return templates[(name, version)]
+
+    def render(
+        self, name: str, version: int = None, budget: int = None, **context
+    ) -> str:
+        """
+        Render a template, cutting its sections to fit the budget.
+
+        `Section` values are first cut to their own `max_tokens`. When the
+        prompt is still over `budget` tokens, the sections are cut further,
+        lowest priority first, and the template is rendered once more.
+
+        Args:
+            name (str): The template name.
+            version (int, optional): The version. Defaults to the pinned, else the latest version.
+            budget (int, optional): Tokens the prompt may use. Defaults to None, no limit.
+            **context: The template variables, plain values or `Section`.
+
+        Returns:
+            str: The prompt.
+        """
+        template = self.get(name=name, version=version)
+        sections = {
+            key: value for key, value in context.items() if isinstance(value, Section)
+        }
+        values = {**context, **{key: section.fit() for key, section in sections.items()}}
+        prompt = template.render(**values)
+        if budget is None or not sections:
+            return prompt
+
+        excess = estimate_tokens(prompt) - budget
+        if excess <= 0:
+            return prompt
+        for key, section in sorted(sections.items(), key=lambda item: item[1].priority):
+            size = estimate_tokens(values[key]) if isinstance(values[key], str) else 0
+            if not size:
+                continue
+            cut = min(size, excess)
+            values[key] = section.fit(max_tokens=size - cut)
+            excess -= cut
+            if excess <= 0:
+                break
+        if excess > 0:
+            LOGGER.warning(
+                f"Prompt '{name}' over budget by {excess} tokens after cutting every section"
+            )
+        return template.render(**values)
+
+    def stream(self, name: str, version: int = None, **context) -> Iterator[str]:
+        """
+        Render a template chunk by chunk.
+
+        Args:
+            name (str): The template name.
+            version (int, optional): The version. Defaults to the pinned, else the latest version.
+            **context: The template variables.
+
+        Returns:
+            Iterator[str]: The rendered chunks.
+        """
+        return self.get(name=name, version=version).stream(**context)
+
+    def versions(self) -> dict:
+        """
+        Version and hash of the template used per name.
+
+        Returns:
+            dict: e.g. {"chat": {"version": 1, "sha": "..."}}.
+        """
+        names = {key[0] for key in self._templates}
+        result = dict()
+        for name in sorted(names):
+            template = self.get(name=name)
+            result[name] = {"version": template.version, "sha": template.sha}
+        return result
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> TemplateRegistry:
+    """
+    The registry shared by every prompt service of the process.
+
+    Returns:
+        TemplateRegistry: The shared registry.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = TemplateRegistry()
+        return _registry
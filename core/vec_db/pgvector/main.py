@@ -1,17 +1,28 @@
+import json
+import logging
 import os
 from typing import List
 
+from haystack import Document
+from haystack.components.retrievers.in_memory import InMemoryEmbeddingRetriever
+from haystack.document_stores.in_memory import InMemoryDocumentStore
 from haystack_integrations.components.retrievers.pgvector import (
     PgvectorEmbeddingRetriever,
 )
 from haystack_integrations.document_stores.pgvector import PgvectorDocumentStore
 
-os.environ["PG_CONN_STR"] = (
-    f"postgresql://{os.environ['POSTGRES_USER']}:{os.environ['POSTGRES_PASSWORD']}@{os.environ['POSTGRES_HOST']}:{os.environ['POSTGRES_PORT']}/{os.environ['POSTGRES_DB']}"
-)
-import logging
-
 from tools.logger import config_logger
+from tools.tracing import traced
+
+# "pgvector": the Postgres store, "memory": an in-process store for offline
+# benchmarks, filled from the `VECTOR_STORE_SEED` JSON file.
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pgvector")
+VECTOR_STORE_SEED = os.getenv("VECTOR_STORE_SEED")
+
+if VECTOR_STORE == "pgvector":
+    os.environ["PG_CONN_STR"] = (
+        f"postgresql://{os.environ['POSTGRES_USER']}:{os.environ['POSTGRES_PASSWORD']}@{os.environ['POSTGRES_HOST']}:{os.environ['POSTGRES_PORT']}/{os.environ['POSTGRES_DB']}"
+    )
 
 # init log
 LOGGER = config_logger(
@@ -30,6 +41,9 @@ class Operator:
     This operator allows initializing the vector database, saving documents,
     setting up the retriever, and searching for documents based on query embeddings.
 
+    With `VECTOR_STORE=memory` the documents are kept in process instead,
+    so the service runs without Postgres.
+
     Attributes:
         document_store (PgvectorDocumentStore): The document store for managing vector embeddings.
         retriever (PgvectorEmbeddingRetriever): The retriever for querying the vector database.
@@ -40,6 +54,9 @@ class Operator:
         save(documents: list) -> None:
             Save the documents to the vector database.
 
+        load(path: str) -> int:
+            Save the documents of a JSON file to the vector database.
+
         set_retriever(top_k: int = 2) -> None:
             Set the retriever for querying the vector database.
 
@@ -53,6 +70,8 @@ class Operator:
         embedding_dimension: int = 384,
         vector_function: str = "cosine_similarity",
         search_strategy: str = "hnsw",
+        store: str = VECTOR_STORE,
+        table_name: str = "haystack_documents",
     ) -> None:
         """
         Initialize the Pgvector operator.
@@ -62,24 +81,66 @@ class Operator:
             embedding_dimension (int, optional): Dimension of the embedding vectors. Defaults to 384.
             vector_function (str, optional): Function to use for vector similarity. Defaults to "cosine_similarity".
             search_strategy (str, optional): Strategy for vector search. Defaults to "hnsw".
+            store (str, optional): "pgvector" or "memory". Defaults to the `VECTOR_STORE` environment variable.
+            table_name (str, optional): Postgres table of the documents, e.g. one per embedding model. Defaults to "haystack_documents".
         """
 
+        self.store = store
+        self.vector_function = vector_function
+        if self.store == "memory":
+            self.document_store = InMemoryDocumentStore(
+                embedding_similarity_function=(
+                    "cosine" if vector_function == "cosine_similarity" else "dot_product"
+                )
+            )
+            LOGGER.info("Success init in-memory vector store")
+            if VECTOR_STORE_SEED:
+                self.load(path=VECTOR_STORE_SEED)
+            self.set_retriever()
+            return
+
         logging.info("Init pgvector...")
         # Initializing the DocumentStore
-        self.vector_function = vector_function
         self.document_store = PgvectorDocumentStore(
+            table_name=table_name,
             embedding_dimension=embedding_dimension,
             vector_function=self.vector_function,
             recreate_table=recreate_table,
             search_strategy=search_strategy,
         )
-        LOGGER.info(f"""Success init pgvector 
+        LOGGER.info(f"""Success init pgvector
+                     table_name:{table_name}
                      embedding_dimension:{embedding_dimension}
                      vector_function:{self.vector_function}
                      recreate_table:{recreate_table}
                      search_strategy:{search_strategy}""")
         self.set_retriever()
 
+    def save(self, documents: list) -> None:
+        """
+        Save the documents to the vector database.
+
+        Args:
+            documents (list): Haystack Documents with their embedding.
+        """
+        self.document_store.write_documents(documents)
+        LOGGER.info(f"Save {len(documents)} documents")
+
+    def load(self, path: str) -> int:
+        """
+        Save the documents of a JSON file to the vector database.
+
+        Args:
+            path (str): A JSON list of {"content", "embedding", "meta"} objects.
+
+        Returns:
+            int: Number of saved documents.
+        """
+        with open(path, encoding="utf-8") as f:
+            documents = [Document.from_dict(item) for item in json.load(f)]
+        self.save(documents=documents)
+        return len(documents)
+
     def set_retriever(self, top_k: int = 10) -> None:
         """
         Set the retriever for querying the vector database.
@@ -87,15 +148,21 @@ class Operator:
         Args:
             top_k (int, optional): Maximum number of results to return. Defaults to 2.
         """
-        self.retriever = PgvectorEmbeddingRetriever(
-            document_store=self.document_store,
-            top_k=top_k,
-            vector_function=self.vector_function,
-        )
-        LOGGER.info(f"""Success set retriever 
+        if self.store == "memory":
+            self.retriever = InMemoryEmbeddingRetriever(
+                document_store=self.document_store, top_k=top_k
+            )
+        else:
+            self.retriever = PgvectorEmbeddingRetriever(
+                document_store=self.document_store,
+                top_k=top_k,
+                vector_function=self.vector_function,
+            )
+        LOGGER.info(f"""Success set retriever
                      top_k:{top_k}
                      """)
 
+    @traced("pgvector.search")
     def search(
         self,
         query_embedding: List[float],
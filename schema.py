@@ -1,7 +1,5 @@
 import re
-from typing import List
 
-from fastapi import File, UploadFile
 from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel, model_validator
 
@@ -11,9 +9,16 @@ class PostChat(BaseModel):
     department: str
     prompt: str | None
     friendly: str | None
+    # "text": plain answer text, "ndjson" / "sse": typed events with stages and keep-alives.
+    stream: str = "text"
 
     @model_validator(mode="after")
     def check(self: "PostChat") -> "PostChat":
+        if self.stream not in ("text", "ndjson", "sse"):
+            raise RequestValidationError(
+                {"messages": f"stream: {self.stream} is not 'text', 'ndjson' or 'sse'."}
+            )
+
         if bool(re.search(r"[^a-zA-Z0-9_\-\s/\u4E00-\u9FFF]+", self.username)) is True:
             raise RequestValidationError(
                 {"messages": f"username: {self.username} contain invalid characters."}
@@ -84,18 +89,87 @@ class PostReport(BaseModel):
         return self
 
 
-class PostUpload(BaseModel):
-    files: List[UploadFile] = File(...)
+class PostUploadStream(BaseModel):
+    username: str
+    department: str
+
+    @model_validator(mode="after")
+    def check(self: "PostUploadStream") -> "PostUploadStream":
+        if bool(re.search(r"[^a-zA-Z0-9_\-\s/\u4E00-\u9FFF]+", self.username)) is True:
+            raise RequestValidationError(
+                {"messages": f"username: {self.username} contain invalid characters."}
+            )
+
+        if (
+            bool(re.search(r"[^a-zA-Z0-9_\-\s/\u4E00-\u9FFF]+", self.department))
+            is True
+        ):
+            raise RequestValidationError(
+                {
+                    "messages": f"department: {self.department} contain invalid characters."
+                }
+            )
+        return self
+
+
+class PostUploadInit(BaseModel):
     username: str
     department: str
+    filename: str
+    size: int
+    sha256: str | None = None
 
     @model_validator(mode="after")
-    def check(self: "PostUpload") -> "PostUpload":
-        for file in self.files:
-            if file.content_type != "application/pdf":
-                raise RequestValidationError(
-                    {
-                        "messages": f"Upload files content invalid format: {file.filename}, only support PDF file."
-                    }
-                )
+    def check(self: "PostUploadInit") -> "PostUploadInit":
+        if bool(re.search(r"[^a-zA-Z0-9_\-\s/\u4E00-\u9FFF]+", self.username)) is True:
+            raise RequestValidationError(
+                {"messages": f"username: {self.username} contain invalid characters."}
+            )
+
+        if (
+            bool(re.search(r"[^a-zA-Z0-9_\-\s/\u4E00-\u9FFF]+", self.department))
+            is True
+        ):
+            raise RequestValidationError(
+                {
+                    "messages": f"department: {self.department} contain invalid characters."
+                }
+            )
+
+        if not self.filename.lower().endswith(".pdf"):
+            raise RequestValidationError(
+                {
+                    "messages": f"Upload files content invalid format: {self.filename}, only support PDF file."
+                }
+            )
+
+        if self.sha256 and not re.fullmatch(r"[0-9a-fA-F]{64}", self.sha256):
+            raise RequestValidationError(
+                {"messages": f"sha256: {self.sha256} is not a valid checksum."}
+            )
+        return self
+
+
+class PostIngest(BaseModel):
+    username: str
+    department: str
+    recreate: bool = False
+    reindex: bool = False
+
+    @model_validator(mode="after")
+    def check(self: "PostIngest") -> "PostIngest":
+        if bool(re.search(r"[^a-zA-Z0-9_\-\s/\u4E00-\u9FFF]+", self.username)) is True:
+            raise RequestValidationError(
+                {"messages": f"username: {self.username} contain invalid characters."}
+            )
+
+        if (
+            bool(re.search(r"[^a-zA-Z0-9_\-\s/\u4E00-\u9FFF]+", self.department))
+            is True
+        ):
+            raise RequestValidationError(
+                {
+                    "messages": f"department: {self.department} contain invalid characters."
+                }
+            )
         return self
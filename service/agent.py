@@ -1,4 +1,6 @@
-from collections.abc import Generator
+import time
+from collections.abc import Callable, Generator
+from contextlib import closing
 from typing import Optional
 
 from core.handler.text_to_text import GenText
@@ -9,11 +11,15 @@ from core.models.pattern import (
     TextEmbedding,
     TopicsClassification,
 )
+from core.models.profiles import PROFILE_ANSWER, TokenBudget
 from core.prompt.main import PromptEngineerService
+from tools.circuit_breaker import CircuitBreaker
 from tools.logger import config_logger
+from tools.tracing import span
 
 from .pools.memory import MemoryService
 from .pools.retriever import RetrieverService
+from .pools.single_flight import SingleFlight
 
 
 class Agent:
@@ -24,6 +30,9 @@ class Agent:
     services to process chat prompts and generate responses.
 
     Methods:
+        degraded() -> list:
+            Names of the dependencies whose circuit is not closed.
+
         chat(prompt: str, file: Optional[Image.Image] = None) -> str:
             Handle chat prompt with optional image input and generate a response.
     """
@@ -34,6 +43,9 @@ class Agent:
         text_emb_model: TextEmbedding,
         topics_classifier_service: TopicsClassification,
         topics: list = None,
+        prompt_layout: str = "cache",
+        breakers: dict = None,
+        prompt_budget: int = 6144,
     ) -> None:
         """
         Initialize the Agent with various models and services.
@@ -44,6 +56,9 @@ class Agent:
             img_emb_model (ImageEmbedding): The image embedding model.
             topics_classifier_model (TopicsClassification): The topics classifier model.
             topics (List[str], optional): List of default topics. Defaults to predefined list.
+            prompt_layout (str, optional): Message layout, "cache" keeps a stable prefix for Ollama KV cache reuse, "legacy" is the previous order. Defaults to "cache".
+            breakers (dict, optional): CircuitBreaker of the "topics", "retrieval" and "summary" dependencies. Defaults to breakers with 2s, 3s and 8s latency budgets.
+            prompt_budget (int, optional): Tokens of the user prompt, retrieval and history are cut to fit. Keep it below the model `num_ctx` minus the answer budget. Defaults to 6144.
         """
         if not topics:
             topics = [
@@ -53,8 +68,13 @@ class Agent:
                 "After-sales Service",
                 "Company Information",
             ]
-        self.gentxt_service = GenText(model=gen_text_model)
-        self.memory_service = MemoryService(model=gen_text_model, topics=topics)
+        self.token_budget = TokenBudget()
+        self.gentxt_service = GenText(
+            model=gen_text_model, profile=PROFILE_ANSWER, budget=self.token_budget
+        )
+        self.memory_service = MemoryService(
+            model=gen_text_model, topics=topics, budget=self.token_budget
+        )
         self.retriever_service = RetrieverService(
             text_emb_model=text_emb_model,
         )
@@ -64,12 +84,31 @@ class Agent:
             url=topics_classifier_service.url,
         )
         self.prompt_engineer = PromptEngineerService()
+        self.prompt_layout = prompt_layout
+        self.prompt_budget = prompt_budget
+        self.single_flight = SingleFlight()
+        # A slow or broken dependency degrades the answer instead of failing it.
+        self.breakers = breakers or {
+            "topics": CircuitBreaker(name="topics", timeout=2.0),
+            "retrieval": CircuitBreaker(name="retrieval", timeout=3.0),
+            "summary": CircuitBreaker(name="summary", timeout=8.0),
+        }
+
+    def degraded(self) -> list:
+        """
+        Names of the dependencies whose circuit is not closed.
+
+        Returns:
+            list: The degraded dependencies.
+        """
+        return [name for name, breaker in self.breakers.items() if breaker.degraded]
 
     def chat(
         self,
         log: config_logger,
         prompt: str,
         friendly: str = None,
+        on_stage: Callable[..., None] = None,
     ) -> Generator[str]:
         """
         Handle chat prompt with optional image input and generate a response.
@@ -78,55 +117,102 @@ class Agent:
             log (config_logger): logger.
             prompt (str): The chat prompt from the user.
             friendly (str): Friendly say hello at first time.
+            on_stage (Callable[..., None], optional): Called with the stage name ("classify", "history", "retrieve", "generate") when it starts. Defaults to None.
         """
 
-        try:
-            log.info("Start chat!")
-            log.info(f"User prompt: '{prompt}'.")
-            topics = self.topics_classifier_service.run(sentence=prompt)
-            log.info(f"Topics: '{topics}'.")
-            conversation_history = self.memory_service.get_chat_history(topics=topics)
-            log.info(f"Conversation history: '{conversation_history}'.")
-            instruction = self.memory_service.get_instruction()
-            log.info(f"Instruction: '{instruction}'.")
-            retriever = self.retriever_service.search(data=prompt)
-            log.info(f"Retriever: '{retriever}'.")
-            user_prompt = self.prompt_engineer.generate(
-                history=conversation_history,
-                retrieval=retriever,
-                prompt=prompt,
-                instruction=instruction,
-            )
-            system_prompt = self.prompt_engineer.instruction_content()
-            final_prompt = [
-                {"role": "system", "content": system_prompt[0]},
-                {"role": "system", "content": system_prompt[1]},
-                {"role": "system", "content": system_prompt[2]},
-                {"role": "user", "content": user_prompt},
-            ]
-            if friendly:
-                final_prompt.insert(0, {"role": "system", "content": friendly})
-            log.info(f"Final prompt: '{str(final_prompt)}'.")
-
-        except BaseException:
-            log.error("Can not preprocess prompt")
-            raise RuntimeError
-        
-        try:
-            content = ""
-            for data in self.gentxt_service.run(data=final_prompt):
-                content += data
-                yield data
-        except BaseException:
-            log.error("Can not execute gentxt service")
-            raise RuntimeError
-        
-        log.info(f"Response: '{content}'.")
-
-        try:
-            self.memory_service.remember(
-                topics=topics, user_prompt=prompt, bot_answer=content
-            )
-        except BaseException:
-            log.error("Can not execute memory service")
-            raise RuntimeError
\ No newline at end of file
+        def stage(name: str, **detail) -> None:
+            if on_stage is not None:
+                on_stage(name, **detail)
+
+        # Root span of the request, the stage spans become its children.
+        with span("chat") as trace_span:
+            start_time = time.perf_counter()
+            try:
+                log.info("Start chat!")
+                log.info(f"User prompt: '{prompt}'.")
+                stage("classify")
+                # Unknown topics: look in every topic.
+                topics = self.breakers["topics"].call(
+                    self.topics_classifier_service.run,
+                    sentence=prompt,
+                    fallback=lambda: list(self.topics_classifier_service.topics),
+                )
+                log.info(f"Topics: '{topics}'.")
+                stage("history")
+                conversation_history = self.breakers["summary"].call(
+                    self.memory_service.get_chat_history,
+                    topics=topics,
+                    fallback=lambda: self.memory_service.get_recent_history(topics=topics),
+                )
+                log.info(f"Conversation history: '{conversation_history}'.")
+                instruction = self.memory_service.get_instruction()
+                log.info(f"Instruction: '{instruction}'.")
+                stage("retrieve")
+                retriever = self.breakers["retrieval"].call(
+                    self.retriever_service.search, data=prompt, fallback=lambda: None
+                )
+                log.info(f"Retriever: '{retriever}'.")
+                degraded = self.degraded()
+                if degraded:
+                    log.warning(f"Degraded dependencies: '{degraded}'.")
+                    trace_span.set_attribute("degraded", ",".join(degraded))
+                user_prompt = self.prompt_engineer.generate(
+                    history=conversation_history,
+                    retrieval=retriever,
+                    prompt=prompt,
+                    instruction=instruction,
+                    budget=self.prompt_budget,
+                )
+                final_prompt = self.prompt_engineer.messages(
+                    user_prompt=user_prompt, friendly=friendly, layout=self.prompt_layout
+                )
+                log.info(f"Final prompt: '{str(final_prompt)}'.")
+                stage("generate", degraded=degraded)
+
+            except BaseException:
+                log.error("Can not preprocess prompt")
+                raise RuntimeError
+
+            try:
+                chunks = []
+                # Identical questions with identical context share one generation.
+                flight_key = self.single_flight.key(
+                    prompt=prompt,
+                    context=[conversation_history, retriever, instruction, friendly],
+                )
+                with closing(
+                    self.single_flight.stream(
+                        key=flight_key,
+                        factory=lambda: self.gentxt_service.run(data=final_prompt),
+                    )
+                ) as stream:
+                    for data in stream:
+                        if not chunks:
+                            # Time to first token as seen by the user.
+                            trace_span.set_attribute(
+                                "ttft", time.perf_counter() - start_time
+                            )
+                        chunks.append(data)
+                        yield data
+                content = "".join(chunks)
+            except GeneratorExit:
+                # Client went away, closing the stream stops the generation.
+                log.info(f"Chat cancelled after {len(chunks)} chunks.")
+                raise
+            except BaseException as e:
+                # Overload or failure: no answer, nothing is remembered.
+                log.error("Can not execute gentxt service")
+                raise RuntimeError(str(e)) from e
+
+            log.info(f"Response: '{content}'.")
+            if not content.strip() or content.startswith("Error occurred:"):
+                log.warning("No answer generated, skip remembering it.")
+                return
+
+            try:
+                self.memory_service.remember(
+                    topics=topics, user_prompt=prompt, bot_answer=content
+                )
+            except BaseException:
+                log.error("Can not execute memory service")
+                raise RuntimeError
\ No newline at end of file
@@ -0,0 +1,249 @@
+import asyncio
+import json
+import time
+import uuid
+from collections.abc import Callable
+
+import httpx
+import websockets
+
+from tools.connect_handler import ConnectHandler
+from tools.job_queue import (
+    CHAT_BUSY_SIGNAL,
+    PRIORITY_INGEST,
+    PRIORITY_REINDEX,
+    JobQueue,
+)
+from tools.logger import config_logger
+from tools.metrics import INGEST_JOBS, INGEST_LATENCY
+from tools.progress_bus import ProgressBus
+from tools.task_store import TaskTracker, create_task_store
+
+# init log
+LOGGER = config_logger(
+    log_name="ingestion.log",
+    logger_name="ingestion",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+JOB_TIMEOUT = 60 * 30
+# A job is leased longer than it may run, so it is not claimed again while
+# its worker is still tearing it down after a timeout.
+LEASE_MARGIN = 60 * 5
+
+
+class IngestionService:
+    """
+    Service for running document ingestion jobs from the JobQueue.
+
+    A job asks the doc_embed server to embed an uploaded folder and waits
+    until it is finished. Jobs run with a global concurrency limit and a per
+    tenant limit, failed jobs are retried with backoff by the queue. While
+    live chat is busy, re-index jobs are not started and ingestion is limited
+    to one job, so background embedding never competes with chat for Ollama.
+    Chat in other processes is seen through the `CHAT_BUSY_SIGNAL` of the
+    queue.
+
+    Methods:
+        enqueue(task_id: str, tenant: str, recreate: bool = False, priority: int = PRIORITY_INGEST) -> str:
+            Queue the ingestion of an uploaded folder.
+
+        run() -> None:
+            Claim and execute jobs until stopped.
+
+        stop() -> None:
+            Stop claiming new jobs.
+
+        is_chat_busy() -> bool:
+            Whether live chat runs in this or another process.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        tracker: TaskTracker,
+        doc_embed_url: str,
+        max_concurrency: int = 2,
+        tenant_limit: int = 1,
+        poll_interval: float = 1.0,
+        job_timeout: float = JOB_TIMEOUT,
+        is_chat_busy: Callable[[], bool] = None,
+    ) -> None:
+        """
+        Initialize the IngestionService.
+
+        Args:
+            queue (JobQueue): The persistent job queue.
+            tracker (TaskTracker): Tracker recording the ingestion progress of each upload task.
+            doc_embed_url (str): Base url of the doc_embed server.
+            max_concurrency (int, optional): Maximum jobs running in this worker. Defaults to 2.
+            tenant_limit (int, optional): Maximum jobs running per tenant across all workers. Defaults to 1.
+            poll_interval (float, optional): Seconds between two claims when the queue is idle. Defaults to 1.0.
+            job_timeout (float, optional): Maximum seconds for one job, shorter than the queue lease. Defaults to 30 minutes.
+            is_chat_busy (Callable[[], bool], optional): Returns True while live chat is running in this process. Defaults to None.
+
+        Raises:
+            ValueError: If the queue lease is not longer than `job_timeout`.
+        """
+        if queue.lease_seconds <= job_timeout:
+            raise ValueError(
+                f"Job lease ({queue.lease_seconds}s) must be longer than the job timeout ({job_timeout}s)"
+            )
+        self.queue = queue
+        self.tracker = tracker
+        self.doc_embed_url = doc_embed_url
+        self.max_concurrency = max_concurrency
+        self.tenant_limit = tenant_limit
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        self._is_local_chat_busy = is_chat_busy or (lambda: False)
+        self.worker_id = uuid.uuid4().hex
+        self._running = set()
+        self._stopped = False
+
+    def enqueue(
+        self,
+        task_id: str,
+        tenant: str,
+        recreate: bool = False,
+        priority: int = PRIORITY_INGEST,
+    ) -> str:
+        """
+        Queue the ingestion of an uploaded folder.
+
+        Args:
+            task_id (str): The upload task id, also the folder name under the save path.
+            tenant (str): Owner of the job, the department.
+            recreate (bool, optional): Recreate the vector table. Defaults to False.
+            priority (int, optional): PRIORITY_INGEST or PRIORITY_REINDEX. Defaults to PRIORITY_INGEST.
+
+        Returns:
+            str: The job id.
+        """
+        job_id = self.queue.enqueue(
+            kind="ingest",
+            tenant=tenant,
+            payload={"task_id": task_id, "recreate": recreate},
+            priority=priority,
+        )
+        self.tracker.update(task_id, ingest="queued", ingest_job=job_id)
+        LOGGER.info(f"Queue ingest job '{job_id}' for '{task_id}'")
+        return job_id
+
+    def is_chat_busy(self) -> bool:
+        return self._is_local_chat_busy() or self.queue.is_signaled(CHAT_BUSY_SIGNAL)
+
+    def _claim(self) -> dict | None:
+        if len(self._running) >= self.max_concurrency:
+            return None
+
+        exclude = []
+        if self.is_chat_busy():
+            if self._running:
+                return None
+            exclude = [PRIORITY_REINDEX]
+        return self.queue.claim(
+            worker_id=self.worker_id, tenant_limit=self.tenant_limit, exclude=exclude
+        )
+
+    async def _embed(self, task_id: str, recreate: bool) -> None:
+        async with httpx.AsyncClient(timeout=30) as client:
+            response = await client.post(
+                url=f"{self.doc_embed_url}/embed/doc/",
+                json={"data_folder": task_id, "recreate": recreate},
+            )
+        if response.status_code != 200:
+            raise RuntimeError(f"doc_embed responds {response.status_code}")
+        embed_task_id = response.json()["task_id"]
+
+        ws_url = self.doc_embed_url.replace("http://", "ws://", 1)
+        async with websockets.connect(f"{ws_url}/ws/{embed_task_id}") as ws:
+            async for message in ws:
+                progress = json.loads(message)
+                self.tracker.update(task_id, ingest_progress=progress)
+                if progress.get("task") is True:
+                    return
+        raise RuntimeError("doc_embed closed the progress stream early")
+
+    async def _execute(self, job: dict) -> None:
+        task_id = job["payload"]["task_id"]
+        start_time = time.monotonic()
+        try:
+            self.tracker.update(task_id, ingest="running", ingest_attempts=job["attempts"])
+            await asyncio.wait_for(
+                self._embed(task_id=task_id, recreate=job["payload"]["recreate"]),
+                timeout=self.job_timeout,
+            )
+            await asyncio.to_thread(self.queue.complete, job["job_id"])
+            self.tracker.update(task_id, ingest="done")
+            INGEST_JOBS.labels("done").inc()
+            LOGGER.info(f"Finish ingest job '{job['job_id']}' for '{task_id}'")
+        except Exception as e:
+            job = await asyncio.to_thread(self.queue.fail, job["job_id"], repr(e))
+            self.tracker.update(task_id, ingest=job["status"], ingest_error=repr(e))
+            INGEST_JOBS.labels("retry" if job["status"] == "queued" else job["status"]).inc()
+            LOGGER.error(
+                f"Ingest job '{job['job_id']}' attempt {job['attempts']} failed: {repr(e)}"
+            )
+        finally:
+            INGEST_LATENCY.observe(time.monotonic() - start_time)
+
+    async def run(self) -> None:
+        """
+        Claim and execute jobs until stopped.
+        """
+        LOGGER.info(
+            f"Start ingestion worker '{self.worker_id}', concurrency={self.max_concurrency}, tenant_limit={self.tenant_limit}"
+        )
+        while not self._stopped:
+            try:
+                job = await asyncio.to_thread(self._claim)
+            except Exception as e:
+                LOGGER.error(f"Can not claim ingest job: {repr(e)}")
+                job = None
+
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            task = asyncio.create_task(self._execute(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+        if self._running:
+            await asyncio.wait(self._running)
+
+    def stop(self) -> None:
+        """
+        Stop claiming new jobs, running jobs are finished.
+        """
+        self._stopped = True
+
+
+def create_ingestion_service(
+    connect_handler: ConnectHandler,
+    tracker: TaskTracker,
+    is_chat_busy: Callable[[], bool] = None,
+) -> IngestionService:
+    return IngestionService(
+        queue=JobQueue(
+            path=connect_handler.JOB_QUEUE_PATH,
+            lease_seconds=JOB_TIMEOUT + LEASE_MARGIN,
+        ),
+        tracker=tracker,
+        doc_embed_url=f"http://{connect_handler.DOC_EMBED_HOST}:{connect_handler.DOC_EMBED_PORT}",
+        job_timeout=JOB_TIMEOUT,
+        is_chat_busy=is_chat_busy,
+    )
+
+
+if __name__ == "__main__":
+    # Separate worker mode: python -m service.ingestion
+    connect_handler = ConnectHandler()
+    tracker = TaskTracker(
+        store=create_task_store(url=connect_handler.TASK_STORE_URL), bus=ProgressBus()
+    )
+    service = create_ingestion_service(connect_handler=connect_handler, tracker=tracker)
+    asyncio.run(service.run())
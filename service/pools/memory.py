@@ -1,10 +1,26 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Union
 
 from core.handler.text_to_text import GenText
 from core.memory.long_term import Instruction
 from core.memory.short_term import ChatHistory
 from core.models.pattern import Text2Text
+from core.models.profiles import PROFILE_SUMMARY, TokenBudget
+from core.models.scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
 from core.prompt.main import PromptEngineerService
+from tools.logger import config_logger
+from tools.tracing import traced
+
+# init log
+LOGGER = config_logger(
+    log_name="memory.log",
+    logger_name="memory",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
 
 
 class MemoryService:
@@ -14,6 +30,10 @@ class MemoryService:
     This service includes short-term memory for recent conversation history and
     long-term memory instructions for summarizing and retrieving important information.
 
+    After every turn the summary of its topics is refreshed at background
+    priority, so the next turn usually finds it ready instead of waiting
+    for an interactive summary.
+
     Attributes:
         gen_text_service (GenText): The text generation service used for processing prompts.
         short_term_mem (ChatHistory): Object for managing short-term conversation history.
@@ -24,22 +44,57 @@ class MemoryService:
         remember(topics: List[str], user_prompt: str, bot_answer: str) -> None:
             Store the conversation history in short-term memory.
 
+        refresh_summary(topics: List[str]) -> None:
+            Summarize the conversation history at background priority.
+
         get_instruction() -> List[str]:
             Retrieve the long-term memory instructions.
 
         get_chat_history(topics: List[str]) -> Union[str, None]:
             Retrieve and summarize the conversation history for given topics.
+
+        get_recent_history(topics: List[str], last_n: int = 3) -> Union[str, None]:
+            Retrieve the last turns for given topics without summarizing them.
     """
 
-    def __init__(self, model: Text2Text, topics: list) -> None:
+    def __init__(
+        self,
+        model: Text2Text,
+        topics: list,
+        budget: TokenBudget = None,
+        summary_cache_size: int = 64,
+    ) -> None:
         """
         Initialize the MemoryService with a Text2Text model and other components.
 
         Args:
             model (Text2Text): The text generation model used for processing prompts.
             topics (List[str]): List of default topics.
+            budget (TokenBudget, optional): Adaptive token budget of the summaries. Defaults to None.
+            summary_cache_size (int, optional): Summaries kept, by summary prompt. Defaults to 64.
         """
-        self.gen_text_service = GenText(model=model)
+        # A summary missing on a chat turn is waited for like the answer.
+        self.gen_text_service = GenText(
+            model=model,
+            priority=PRIORITY_INTERACTIVE,
+            profile=PROFILE_SUMMARY,
+            budget=budget,
+        )
+        # Refreshes nobody waits for yield to the user answers.
+        self.refresh_service = GenText(
+            model=model,
+            priority=PRIORITY_BACKGROUND,
+            profile=PROFILE_SUMMARY,
+            budget=budget,
+        )
+        self.summary_cache_size = summary_cache_size
+        self._summaries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        # One refresh at a time, they never take more than one slot.
+        self._refresh_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="summary-refresh"
+        )
         self.short_term_mem = ChatHistory(topics=topics)
         self.long_term = Instruction()
         self.prompt = PromptEngineerService()
@@ -56,6 +111,55 @@ class MemoryService:
         self.short_term_mem.remember(
             topics=topics, user_prompt=user_prompt, bot_answer=bot_answer
         )
+        self.refresh_summary(topics=topics)
+
+    def _summary_prompt(self, topics: list) -> str | None:
+        conversation_history = self.short_term_mem.get(topics=topics)
+        if not conversation_history:
+            return None
+        return self.prompt.summary_history(chat_history=conversation_history)
+
+    def _summarize(self, prompt: str, service: GenText) -> str:
+        summary = "".join(service.run(data=[{"role": "user", "content": prompt}]))
+        # The model reports its failures in the stream, never use them as history.
+        if summary.startswith("Error occurred:"):
+            raise RuntimeError(summary.strip())
+        with self._lock:
+            self._summaries[prompt] = summary
+            self._summaries.move_to_end(prompt)
+            while len(self._summaries) > self.summary_cache_size:
+                self._summaries.popitem(last=False)
+        return summary
+
+    def _refresh(self, prompt: str) -> None:
+        try:
+            self._summarize(prompt=prompt, service=self.refresh_service)
+        except Exception as e:
+            # Overloaded or failed, the next turn summarizes interactively.
+            LOGGER.warning(f"Can not refresh summary: {str(e)}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(prompt)
+
+    def refresh_summary(self, topics: list) -> None:
+        """
+        Summarize the conversation history at background priority.
+
+        The summary is cached for the next `get_chat_history` of the same
+        history. It runs outside the request, its tokens are not accounted
+        to a user.
+
+        Args:
+            topics (List[str]): List of topics to filter the conversation history.
+        """
+        prompt = self._summary_prompt(topics=topics)
+        if prompt is None:
+            return
+        with self._lock:
+            if prompt in self._summaries or prompt in self._refreshing:
+                return
+            self._refreshing.add(prompt)
+        self._refresh_executor.submit(self._refresh, prompt)
 
     def get_instruction(self) -> list:
         """
@@ -66,6 +170,7 @@ class MemoryService:
         """
         return self.long_term.get()
 
+    @traced("memory.summary")
     def get_chat_history(self, topics: list) -> Union[str, None]:
         """
         Retrieve and summarize the conversation history for given topics.
@@ -76,18 +181,38 @@ class MemoryService:
         Returns:
             Union[str, None]: A summary of the conversation history if available, otherwise None.
         """
-        conversation_history = self.short_term_mem.get(topics=topics)
+        summary_his_prompt = self._summary_prompt(topics=topics)
+        if summary_his_prompt is None:
+            return None
+
+        with self._lock:
+            summary = self._summaries.get(summary_his_prompt)
+        if summary is not None:
+            return summary
+        return self._summarize(prompt=summary_his_prompt, service=self.gen_text_service)
+
+    def get_recent_history(self, topics: list, last_n: int = 3) -> str | None:
+        """
+        Retrieve the last turns for given topics without summarizing them.
 
-        if conversation_history:
-            summary_his_prompt = self.prompt.summary_history(
-                chat_history=conversation_history
-            )
+        Used when the summary can not be generated in time.
 
-            summary_history = ""
-            for data in self.gen_text_service.run(
-                data=[{"role": "user", "content": summary_his_prompt}]
-            ):
-                summary_history += data
-            return summary_history
+        Args:
+            topics (List[str]): List of topics to filter the conversation history.
+            last_n (int, optional): Number of turns kept. Defaults to 3.
 
-        return None
+        Returns:
+            Union[str, None]: The last turns if available, otherwise None.
+        """
+        conversations = []
+        for history in self.short_term_mem.get(topics=topics).values():
+            for conversation in history[-last_n:]:
+                if conversation not in conversations:
+                    conversations.append(conversation)
+        if not conversations:
+            return None
+
+        return "\n".join(
+            f"User ask: {conversation['user']} Bot answer: {conversation['bot']}"
+            for conversation in conversations[-last_n:]
+        )
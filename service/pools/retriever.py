@@ -3,6 +3,7 @@ from typing import Union
 from core.handler.embedding.text_embedding import TextEmb
 from core.models.minillm import MinillmModel
 from core.vec_db.pgvector.main import Operator as PgvecDB
+from tools.accounting import add_usage
 
 
 class RetrieverService:
@@ -48,6 +49,7 @@ class RetrieverService:
         """
         data_vector = self.text_emb_service.run(data=data)
         retriever_result = self.pgvec_db.search(query_embedding=data_vector)
+        add_usage(retrieval_rows=len(retriever_result["documents"]))
 
         if retriever_result["documents"]:
             # rank_documents = self.ranker.run(documents=retriever_result["documents"])
@@ -0,0 +1,190 @@
+import contextvars
+import hashlib
+import json
+import re
+import threading
+from collections.abc import Callable, Generator, Iterator
+from contextlib import closing
+
+from tools.accounting import RequestUsage, add_usage, bind_usage
+from tools.logger import config_logger
+
+# init log
+LOGGER = config_logger(
+    log_name="single_flight.log",
+    logger_name="single_flight",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+
+class _Flight:
+    """
+    One upstream generation shared by its subscribers.
+    """
+
+    def __init__(self) -> None:
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.cancelled = False
+        self.subscribers = 0
+        self.cond = threading.Condition()
+        # Upstream usage, charged once when the flight ends.
+        self.usage = RequestUsage(department="", username="")
+        self.charged = False
+
+
+class SingleFlight:
+    """
+    SingleFlight class.
+
+    This class deduplicates identical generations running at the same time.
+    The first request for a key starts the upstream stream in a producer
+    thread, every request for the same key while it runs subscribes to it
+    and receives all chunks from the beginning. The upstream stream is
+    closed when its last subscriber goes away.
+
+    The upstream usage is charged once, to the first subscriber that sees
+    the generation end (or to the last one leaving before). The other
+    subscribers that got the whole answer count its tokens as
+    `shared_completion_tokens`.
+
+    Methods:
+        key(prompt: str, context: list) -> str:
+            Build the dedup key of a request.
+
+        stream(key: str, factory: Callable[[], Iterator[str]]) -> Generator[str]:
+            Stream the generation for a key, starting it if needed.
+
+        stats() -> dict:
+            Started and joined generation counts.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._flights = dict()
+        self.started = 0
+        self.joined = 0
+
+    @staticmethod
+    def key(prompt: str, context: list) -> str:
+        """
+        Build the dedup key of a request.
+
+        Args:
+            prompt (str): The user prompt, compared case and whitespace insensitive.
+            context (list): Everything else the answer depends on (history, retrieval, ...).
+
+        Returns:
+            str: The key.
+        """
+        normalized = re.sub(r"\s+", " ", prompt).strip().lower()
+        payload = json.dumps([normalized, context], ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _produce(
+        self, key: str, flight: _Flight, factory: Callable[[], Iterator[str]]
+    ) -> None:
+        try:
+            with closing(factory()) as upstream:
+                for chunk in upstream:
+                    with flight.cond:
+                        flight.chunks.append(chunk)
+                        flight.cond.notify_all()
+                    if flight.cancelled:
+                        LOGGER.info(f"No subscriber left, stop flight '{key[:12]}'")
+                        break
+        except BaseException as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    def stream(
+        self, key: str, factory: Callable[[], Iterator[str]]
+    ) -> Generator[str]:
+        """
+        Stream the generation for a key, starting it if needed.
+
+        Args:
+            key (str): The dedup key, see `key()`.
+            factory (Callable[[], Iterator[str]]): Starts the upstream stream, only called by the first request.
+
+        Yields:
+            str: The generated chunks.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.started += 1
+                # The producer runs in the first subscriber's context (tracing),
+                # its upstream usage goes to the flight.
+                context = contextvars.copy_context()
+                context.run(bind_usage, flight.usage)
+                threading.Thread(
+                    target=context.run,
+                    args=(self._produce, key, flight, factory),
+                    name="single-flight",
+                    daemon=True,
+                ).start()
+            else:
+                self.joined += 1
+                LOGGER.info(f"Join running flight '{key[:12]}'")
+            flight.subscribers += 1
+
+        finished = False
+        try:
+            index = 0
+            while True:
+                with flight.cond:
+                    while index >= len(flight.chunks) and not flight.done:
+                        flight.cond.wait()
+                    chunks = flight.chunks[index:]
+                    done = flight.done
+                index += len(chunks)
+                yield from chunks
+                if done:
+                    finished = True
+                    break
+            if flight.error is not None:
+                raise RuntimeError(
+                    f"Shared generation failed: {str(flight.error)}"
+                ) from flight.error
+        finally:
+            with self._lock:
+                flight.subscribers -= 1
+                charge = not flight.charged and (finished or flight.subscribers == 0)
+                flight.charged = flight.charged or charge
+                if flight.subscribers == 0:
+                    flight.cancelled = True
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+            # Runs in the subscriber's request context.
+            if charge:
+                add_usage(**flight.usage.snapshot())
+            elif finished:
+                add_usage(
+                    shared_completion_tokens=flight.usage.snapshot()["completion_tokens"]
+                )
+
+    def stats(self) -> dict:
+        """
+        Started and joined generation counts.
+
+        Returns:
+            dict: The counters and the running flights.
+        """
+        with self._lock:
+            return {
+                "started": self.started,
+                "joined": self.joined,
+                "running": len(self._flights),
+            }
@@ -0,0 +1,307 @@
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from collections.abc import Generator, Iterator
+
+from tools.logger import config_logger
+
+# init log
+LOGGER = config_logger(
+    log_name="accounting.log",
+    logger_name="accounting",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+# Counters kept per day, department and user. `shared_completion_tokens`
+# are tokens of a generation another request paid for (see SingleFlight),
+# every upstream call is counted once in `completion_tokens`.
+USAGE_FIELDS = (
+    "requests",
+    "llm_calls",
+    "prompt_tokens",
+    "completion_tokens",
+    "shared_completion_tokens",
+    "embedding_calls",
+    "retrieval_rows",
+    "bytes_streamed",
+    "upload_bytes",
+)
+
+
+class RequestUsage:
+    """
+    RequestUsage class.
+
+    The usage of one request. Upstream calls add to the usage of the request
+    they run for with `add_usage()`, from any thread that inherits the
+    request context.
+
+    Methods:
+        add(**counts) -> None:
+            Add to the counters.
+
+        snapshot() -> Counter:
+            Copy of the counters.
+    """
+
+    def __init__(self, department: str, username: str) -> None:
+        self.department = department
+        self.username = username
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, **counts) -> None:
+        with self._lock:
+            self.counts.update(counts)
+
+    def snapshot(self) -> Counter:
+        with self._lock:
+            return Counter(self.counts)
+
+
+_current_usage = contextvars.ContextVar("current_usage", default=None)
+
+
+def add_usage(**counts) -> None:
+    """
+    Add to the usage of the current request, does nothing outside a request.
+
+    Args:
+        **counts: Values of `USAGE_FIELDS` to add.
+    """
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add(**counts)
+
+
+def bind_usage(usage: RequestUsage) -> None:
+    """
+    Count the upstream calls of the current context into `usage`.
+
+    For work that does not belong to a single request, e.g. a generation
+    shared by several requests, run in its own context copy.
+
+    Args:
+        usage (RequestUsage): The usage to add to.
+    """
+    _current_usage.set(usage)
+
+
+class UsageAccountant:
+    """
+    UsageAccountant class.
+
+    This class aggregates the usage of the requests per day, department and
+    user in memory, and adds it to a SQLite file on `flush()`. Flushes only
+    add to the stored counters, so every uvicorn worker can flush into the
+    same file.
+
+    Methods:
+        record(department: str, username: str, **counts) -> None:
+            Add usage to a user.
+
+        track(iterator: Iterator[str], department: str, username: str) -> Generator[str]:
+            Account a streamed request.
+
+        flush() -> int:
+            Write the aggregated usage to the store.
+
+        query(department: str = None, username: str = None, days: int = 7, group_by: str = "department") -> list:
+            Usage totals read from the store.
+    """
+
+    def __init__(self, path: str, timeout: float = 10.0) -> None:
+        """
+        Initialize the UsageAccountant class.
+
+        Args:
+            path (str): Path of the SQLite file.
+            timeout (float, optional): Seconds to wait for a lock held by another worker. Defaults to 10.0.
+        """
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.path = path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pending = dict()
+
+        columns = ", ".join(f"{field} INTEGER NOT NULL DEFAULT 0" for field in USAGE_FIELDS)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS usage (
+                    day TEXT NOT NULL,
+                    department TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    {columns},
+                    PRIMARY KEY (day, department, username)
+                )
+                """
+            )
+            # Stores created before a counter was added get its column.
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(usage)")}
+            for field in USAGE_FIELDS:
+                if field not in existing:
+                    conn.execute(
+                        f"ALTER TABLE usage ADD COLUMN {field} INTEGER NOT NULL DEFAULT 0"
+                    )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=self.timeout)
+
+    def record(self, department: str, username: str, **counts) -> None:
+        """
+        Add usage to a user.
+
+        Args:
+            department (str): The department.
+            username (str): The username.
+            **counts: Values of `USAGE_FIELDS` to add.
+        """
+        key = (time.strftime("%Y-%m-%d"), department.lower(), username.lower())
+        with self._lock:
+            self._pending.setdefault(key, Counter()).update(counts)
+
+    def track(
+        self, iterator: Iterator[str], department: str, username: str
+    ) -> Generator[str]:
+        """
+        Account a streamed request.
+
+        Every step of `iterator` runs with the request usage as the current
+        one, so the upstream calls it makes are counted even when the steps
+        run in different threads. The usage is recorded when the stream
+        ends, is closed or fails.
+
+        Args:
+            iterator (Iterator[str]): The response stream.
+            department (str): The department.
+            username (str): The username.
+
+        Returns:
+            Generator[str]: The same chunks.
+        """
+        usage = RequestUsage(department=department, username=username)
+        usage.add(requests=1)
+        try:
+            while True:
+                token = _current_usage.set(usage)
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    _current_usage.reset(token)
+                usage.add(bytes_streamed=len(chunk.encode("utf-8")))
+                yield chunk
+        finally:
+            token = _current_usage.set(usage)
+            try:
+                iterator.close()
+            finally:
+                _current_usage.reset(token)
+                self.record(department=department, username=username, **usage.counts)
+
+    def flush(self) -> int:
+        """
+        Write the aggregated usage to the store.
+
+        Returns:
+            int: Number of (day, department, user) rows written.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, dict()
+        if not pending:
+            return 0
+
+        assignments = ", ".join(f"{field} = {field} + excluded.{field}" for field in USAGE_FIELDS)
+        sql = (
+            f"INSERT INTO usage (day, department, username, {', '.join(USAGE_FIELDS)}) "
+            f"VALUES (?, ?, ?, {', '.join('?' for _ in USAGE_FIELDS)}) "
+            f"ON CONFLICT (day, department, username) DO UPDATE SET {assignments}"
+        )
+        rows = [
+            (*key, *(counts.get(field, 0) for field in USAGE_FIELDS))
+            for key, counts in pending.items()
+        ]
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany(sql, rows)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            # Keep the usage for the next flush.
+            LOGGER.error(f"Can not flush usage: {str(e)}")
+            with self._lock:
+                for key, counts in pending.items():
+                    self._pending.setdefault(key, Counter()).update(counts)
+            return 0
+        return len(rows)
+
+    def query(
+        self,
+        department: str = None,
+        username: str = None,
+        days: int = 7,
+        group_by: str = "department",
+    ) -> list:
+        """
+        Usage totals read from the store.
+
+        Args:
+            department (str, optional): Only this department. Defaults to None.
+            username (str, optional): Only this user. Defaults to None.
+            days (int, optional): Number of days, today included. Defaults to 7.
+            group_by (str, optional): "department", "user" or "day". Defaults to "department".
+
+        Returns:
+            list: One dict of totals per group, largest token use first, or by day.
+
+        Raises:
+            ValueError: If `group_by` is not supported.
+        """
+        groups = {
+            "department": ("department",),
+            "user": ("department", "username"),
+            "day": ("day",),
+        }
+        if group_by not in groups:
+            raise ValueError(f"Not support usage group: '{group_by}'")
+
+        conditions, params = ["day >= ?"], [
+            time.strftime("%Y-%m-%d", time.localtime(time.time() - (days - 1) * 86400))
+        ]
+        if department:
+            conditions.append("department = ?")
+            params.append(department.lower())
+        if username:
+            conditions.append("username = ?")
+            params.append(username.lower())
+
+        keys = ", ".join(groups[group_by])
+        totals = ", ".join(f"SUM({field})" for field in USAGE_FIELDS)
+        order = (
+            "day" if group_by == "day" else "SUM(prompt_tokens) + SUM(completion_tokens) DESC"
+        )
+        conn = self._connect()
+        try:
+            result = conn.execute(
+                f"SELECT {keys}, {totals} FROM usage WHERE {' AND '.join(conditions)} "
+                f"GROUP BY {keys} ORDER BY {order}",
+                params,
+            ).fetchall()
+        finally:
+            conn.close()
+        return [dict(zip(groups[group_by] + USAGE_FIELDS, row, strict=True)) for row in result]
@@ -0,0 +1,260 @@
+import contextvars
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+from tools.logger import config_logger
+from tools.metrics import BREAKER_FALLBACKS
+
+# init log
+LOGGER = config_logger(
+    log_name="circuit_breaker.log",
+    logger_name="circuit_breaker",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class Cancellation:
+    """
+    Cancel signal of one breaker call.
+
+    The breaker cancels a call when it stops waiting for it. The code the
+    call runs checks `call_cancelled()` or registers `on_call_cancel()`
+    callbacks, e.g. closing its upstream connection, so abandoned work does
+    not keep holding upstream capacity.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                LOGGER.warning(f"Cancel callback failed: {str(e)}")
+
+    def add(self, callback: Callable[[], None]) -> bool:
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return True
+        return False
+
+    def remove(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+_current_cancellation = contextvars.ContextVar("breaker_cancellation", default=None)
+
+
+def call_cancelled() -> bool:
+    """
+    Whether the breaker call running in this context was abandoned.
+
+    Returns:
+        bool: True after the breaker timed out the call, False outside a breaker call.
+    """
+    cancellation = _current_cancellation.get()
+    return cancellation is not None and cancellation.cancelled
+
+
+@contextmanager
+def on_call_cancel(callback: Callable[[], None]):
+    """
+    Call `callback` from the breaker thread if the running call is abandoned.
+
+    Does nothing outside a breaker call. The callback runs at once when the
+    call is already cancelled.
+
+    Args:
+        callback (Callable[[], None]): e.g. closing an upstream response.
+    """
+    cancellation = _current_cancellation.get()
+    if cancellation is not None and not cancellation.add(callback):
+        callback()
+    try:
+        yield
+    finally:
+        if cancellation is not None:
+            cancellation.remove(callback)
+
+
+class CircuitBreaker:
+    """
+    CircuitBreaker class.
+
+    This class guards the calls to one dependency with a latency budget. A
+    call failing or running longer than `timeout` returns its fallback
+    instead. After `failure_threshold` failures in a row the circuit opens:
+    calls go straight to the fallback for `reset_seconds`, then a single
+    trial call decides whether the circuit closes again.
+
+    Calls run in the breaker's own thread pool, a hanging dependency only
+    uses up its own threads. A timed out call is cancelled (see
+    `Cancellation`), so it stops instead of running on unobserved.
+
+    Methods:
+        call(func: Callable, *args, fallback: Callable, **kwargs):
+            Run a call through the breaker.
+
+        stats() -> dict:
+            State and counters of the breaker.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float,
+        failure_threshold: int = 3,
+        reset_seconds: float = 30.0,
+        max_workers: int = 8,
+    ) -> None:
+        """
+        Initialize the CircuitBreaker class.
+
+        Args:
+            name (str): Name of the dependency.
+            timeout (float): Latency budget of one call in seconds.
+            failure_threshold (int, optional): Failures in a row before the circuit opens. Defaults to 3.
+            reset_seconds (float, optional): Seconds the circuit stays open before a trial call. Defaults to 30.0.
+            max_workers (int, optional): Maximum calls running at once. Defaults to 8.
+        """
+        self.name = name
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"breaker-{name}"
+        )
+        self._lock = threading.Lock()
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.fallbacks = 0
+        self.short_circuits = 0
+        self.opens = 0
+
+    def _allow(self) -> bool:
+        with self._lock:
+            self.calls += 1
+            if self.state == STATE_CLOSED:
+                return True
+            if (
+                self.state == STATE_OPEN
+                and time.monotonic() - self.opened_at >= self.reset_seconds
+            ):
+                # Let one trial call through, the others keep falling back.
+                self.state = STATE_HALF_OPEN
+                return True
+            self.short_circuits += 1
+            return False
+
+    def _on_success(self) -> None:
+        with self._lock:
+            if self.state != STATE_CLOSED:
+                LOGGER.info(f"Close circuit '{self.name}'")
+            self.state = STATE_CLOSED
+            self.failures = 0
+
+    def _on_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == STATE_HALF_OPEN or (
+                self.state == STATE_CLOSED and self.failures >= self.failure_threshold
+            ):
+                LOGGER.warning(f"Open circuit '{self.name}' for {self.reset_seconds}s")
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+                self.opens += 1
+
+    def call(self, func: Callable, *args, fallback: Callable, **kwargs):
+        """
+        Run a call through the breaker.
+
+        Args:
+            func (Callable): The dependency call.
+            *args: Positional arguments of `func`.
+            fallback (Callable): Called without arguments when `func` is skipped, fails or is too slow.
+            **kwargs: Keyword arguments of `func`.
+
+        Returns:
+            The result of `func`, or of `fallback`.
+        """
+        # Why the fallback is used: the circuit is open, or the call failed.
+        outcome = "open"
+        if self._allow():
+            # Run in a copy of the caller context so tracing spans nest.
+            cancellation = Cancellation()
+            context = contextvars.copy_context()
+            context.run(_current_cancellation.set, cancellation)
+            future = self._executor.submit(context.run, func, *args, **kwargs)
+            try:
+                result = future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                # Nobody reads the result any more, stop the call.
+                cancellation.cancel()
+                with self._lock:
+                    self.timeouts += 1
+                outcome = "timeout"
+                LOGGER.warning(f"'{self.name}' exceeded {self.timeout}s, use fallback")
+                self._on_failure()
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                outcome = "error"
+                LOGGER.warning(f"'{self.name}' failed: {str(e)}, use fallback")
+                self._on_failure()
+            else:
+                self._on_success()
+                return result
+
+        with self._lock:
+            self.fallbacks += 1
+        BREAKER_FALLBACKS.labels(self.name, outcome).inc()
+        return fallback()
+
+    @property
+    def degraded(self) -> bool:
+        return self.state != STATE_CLOSED
+
+    def stats(self) -> dict:
+        """
+        State and counters of the breaker.
+
+        Returns:
+            dict: The breaker metrics.
+        """
+        with self._lock:
+            return {
+                "state": self.state,
+                "timeout": self.timeout,
+                "calls": self.calls,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+                "fallbacks": self.fallbacks,
+                "short_circuits": self.short_circuits,
+                "opens": self.opens,
+            }
@@ -6,6 +6,8 @@ from dataclasses import dataclass
 class ConnectHandler:
     OLLAMA_HOST: str = os.getenv("OLLAMA_HOST")
     OLLAMA_PORT: str = os.getenv("OLLAMA_PORT")
+    # Comma separated 'host[:port]' list of Ollama instances, defaults to OLLAMA_HOST.
+    OLLAMA_HOSTS: str = os.getenv("OLLAMA_HOSTS", os.getenv("OLLAMA_HOST"))
 
     BART_HOST: str = os.getenv("BART_HOST")
     BART_PORT: str = os.getenv("BART_PORT")
@@ -16,9 +18,23 @@ class ConnectHandler:
     POSTGRES_PASSWORD: str = os.getenv("POSTGRES_PASSWORD")
     POSTGRES_DB: str = os.getenv("POSTGRES_DB")
 
+    DOC_EMBED_HOST: str = os.getenv("DOC_EMBED_HOST")
+    DOC_EMBED_PORT: str = os.getenv("DOC_EMBED_PORT")
+
     CORE_HOST: str = os.getenv("CORE_HOST")
     CORE_PORT: str = os.getenv("CORE_PORT")
 
+    TASK_STORE_URL: str = os.getenv("TASK_STORE_URL", "sqlite:///task/tasks.db")
+    JOB_QUEUE_PATH: str = os.getenv("JOB_QUEUE_PATH", "task/jobs.db")
+    USAGE_STORE_PATH: str = os.getenv("USAGE_STORE_PATH", "task/usage.db")
+    # "inprocess": run ingestion jobs in the API process, "external": run them
+    # with `python -m service.ingestion`.
+    INGEST_WORKER_MODE: str = os.getenv("INGEST_WORKER_MODE", "inprocess")
+
+    # Token expected in the 'X-Admin-Token' header of the admin endpoints,
+    # they are disabled when it is not set.
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN")
+
 
 if __name__ == "__main__":
     connect_handler = ConnectHandler()
@@ -0,0 +1,334 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Lower value runs first. Live chat never goes through the queue, it is only
+# listed to keep every background priority below it.
+PRIORITY_CHAT = 0
+PRIORITY_INGEST = 10
+PRIORITY_REINDEX = 20
+
+# Signal set by the API workers while live chat runs, read by the ingestion
+# workers of any process.
+CHAT_BUSY_SIGNAL = "chat_busy"
+
+
+class JobQueue:
+    """
+    JobQueue class.
+
+    This class is a persistent job queue kept in a SQLite file. Several
+    workers, in the API process or in a separate process, can claim jobs from
+    the same file. A claimed job is leased: if its worker dies the lease
+    expires and the job is claimed again. Failed jobs are retried with
+    exponential backoff until `max_attempts`. Short lived signals, such as
+    "chat is busy", are shared between the processes through the same file.
+
+    Methods:
+        enqueue(kind: str, tenant: str, payload: dict, priority: int = PRIORITY_INGEST, max_attempts: int = 5) -> str:
+            Add a job.
+
+        claim(worker_id: str, tenant_limit: int, exclude: list = None) -> dict | None:
+            Lease the next runnable job.
+
+        complete(job_id: str) -> None:
+            Mark a job as done.
+
+        fail(job_id: str, error: str) -> dict:
+            Record a failure and schedule a retry or give up.
+
+        get(job_id: str) -> dict | None:
+            Get a job.
+
+        signal(name: str, owner: str, seconds: float) -> None:
+            Raise a signal for `seconds`, 0 clears it.
+
+        is_signaled(name: str) -> bool:
+            Whether any owner currently raises a signal.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        lease_seconds: float = 60 * 30,
+        backoff_seconds: float = 5.0,
+        max_backoff_seconds: float = 60 * 10,
+        timeout: float = 10.0,
+    ) -> None:
+        """
+        Initialize the JobQueue class.
+
+        Args:
+            path (str): Path of the SQLite file.
+            lease_seconds (float, optional): Seconds a claimed job stays owned by its worker. Defaults to 30 minutes.
+            backoff_seconds (float, optional): First retry delay, doubled on every failure. Defaults to 5.0.
+            max_backoff_seconds (float, optional): Maximum retry delay. Defaults to 10 minutes.
+            timeout (float, optional): Seconds to wait for a lock held by another worker. Defaults to 10.0.
+        """
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.timeout = timeout
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                tenant TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                available_at REAL NOT NULL,
+                lease_until REAL,
+                worker_id TEXT,
+                error TEXT,
+                create_time REAL NOT NULL,
+                update_time REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_runnable ON jobs (status, priority, available_at)"
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS signals (
+                name TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                until REAL NOT NULL,
+                PRIMARY KEY (name, owner)
+            )
+            """
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _to_dict(self, row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def enqueue(
+        self,
+        kind: str,
+        tenant: str,
+        payload: dict,
+        priority: int = PRIORITY_INGEST,
+        max_attempts: int = 5,
+    ) -> str:
+        """
+        Add a job.
+
+        Args:
+            kind (str): Job type, selects the handler.
+            tenant (str): Owner of the job, used for the per tenant limit.
+            payload (dict): Handler arguments.
+            priority (int, optional): Lower runs first. Defaults to PRIORITY_INGEST.
+            max_attempts (int, optional): Attempts before the job is given up. Defaults to 5.
+
+        Returns:
+            str: The job id.
+        """
+        job_id = uuid.uuid4().hex
+        now_time = time.time()
+        self._connect().execute(
+            """
+            INSERT INTO jobs (job_id, kind, tenant, payload, priority, status, max_attempts, available_at, create_time, update_time)
+            VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?)
+            """,
+            (
+                job_id,
+                kind,
+                tenant,
+                json.dumps(payload, ensure_ascii=False),
+                priority,
+                max_attempts,
+                now_time,
+                now_time,
+                now_time,
+            ),
+        )
+        return job_id
+
+    def claim(
+        self, worker_id: str, tenant_limit: int, exclude: list = None
+    ) -> dict | None:
+        """
+        Lease the next runnable job.
+
+        Jobs are taken by priority then age, skipping tenants that already
+        run `tenant_limit` jobs. Expired leases are runnable again.
+
+        Args:
+            worker_id (str): Id of the claiming worker.
+            tenant_limit (int): Maximum running jobs per tenant.
+            exclude (list, optional): Priorities not to claim now. Defaults to None.
+
+        Returns:
+            dict | None: The job, or None if nothing is runnable.
+        """
+        now_time = time.time()
+        exclude = exclude or []
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', worker_id = NULL WHERE status = 'running' AND lease_until < ?",
+                (now_time,),
+            )
+            row = conn.execute(
+                f"""
+                SELECT * FROM jobs
+                WHERE status = 'queued' AND available_at <= ?
+                    AND priority NOT IN ({",".join("?" * len(exclude))})
+                    AND tenant NOT IN (
+                        SELECT tenant FROM jobs WHERE status = 'running'
+                        GROUP BY tenant HAVING COUNT(*) >= ?
+                    )
+                ORDER BY priority, create_time
+                LIMIT 1
+                """,
+                (now_time, *exclude, tenant_limit),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            conn.execute(
+                """
+                UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                    lease_until = ?, worker_id = ?, update_time = ?
+                WHERE job_id = ?
+                """,
+                (now_time + self.lease_seconds, worker_id, now_time, row["job_id"]),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        job = self._to_dict(row)
+        job["attempts"] += 1
+        return job
+
+    def complete(self, job_id: str) -> None:
+        """
+        Mark a job as done.
+
+        Args:
+            job_id (str): The job id.
+        """
+        self._connect().execute(
+            "UPDATE jobs SET status = 'done', lease_until = NULL, update_time = ? WHERE job_id = ?",
+            (time.time(), job_id),
+        )
+
+    def fail(self, job_id: str, error: str) -> dict:
+        """
+        Record a failure and schedule a retry, or give up after `max_attempts`.
+
+        Args:
+            job_id (str): The job id.
+            error (str): The failure reason.
+
+        Returns:
+            dict: The updated job.
+        """
+        job = self.get(job_id=job_id)
+        now_time = time.time()
+        if job["attempts"] >= job["max_attempts"]:
+            status, available_at = "failed", job["available_at"]
+        else:
+            delay = min(
+                self.backoff_seconds * 2 ** (job["attempts"] - 1),
+                self.max_backoff_seconds,
+            )
+            status, available_at = "queued", now_time + delay
+
+        self._connect().execute(
+            """
+            UPDATE jobs SET status = ?, available_at = ?, lease_until = NULL,
+                worker_id = NULL, error = ?, update_time = ?
+            WHERE job_id = ?
+            """,
+            (status, available_at, error, now_time, job_id),
+        )
+        return self.get(job_id=job_id)
+
+    def get(self, job_id: str) -> dict | None:
+        """
+        Get a job.
+
+        Args:
+            job_id (str): The job id.
+
+        Returns:
+            dict | None: The job, or None if it does not exist.
+        """
+        row = (
+            self._connect()
+            .execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+            .fetchone()
+        )
+        return self._to_dict(row) if row else None
+
+    def signal(self, name: str, owner: str, seconds: float) -> None:
+        """
+        Raise a signal for `seconds`, 0 clears it.
+
+        An owner keeps a signal raised by renewing it, so the signal of a
+        dead process expires by itself.
+
+        Args:
+            name (str): The signal, e.g. `CHAT_BUSY_SIGNAL`.
+            owner (str): Id of the raising process.
+            seconds (float): Seconds the signal stays raised.
+        """
+        self._connect().execute(
+            """
+            INSERT INTO signals (name, owner, until) VALUES (?, ?, ?)
+            ON CONFLICT (name, owner) DO UPDATE SET until = excluded.until
+            """,
+            (name, owner, time.time() + seconds),
+        )
+
+    def is_signaled(self, name: str) -> bool:
+        """
+        Whether any owner currently raises a signal.
+
+        Args:
+            name (str): The signal.
+
+        Returns:
+            bool: True if the signal is raised.
+        """
+        row = (
+            self._connect()
+            .execute(
+                "SELECT 1 FROM signals WHERE name = ? AND until > ? LIMIT 1",
+                (name, time.time()),
+            )
+            .fetchone()
+        )
+        return row is not None
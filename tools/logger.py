@@ -1,7 +1,10 @@
+import atexit
 import logging
 import os
+import queue
+import threading
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 import colorlog
 
@@ -12,6 +15,133 @@ LOG_LEVEL = {
     "error": logging.ERROR,
 }
 
+# "sync": handlers write in the logging thread, "queue": records are queued
+# and formatted / written by one background thread.
+LOG_MODE = os.getenv("LOG_MODE", "sync")
+# Records waiting in queue mode, new records are dropped when it is full.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Maximum characters of a message, 0 keeps the whole message.
+LOG_MAX_LENGTH = int(os.getenv("LOG_MAX_LENGTH", "0"))
+
+
+class _TruncateFilter(logging.Filter):
+    """
+    Merge the message arguments and cut messages longer than `max_length`.
+
+    Set on the handlers, not on the logger: in queue mode it runs in the
+    listener thread, the logging thread only enqueues the record.
+    """
+
+    def __init__(self, max_length: int) -> None:
+        super().__init__()
+        self.max_length = max_length
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # The handlers of a logger share the record, merge it only once.
+        if getattr(record, "merged", False):
+            return True
+        message = record.getMessage()
+        if self.max_length and len(message) > self.max_length:
+            message = (
+                f"{message[: self.max_length]}... "
+                f"[truncated {len(message) - self.max_length} chars]"
+            )
+        record.msg, record.args = message, None
+        record.merged = True
+        return True
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """
+    Queue handler that never blocks: records are dropped when the queue is full.
+    """
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting, argument merging included, happens in the listener
+        # thread. Log arguments must not be mutated after the call.
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+
+class _Dispatcher(logging.Handler):
+    """
+    Listener side handler, passes a record to the handlers of its logger.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.targets = dict()
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        for handler in self.targets.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+
+class _BoundedQueueListener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # The queue may be full, wait for room rather than losing the sentinel.
+        self.queue.put(self._sentinel)
+
+
+_queue_lock = threading.Lock()
+_queue_handler = None
+_queue_listener = None
+_dispatcher = None
+
+
+def _get_queue_handler() -> _DroppingQueueHandler:
+    """
+    Start the shared log queue and its listener thread on first use.
+    """
+    global _queue_handler, _queue_listener, _dispatcher
+    with _queue_lock:
+        if _queue_handler is None:
+            log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+            _dispatcher = _Dispatcher()
+            _queue_handler = _DroppingQueueHandler(log_queue)
+            _queue_listener = _BoundedQueueListener(log_queue, _dispatcher)
+            _queue_listener.start()
+            atexit.register(stop_log_listener)
+        return _queue_handler
+
+
+def stop_log_listener() -> None:
+    """
+    Flush the queued records and stop the listener thread.
+    """
+    global _queue_listener
+    with _queue_lock:
+        if _queue_listener is not None:
+            _queue_listener.stop()
+            _queue_listener = None
+
+
+def get_log_stats() -> dict:
+    """
+    Queue mode metrics.
+
+    Returns:
+        dict: The log mode, the records waiting in the queue and the dropped records.
+    """
+    return {
+        "mode": LOG_MODE,
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+    }
+
 
 def config_logger(
     log_name: str,
@@ -20,6 +150,10 @@ def config_logger(
     write_mode: str = "a",
     level: str = "debug",
     clear_log: bool = False,
+    mode: str = None,
+    max_length: int = None,
+    max_bytes: int = 5 * 1024 * 1024,
+    backup_count: int = 2,
 ) -> logging.Logger:
     """
     Configures and returns a logger with specified settings.
@@ -31,16 +165,26 @@ def config_logger(
         write_mode (str): The mode in which the log file is opened. Defaults to 'a' (append).
         level (str): The logging level. Defaults to 'debug'.
         clear_log (bool): If True, existing log file will be cleared. Defaults to False.
+        mode (str): "sync" or "queue", see `LOG_MODE`. Defaults to `LOG_MODE`.
+        max_length (int): Maximum characters of a message, 0 for no limit. Defaults to `LOG_MAX_LENGTH`.
+        max_bytes (int): Size of the log file before it rotates. Defaults to 5 MB.
+        backup_count (int): Rotated files kept. Defaults to 2.
 
     Returns:
         logging.Logger: Configured logger.
     """
+    mode = mode or LOG_MODE
+    max_length = LOG_MAX_LENGTH if max_length is None else max_length
+
     logger = logging.getLogger(logger_name)
     logger.setLevel(LOG_LEVEL[level.lower()])
 
     # Remove existing handlers
     if logger.hasHandlers():
         logger.handlers.clear()
+    logger.filters.clear()
+    truncate_filter = _TruncateFilter(max_length=max_length)
+    handlers = []
 
         # if not logger.hasHandlers():
     basic_formatter = logging.Formatter(
@@ -56,7 +200,7 @@ def config_logger(
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(formatter)
     stream_handler.setLevel(LOG_LEVEL[level.lower()])
-    logger.addHandler(stream_handler)
+    handlers.append(stream_handler)
 
     create_day = datetime.now().strftime("%y-%m-%d")
     log_root_path = os.path.join(default_folder, create_day)
@@ -72,19 +216,37 @@ def config_logger(
         file_handler = RotatingFileHandler(
             filename=log_path,
             mode=write_mode,
-            maxBytes=5 * 1024 * 1024,
-            backupCount=2,
+            maxBytes=max_bytes,
+            backupCount=backup_count,
             encoding="utf-8",
         )
         file_handler.setFormatter(basic_formatter)
         file_handler.setLevel(LOG_LEVEL[level.lower()])
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
+
+    for handler in handlers:
+        handler.addFilter(truncate_filter)
+
+    if mode == "queue":
+        queue_handler = _get_queue_handler()
+        with _queue_lock:
+            replaced = _dispatcher.targets.get(logger.name, [])
+            _dispatcher.targets[logger.name] = handlers
+        for handler in replaced:
+            handler.close()
+        logger.addHandler(queue_handler)
+    elif mode == "sync":
+        for handler in handlers:
+            logger.addHandler(handler)
+    else:
+        raise ValueError(f"Not support log mode: '{mode}'")
 
     logger.info(f"Create logger.({logger.name})")
     logger.info(
         "Enabled stream {}".format(
             f"and file mode.({log_name})" if log_name else "mode"
         )
+        + (" through the log queue" if mode == "queue" else "")
     )
     return logger
 
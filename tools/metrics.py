@@ -0,0 +1,235 @@
+import os
+import threading
+import time
+from collections.abc import Callable
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from tools.logger import config_logger
+from tools.tracing import Span, add_span_observer
+
+# init log
+LOGGER = config_logger(
+    log_name="metrics.log",
+    logger_name="metrics",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+# With several uvicorn workers every process writes its samples to this
+# folder and `/metrics` merges them. It must be set, and emptied, before the
+# workers start.
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# "on": the chat pipeline stages are timed with spans, even with tracing
+# off, and exported as stage latency / errors, TTFT and tokens per second.
+# It costs a few observations per request. "off": no stage metrics.
+STAGE_METRICS = os.getenv("STAGE_METRICS", "on")
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Upstream service behind each traced stage.
+STAGE_UPSTREAMS = {
+    "topics.classify": "bart",
+    "embedding.text": "ollama",
+    "llm.generate": "ollama",
+    "pgvector.search": "postgres",
+    "memory.summary": "ollama",
+}
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "HTTP requests by endpoint and status.",
+    ["method", "endpoint", "status"],
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time until the response starts, streamed bodies excluded.",
+    ["method", "endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests being handled.",
+    multiprocess_mode="livesum",
+)
+CHAT_STREAMS = Gauge(
+    "chat_streams_in_flight",
+    "Chat answers being streamed.",
+    multiprocess_mode="livesum",
+)
+STAGE_LATENCY = Histogram(
+    "pipeline_stage_duration_seconds",
+    "Duration of the chat pipeline stages.",
+    ["stage", "upstream"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "pipeline_stage_errors_total",
+    "Failed chat pipeline stages.",
+    ["stage", "upstream"],
+)
+TTFT = Histogram(
+    "chat_time_to_first_token_seconds",
+    "Time from the chat request to its first token.",
+    buckets=LATENCY_BUCKETS,
+)
+TOKENS_PER_SECOND = Histogram(
+    "llm_tokens_per_second",
+    "Generation speed reported by Ollama.",
+    buckets=(1, 5, 10, 20, 40, 80, 160),
+)
+BREAKER_FALLBACKS = Counter(
+    "circuit_breaker_fallbacks_total",
+    "Degraded calls answered by a circuit breaker fallback, by cause.",
+    ["breaker", "outcome"],
+)
+UPLOAD_FILES = Counter(
+    "upload_files_total", "Uploaded files by result.", ["result"]
+)
+UPLOAD_BYTES = Counter("upload_bytes_total", "Uploaded bytes saved.")
+INGEST_JOBS = Counter(
+    "ingest_jobs_total", "Finished ingestion job attempts by status.", ["status"]
+)
+INGEST_LATENCY = Histogram(
+    "ingest_job_duration_seconds",
+    "Duration of one ingestion job attempt.",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800),
+)
+
+_gauges_lock = threading.Lock()
+_gauges = dict()
+
+
+def register_gauge(
+    name: str,
+    documentation: str,
+    func: Callable,
+    labelnames: tuple = (),
+    multiprocess_mode: str = "livesum",
+) -> None:
+    """
+    Export a value read from any cache, pool or queue as a gauge.
+
+    `func` is called by `refresh_gauges()`. It returns a number, or a dict
+    mapping label value tuples to numbers when `labelnames` is given.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The metric help text.
+        func (Callable): Returns the current value(s).
+        labelnames (tuple, optional): Label names of the gauge. Defaults to ().
+        multiprocess_mode (str, optional): How the values of the workers are merged. Defaults to "livesum".
+    """
+    with _gauges_lock:
+        if name in _gauges:
+            raise ValueError(f"Gauge '{name}' is already registered")
+        gauge = Gauge(
+            name, documentation, labelnames, multiprocess_mode=multiprocess_mode
+        )
+        _gauges[name] = (gauge, func, labelnames)
+
+
+def refresh_gauges() -> None:
+    """
+    Read every registered gauge function and set the gauges of this process.
+    """
+    with _gauges_lock:
+        gauges = list(_gauges.items())
+    for name, (gauge, func, labelnames) in gauges:
+        try:
+            value = func()
+            if labelnames:
+                for labels, sample in value.items():
+                    gauge.labels(*labels).set(sample)
+            else:
+                gauge.set(value)
+        except Exception as e:
+            LOGGER.error(f"Can not refresh gauge '{name}': {str(e)}")
+
+
+def _observe_span(span: Span) -> None:
+    labels = (span.name, STAGE_UPSTREAMS.get(span.name, "none"))
+    STAGE_LATENCY.labels(*labels).observe(span.duration)
+    if "error" in span.attributes:
+        STAGE_ERRORS.labels(*labels).inc()
+    if span.name == "chat" and "ttft" in span.attributes:
+        TTFT.observe(span.attributes["ttft"])
+    if "tokens_per_second" in span.attributes:
+        TOKENS_PER_SECOND.observe(span.attributes["tokens_per_second"])
+
+
+if STAGE_METRICS == "on":
+    add_span_observer(_observe_span)
+
+
+def render_metrics() -> tuple:
+    """
+    Render the metrics of every worker in the Prometheus text format.
+
+    Returns:
+        tuple: The body and its content type.
+    """
+    refresh_gauges()
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+    """
+    Drop the live gauges of this worker, call it when the worker stops.
+    """
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class PrometheusMiddleware:
+    """
+    ASGI middleware counting HTTP requests and timing them until the
+    response starts. Endpoints are labelled with their route template.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                route = scope.get("route")
+                endpoint = route.path if route is not None else "unmatched"
+                HTTP_LATENCY.labels(scope["method"], endpoint).observe(
+                    time.perf_counter() - start_time
+                )
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            endpoint = route.path if route is not None else "unmatched"
+            HTTP_REQUESTS.labels(scope["method"], endpoint, str(status_code)).inc()
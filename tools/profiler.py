@@ -0,0 +1,169 @@
+import asyncio
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from tools.logger import config_logger
+
+# init log
+LOGGER = config_logger(
+    log_name="profiler.log",
+    logger_name="profiler",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+MODE_WALL = "wall"
+MODE_ASYNC = "async"
+MAX_PROFILE_SECONDS = 60.0
+
+# Pool threads are numbered ('breaker-topics_3'), merge them in the output.
+_THREAD_NUMBER = re.compile(r"[-_]\d+$")
+
+
+class ProfilerBusy(RuntimeError):
+    """Raised when a profile is requested while another one is running."""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def _thread_stacks(skip: int) -> list:
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks = []
+    for ident, frame in sys._current_frames().items():
+        if ident == skip:
+            continue
+        labels = []
+        while frame is not None:
+            labels.append(_frame_label(frame))
+            frame = frame.f_back
+        name = _THREAD_NUMBER.sub("", names.get(ident, str(ident)))
+        labels.append(f"thread:{name}")
+        stacks.append(";".join(reversed(labels)))
+    return stacks
+
+
+def _task_stacks(loop: asyncio.AbstractEventLoop) -> list:
+    stacks = []
+    for task in asyncio.all_tasks(loop):
+        labels = ["asyncio"]
+        # Follow the await chain from the task coroutine down to the leaf.
+        coro = task.get_coro()
+        while coro is not None:
+            frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+            if frame is None:
+                break
+            labels.append(_frame_label(frame))
+            coro = (
+                getattr(coro, "cr_await", None)
+                or getattr(coro, "gi_yieldfrom", None)
+                or getattr(coro, "ag_await", None)
+            )
+        if coro is not None:
+            labels.append(f"<{type(coro).__name__}>")
+        stacks.append(";".join(labels))
+    return stacks
+
+
+class SamplingProfiler:
+    """
+    SamplingProfiler class.
+
+    This class samples the stacks of the live process for a while and
+    returns them in the collapsed format of flamegraph.pl / speedscope. Nothing
+    is hooked into the interpreter: between two profiles it costs nothing,
+    while profiling only the sampling thread runs.
+
+    The "wall" mode samples every thread, waiting or running, with
+    `sys._current_frames`. The "async" mode samples the await chain of
+    every asyncio task of the loop, showing where requests are suspended.
+
+    Methods:
+        run(seconds: float, mode: str = "wall", interval: float = 0.01, loop: asyncio.AbstractEventLoop = None) -> dict:
+            Sample the process and return the collapsed stacks.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initialize the SamplingProfiler class.
+        """
+        self._lock = threading.Lock()
+
+    def run(
+        self,
+        seconds: float,
+        mode: str = MODE_WALL,
+        interval: float = 0.01,
+        loop: asyncio.AbstractEventLoop = None,
+    ) -> dict:
+        """
+        Sample the process and return the collapsed stacks.
+
+        Blocks for `seconds`, call it from a worker thread.
+
+        Args:
+            seconds (float): Sampling duration, at most `MAX_PROFILE_SECONDS`.
+            mode (str, optional): "wall" or "async". Defaults to "wall".
+            interval (float, optional): Seconds between two samples. Defaults to 0.01.
+            loop (asyncio.AbstractEventLoop, optional): The loop sampled in "async" mode. Defaults to None.
+
+        Returns:
+            dict: "collapsed" text, one 'frame;frame;frame count' line per stack, and the sample counts.
+
+        Raises:
+            ValueError: If the mode or the durations are invalid.
+            ProfilerBusy: If another profile is running.
+        """
+        if mode not in (MODE_WALL, MODE_ASYNC):
+            raise ValueError(f"Not support profile mode: '{mode}'")
+        if mode == MODE_ASYNC and loop is None:
+            raise ValueError("The 'async' mode needs the event loop")
+        if not 0 < seconds <= MAX_PROFILE_SECONDS or not 0 < interval < seconds:
+            raise ValueError(
+                f"Profile seconds must be in (0, {MAX_PROFILE_SECONDS}] and interval in (0, seconds)"
+            )
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+
+        try:
+            LOGGER.info(f"Start {mode} profile for {seconds}s, interval {interval}s")
+            stacks = Counter()
+            samples = 0
+            skip = threading.get_ident()
+            start_time = time.perf_counter()
+            deadline = time.monotonic() + seconds
+            next_sample = time.monotonic()
+            while next_sample < deadline:
+                try:
+                    if mode == MODE_WALL:
+                        stacks.update(_thread_stacks(skip=skip))
+                    else:
+                        stacks.update(_task_stacks(loop=loop))
+                    samples += 1
+                except RuntimeError:
+                    # The task set changed while it was read, skip this sample.
+                    pass
+                next_sample += interval
+                delay = next_sample - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            duration = time.perf_counter() - start_time
+        finally:
+            self._lock.release()
+
+        LOGGER.info(f"Finish {mode} profile, {samples} samples in {duration:.1f}s")
+        collapsed = "\n".join(
+            f"{stack} {count}" for stack, count in stacks.most_common()
+        )
+        return {
+            "mode": mode,
+            "samples": samples,
+            "duration": duration,
+            "collapsed": collapsed + "\n" if collapsed else "",
+        }
@@ -0,0 +1,98 @@
+import asyncio
+import threading
+from contextlib import contextmanager
+
+
+class ProgressBus:
+    """
+    ProgressBus class.
+
+    This class broadcasts task progress to every subscriber of a task. Each
+    subscriber owns a small asyncio queue, so watchers wake up only when a
+    task changes. Progress can be published from the event loop or from worker
+    threads.
+
+    Methods:
+        bind(loop: asyncio.AbstractEventLoop) -> None:
+            Bind the bus to the event loop serving the subscribers.
+
+        publish(task_id: str, progress: dict) -> None:
+            Send a progress snapshot to every subscriber of a task.
+
+        subscribe(task_id: str) -> asyncio.Queue:
+            Context manager giving a queue of progress snapshots for a task.
+    """
+
+    def __init__(self, queue_size: int = 16) -> None:
+        """
+        Initialize the ProgressBus class.
+
+        Args:
+            queue_size (int, optional): Maximum snapshots kept per subscriber, the oldest is dropped first. Defaults to 16.
+        """
+        self.queue_size = queue_size
+        self._loop = None
+        self._lock = threading.Lock()
+        self._subscribers = dict()
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Bind the bus to the event loop serving the subscribers.
+
+        Args:
+            loop (asyncio.AbstractEventLoop): The running event loop.
+        """
+        self._loop = loop
+
+    def _dispatch(self, task_id: str, progress: dict) -> None:
+        with self._lock:
+            queues = list(self._subscribers.get(task_id, ()))
+
+        for queue in queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(progress)
+
+    def publish(self, task_id: str, progress: dict) -> None:
+        """
+        Send a progress snapshot to every subscriber of a task.
+
+        Args:
+            task_id (str): The task id.
+            progress (dict): The progress snapshot, it must not be mutated afterwards.
+        """
+        if self._loop is None or self._loop.is_closed():
+            return
+
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self._loop:
+            self._dispatch(task_id=task_id, progress=progress)
+        else:
+            self._loop.call_soon_threadsafe(self._dispatch, task_id, progress)
+
+    @contextmanager
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        """
+        Subscribe to the progress of a task.
+
+        Args:
+            task_id (str): The task id.
+
+        Yields:
+            asyncio.Queue: Queue receiving the progress snapshots.
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(task_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(task_id, set())
+                subscribers.discard(queue)
+                if not subscribers:
+                    self._subscribers.pop(task_id, None)
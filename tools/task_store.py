@@ -0,0 +1,256 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from tools.progress_bus import ProgressBus
+
+# File fields also copied to the top of the snapshot, the last file wins.
+FLAT_FILE_FIELDS = ("filename", "is_saved")
+
+
+def _merge(snapshot: dict | None, progress: dict, file: dict | None) -> dict:
+    """
+    Merge a progress update into a task snapshot.
+
+    Args:
+        snapshot (dict | None): The current snapshot, None for a new task.
+        progress (dict): Task level fields to update.
+        file (dict | None): Per file fields to update, must contain `filename`.
+
+    Returns:
+        dict: The new snapshot.
+    """
+    now_time = time.time()
+    if snapshot is None:
+        snapshot = {"create_time": now_time, "files": {}}
+
+    snapshot.update(progress)
+    if file:
+        filename = file["filename"]
+        file_info = snapshot["files"].setdefault(filename, {"start_time": now_time})
+        file_info.update({k: v for k, v in file.items() if k != "filename"})
+        if "is_saved" in file:
+            file_info["end_time"] = now_time
+        # Keep the flat fields the existing clients read, per file fields
+        # such as `error` or `duplicate` only live under `files`.
+        snapshot.update({k: v for k, v in file.items() if k in FLAT_FILE_FIELDS})
+
+    if progress.get("task") is True:
+        snapshot["finish_time"] = now_time
+    elif progress.get("task") is False:
+        snapshot.pop("finish_time", None)
+    snapshot["update_time"] = now_time
+    return snapshot
+
+
+class TaskStore(ABC):
+    """
+    Task status store template.
+
+    A store keeps one snapshot per task: the flat `task` / `filename` /
+    `is_saved` fields read by the clients, a `files` dict with per file
+    progress, timing and errors, and `create_time` / `update_time` /
+    `finish_time`.
+
+    Methods:
+        update(task_id: str, progress: dict, file: dict = None) -> dict:
+            Merge an update into a task and return the new snapshot.
+
+        get(task_id: str) -> dict | None:
+            Get the snapshot of a task.
+
+        cleanup(ttl: float) -> int:
+            Remove finished tasks older than `ttl` seconds.
+    """
+
+    @abstractmethod
+    def update(self, task_id: str, progress: dict, file: dict = None) -> dict:
+        raise NotImplementedError("Not implemented 'update()'!")
+
+    @abstractmethod
+    def get(self, task_id: str) -> dict | None:
+        raise NotImplementedError("Not implemented 'get()'!")
+
+    @abstractmethod
+    def cleanup(self, ttl: float) -> int:
+        raise NotImplementedError("Not implemented 'cleanup()'!")
+
+
+class MemoryTaskStore(TaskStore):
+    """
+    Task status store kept in the process memory, for a single worker.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._tasks = dict()
+
+    def update(self, task_id: str, progress: dict, file: dict = None) -> dict:
+        with self._lock:
+            snapshot = _merge(self._tasks.get(task_id), progress, file)
+            self._tasks[task_id] = snapshot
+            return copy.deepcopy(snapshot)
+
+    def get(self, task_id: str) -> dict | None:
+        with self._lock:
+            return copy.deepcopy(self._tasks.get(task_id))
+
+    def cleanup(self, ttl: float) -> int:
+        expire_time = time.time() - ttl
+        with self._lock:
+            expired = [
+                task_id
+                for task_id, snapshot in self._tasks.items()
+                if snapshot.get("finish_time", float("inf")) < expire_time
+            ]
+            for task_id in expired:
+                del self._tasks[task_id]
+        return len(expired)
+
+
+class SQLiteTaskStore(TaskStore):
+    """
+    Task status store kept in a SQLite file.
+
+    Every uvicorn worker opening the same file sees the same tasks, and the
+    tasks survive a restart. Updates run in `BEGIN IMMEDIATE` transactions so
+    concurrent read-modify-write from several processes do not lose fields.
+    """
+
+    def __init__(self, path: str, timeout: float = 10.0) -> None:
+        """
+        Initialize the SQLiteTaskStore class.
+
+        Args:
+            path (str): Path of the SQLite file.
+            timeout (float, optional): Seconds to wait for a lock held by another worker. Defaults to 10.0.
+        """
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    update_time REAL NOT NULL,
+                    finish_time REAL
+                )
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            self._local.conn = conn
+        return conn
+
+    def update(self, task_id: str, progress: dict, file: dict = None) -> dict:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT data FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+            snapshot = _merge(json.loads(row[0]) if row else None, progress, file)
+            conn.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, data, update_time, finish_time) VALUES (?, ?, ?, ?)",
+                (
+                    task_id,
+                    json.dumps(snapshot, ensure_ascii=False),
+                    snapshot["update_time"],
+                    snapshot.get("finish_time"),
+                ),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return snapshot
+
+    def get(self, task_id: str) -> dict | None:
+        row = (
+            self._connect()
+            .execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,))
+            .fetchone()
+        )
+        return json.loads(row[0]) if row else None
+
+    def cleanup(self, ttl: float) -> int:
+        cursor = self._connect().execute(
+            "DELETE FROM tasks WHERE finish_time IS NOT NULL AND finish_time < ?",
+            (time.time() - ttl,),
+        )
+        return cursor.rowcount
+
+
+def create_task_store(url: str) -> TaskStore:
+    """
+    Create a task store from a url.
+
+    Args:
+        url (str): `memory://` or `sqlite:///<path>`.
+
+    Returns:
+        TaskStore: The task store.
+
+    Raises:
+        ValueError: If the url scheme is not supported.
+    """
+    if url.startswith("memory://"):
+        return MemoryTaskStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteTaskStore(path=url[len("sqlite:///") :])
+    raise ValueError(f"Not support task store url: '{url}'")
+
+
+class TaskTracker:
+    """
+    TaskTracker class.
+
+    This class records task progress in a TaskStore and pushes every new
+    snapshot to the watchers of the ProgressBus.
+
+    Methods:
+        update(task_id: str, file: dict = None, **progress) -> dict:
+            Update a task and notify its watchers.
+
+        get(task_id: str) -> dict | None:
+            Get the snapshot of a task.
+    """
+
+    def __init__(self, store: TaskStore, bus: ProgressBus) -> None:
+        self.store = store
+        self.bus = bus
+
+    def update(self, task_id: str, file: dict = None, **progress) -> dict:
+        """
+        Update a task and notify its watchers.
+
+        Args:
+            task_id (str): The task id.
+            file (dict, optional): Per file fields to update, must contain `filename`. Defaults to None.
+            **progress: Task level fields to update.
+
+        Returns:
+            dict: The new snapshot.
+        """
+        snapshot = self.store.update(task_id=task_id, progress=progress, file=file)
+        self.bus.publish(task_id=task_id, progress=snapshot)
+        return snapshot
+
+    def get(self, task_id: str) -> dict | None:
+        return self.store.get(task_id=task_id)
@@ -0,0 +1,264 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+
+from tools.logger import config_logger
+
+# "off": spans cost nothing, "log": finished traces are written to
+# `tracing.log` as JSON, "otel": spans are exported with OpenTelemetry.
+TRACING = os.getenv("TRACING", "off")
+
+# init log
+LOGGER = config_logger(
+    log_name="tracing.log",
+    logger_name="tracing",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+
+class _NoopSpan:
+    """
+    Span used when tracing is off, every method does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        return False
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class _SpanStats:
+    """
+    Duration of the recent spans per name, read by `span_stats()`.
+    """
+
+    def __init__(self, window: int = 1024) -> None:
+        self.window = window
+        self._lock = threading.Lock()
+        self._durations = dict()
+        self._counts = dict()
+        self._errors = dict()
+
+    def add(self, name: str, duration: float, error: bool) -> None:
+        with self._lock:
+            self._durations.setdefault(name, deque(maxlen=self.window)).append(duration)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            self._errors[name] = self._errors.get(name, 0) + int(error)
+
+    def get(self) -> dict:
+        with self._lock:
+            result = dict()
+            for name, durations in self._durations.items():
+                durations = sorted(durations)
+                result[name] = {
+                    "count": self._counts[name],
+                    "errors": self._errors[name],
+                    "p50": durations[len(durations) // 2],
+                    "p95": durations[int(len(durations) * 0.95)],
+                    "max": durations[-1],
+                }
+            return result
+
+
+_stats = _SpanStats()
+_tracer = None
+_observers = []
+
+
+def add_span_observer(observer: Callable) -> None:
+    """
+    Call `observer(span)` for every finished span, e.g. to export metrics.
+
+    Spans are recorded while an observer is registered, even with tracing
+    off; they are then only timed, not linked into a tree.
+
+    Args:
+        observer (Callable): Called with the finished Span.
+    """
+    _observers.append(observer)
+
+
+def _enabled() -> bool:
+    return TRACING != "off" or bool(_observers)
+
+
+def _get_tracer():
+    """
+    Create the OpenTelemetry tracer on first use.
+
+    The exporter follows the standard `OTEL_EXPORTER_OTLP_*` variables when
+    the OTLP exporter is installed, otherwise spans go to the console.
+    """
+    global _tracer
+    if _tracer is None:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import (
+            BatchSpanProcessor,
+            ConsoleSpanExporter,
+        )
+
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter,
+            )
+
+            exporter = OTLPSpanExporter()
+        except ImportError:
+            exporter = ConsoleSpanExporter()
+
+        provider = TracerProvider(
+            resource=Resource.create(
+                {"service.name": os.getenv("OTEL_SERVICE_NAME", "chatbot-core")}
+            )
+        )
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        trace.set_tracer_provider(provider)
+        _tracer = trace.get_tracer("chatbot")
+    return _tracer
+
+
+class Span:
+    """
+    Span class.
+
+    One timed stage of a request. Spans entered while another span is
+    current become its children. The parent is restored explicitly on exit,
+    so a span may be entered and left in different threads (a generator
+    consumed from a thread pool).
+
+    Methods:
+        set_attribute(key: str, value) -> None:
+            Attach a value to the span.
+    """
+
+    def __init__(self, name: str, attributes: dict) -> None:
+        self.name = name
+        self.attributes = dict(attributes)
+        self.children = []
+        self.parent = None
+        self.start_time = 0.0
+        self.duration = 0.0
+        self._otel_span = None
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        # The span tree is only kept for a tracing export, metrics only
+        # observe single spans.
+        if self.parent is not None and TRACING != "off":
+            self.parent.children.append(self)
+        if TRACING == "otel":
+            from opentelemetry import trace
+
+            parent_context = (
+                trace.set_span_in_context(self.parent._otel_span)
+                if self.parent is not None and self.parent._otel_span is not None
+                else None
+            )
+            self._otel_span = _get_tracer().start_span(
+                self.name, context=parent_context, attributes=self.attributes
+            )
+        self.start_time = time.perf_counter()
+        _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        self.duration = time.perf_counter() - self.start_time
+        _current_span.set(self.parent)
+        if exc_type is not None and exc_type is not GeneratorExit:
+            self.attributes["error"] = str(exc_value) or exc_type.__name__
+        error = "error" in self.attributes
+        _stats.add(name=self.name, duration=self.duration, error=error)
+        for observer in _observers:
+            try:
+                observer(self)
+            except Exception as e:
+                LOGGER.error(f"Span observer failed: {str(e)}")
+
+        if self._otel_span is not None:
+            if exc_value is not None and error:
+                self._otel_span.record_exception(exc_value)
+            self._otel_span.end()
+        elif self.parent is None and TRACING == "log":
+            LOGGER.info(json.dumps(self.to_dict(), ensure_ascii=False, default=str))
+        return False
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+        if self._otel_span is not None:
+            self._otel_span.set_attribute(key, value)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "duration": round(self.duration, 6),
+            "attributes": self.attributes,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+def span(name: str, **attributes):
+    """
+    Time a stage of the request.
+
+    Args:
+        name (str): The span name, e.g. 'topics.classify'.
+        **attributes: Values attached to the span.
+
+    Returns:
+        The span context manager, a shared no-op span when tracing is off.
+    """
+    if not _enabled():
+        return _NOOP_SPAN
+    return Span(name=name, attributes=attributes)
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorator running a function inside a span.
+
+    When tracing is off and no observer is registered the function is
+    called directly. Use `span()` inside generator functions, a decorator
+    only times their creation.
+
+    Args:
+        name (str): The span name.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled():
+                return func(*args, **kwargs)
+            with Span(name=name, attributes={}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def span_stats() -> dict:
+    """
+    Count, errors and p50 / p95 / max seconds of the recent spans per name.
+
+    Returns:
+        dict: The span metrics, empty when no span is recorded.
+    """
+    return _stats.get()
@@ -0,0 +1,308 @@
+import hashlib
+import json
+import math
+import os
+import shutil
+import time
+import uuid
+from collections.abc import AsyncIterator
+from pathlib import Path
+
+import aiofiles
+
+
+class UploadSessionError(ValueError):
+    """Raised when an upload session or one of its parts is invalid."""
+
+
+class UploadSessionNotFound(UploadSessionError):
+    """Raised when an upload session does not exist or has expired."""
+
+
+class UploadSessionBusy(UploadSessionError):
+    """Raised when an upload session is being completed by another request."""
+
+
+class UploadSessionHandler:
+    """
+    UploadSessionHandler class.
+
+    This class handles resumable uploads: a file is announced first, then sent
+    in fixed size parts in any order, and finally completed. Each part is
+    written at its offset in a preallocated file and verified by SHA-256.
+    Received parts are recorded as marker files, so any worker sharing the
+    folder can resume a session and nothing is lost on restart. Completing
+    renames the session info file first, so only one request of any worker
+    can complete a session.
+
+    Methods:
+        init(username: str, department: str, filename: str, size: int, sha256: str = None) -> dict:
+            Create a new upload session.
+
+        status(upload_id: str) -> dict:
+            Get the session info and the parts already received.
+
+        write_part(upload_id: str, index: int, stream: AsyncIterator[bytes], sha256: str) -> dict:
+            Write one part at its offset.
+
+        complete(upload_id: str) -> tuple:
+            Claim the session, verify the whole file and return its session info, path and checksum.
+
+        discard(upload_id: str) -> None:
+            Remove a session and its data.
+
+        cleanup() -> int:
+            Remove the sessions without activity within `expire_seconds`.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        part_size: int = 1024 * 1024 * 8,
+        max_file_size: int = 1024 * 1024 * 1024,
+        expire_seconds: int = 60 * 60 * 24,
+    ) -> None:
+        """
+        Initialize the UploadSessionHandler class.
+
+        Args:
+            root (Path): Folder where sessions are stored, must be on the same filesystem as the save folder.
+            part_size (int, optional): Size in bytes of every part except the last one. Defaults to 8 MB.
+            max_file_size (int, optional): Maximum size in bytes of an uploaded file. Defaults to 1 GB.
+            expire_seconds (int, optional): Sessions without a received byte for longer are removed. Defaults to one day.
+        """
+        self.root = Path(root)
+        self.part_size = part_size
+        self.max_file_size = max_file_size
+        self.expire_seconds = expire_seconds
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _session_path(self, upload_id: str) -> Path:
+        if not upload_id.isalnum():
+            raise UploadSessionNotFound(f"Upload id '{upload_id}' is invalid.")
+        return self.root / upload_id
+
+    def _session_dir(self, upload_id: str) -> Path:
+        session_dir = self._session_path(upload_id)
+        if not (session_dir / "meta.json").exists():
+            if (session_dir / "complete.json").exists():
+                raise UploadSessionBusy(f"Upload id '{upload_id}' is being completed.")
+            raise UploadSessionNotFound(f"Upload id '{upload_id}' does not exist.")
+        return session_dir
+
+    def _load(self, upload_id: str) -> dict:
+        with open(self._session_dir(upload_id) / "meta.json", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _received(self, upload_id: str) -> list:
+        parts_dir = self._session_dir(upload_id) / "parts"
+        return sorted(int(path.stem) for path in parts_dir.glob("*.sha256"))
+
+    @staticmethod
+    def _last_activity(session_dir: Path) -> float:
+        # The data file changes with every received chunk, also while a
+        # part is still being written by another worker.
+        paths = [session_dir, session_dir / "data", *session_dir.glob("parts/*")]
+        mtimes = []
+        for path in paths:
+            try:
+                mtimes.append(path.stat().st_mtime)
+            except FileNotFoundError:
+                pass
+        return max(mtimes, default=0.0)
+
+    def cleanup(self) -> int:
+        """
+        Remove the sessions without activity within `expire_seconds`.
+
+        Returns:
+            int: Number of removed sessions.
+        """
+        now_time = time.time()
+        removed = 0
+        for session_dir in self.root.iterdir():
+            if now_time - self._last_activity(session_dir) > self.expire_seconds:
+                shutil.rmtree(session_dir, ignore_errors=True)
+                removed += 1
+        return removed
+
+    def init(
+        self,
+        username: str,
+        department: str,
+        filename: str,
+        size: int,
+        sha256: str = None,
+    ) -> dict:
+        """
+        Create a new upload session and preallocate its data file.
+
+        Args:
+            username (str): The username.
+            department (str): The department the user belongs to.
+            filename (str): Name of the uploaded file.
+            size (int): Total size in bytes of the file.
+            sha256 (str, optional): Expected SHA-256 of the whole file. Defaults to None.
+
+        Returns:
+            dict: The session info.
+
+        Raises:
+            UploadSessionError: If the file size is invalid.
+        """
+        if size <= 0 or size > self.max_file_size:
+            raise UploadSessionError(
+                f"File size must be between 1 and {self.max_file_size} bytes."
+            )
+        self.cleanup()
+
+        upload_id = uuid.uuid4().hex
+        session_dir = self.root / upload_id
+        (session_dir / "parts").mkdir(parents=True)
+        with open(session_dir / "data", "wb") as f:
+            f.truncate(size)
+
+        session = {
+            "upload_id": upload_id,
+            "username": username,
+            "department": department,
+            "filename": Path(filename).name,
+            "size": size,
+            "sha256": sha256,
+            "part_size": self.part_size,
+            "parts": math.ceil(size / self.part_size),
+            "create_time": time.time(),
+        }
+        with open(session_dir / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(session, f, ensure_ascii=False, indent=4)
+        return session
+
+    def status(self, upload_id: str) -> dict:
+        """
+        Get the session info and the parts already received.
+
+        Args:
+            upload_id (str): The upload id.
+
+        Returns:
+            dict: The session info with a `received` list of part indexes.
+        """
+        session = self._load(upload_id)
+        session["received"] = self._received(upload_id)
+        return session
+
+    async def write_part(
+        self, upload_id: str, index: int, stream: AsyncIterator[bytes], sha256: str
+    ) -> dict:
+        """
+        Write one part at its offset and verify its checksum.
+
+        The part is only marked as received when its SHA-256 matches, a
+        mismatching part can simply be sent again.
+
+        Args:
+            upload_id (str): The upload id.
+            index (int): Index of the part, starting from 0.
+            stream (AsyncIterator[bytes]): The part body.
+            sha256 (str): Expected SHA-256 of the part.
+
+        Returns:
+            dict: The part index, its size and checksum.
+
+        Raises:
+            UploadSessionError: If the index, the size or the checksum is invalid.
+        """
+        session = self._load(upload_id)
+        if not 0 <= index < session["parts"]:
+            raise UploadSessionError(f"Part index {index} is out of range.")
+
+        offset = index * session["part_size"]
+        expected_size = min(session["part_size"], session["size"] - offset)
+        session_dir = self._session_dir(upload_id)
+        marker = session_dir / "parts" / f"{index}.sha256"
+        marker.unlink(missing_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+
+        async with aiofiles.open(session_dir / "data", "r+b") as f:
+            await f.seek(offset)
+            async for chunk in stream:
+                size += len(chunk)
+                if size > expected_size:
+                    raise UploadSessionError(
+                        f"Part {index} exceeds {expected_size} bytes."
+                    )
+                digest.update(chunk)
+                await f.write(chunk)
+
+        if size != expected_size:
+            raise UploadSessionError(
+                f"Part {index} has {size} bytes, expected {expected_size}."
+            )
+        if digest.hexdigest() != sha256.lower():
+            raise UploadSessionError(f"Part {index} checksum mismatch.")
+
+        marker.write_text(digest.hexdigest(), encoding="utf-8")
+        os.utime(session_dir)
+        return {"index": index, "size": size, "sha256": digest.hexdigest()}
+
+    def complete(self, upload_id: str) -> tuple:
+        """
+        Claim the session and verify that every part is received and the whole checksum matches.
+
+        The session info file is renamed first, which succeeds for one
+        request only. A failed verification gives the session back, so the
+        missing parts can still be sent. A claimed session is removed with
+        `discard()`.
+
+        Args:
+            upload_id (str): The upload id.
+
+        Returns:
+            tuple: The session info, the path of the data file and its SHA-256.
+
+        Raises:
+            UploadSessionNotFound: If the session does not exist.
+            UploadSessionBusy: If the session is being completed by another request.
+            UploadSessionError: If parts are missing or the checksum mismatches.
+        """
+        session_dir = self._session_dir(upload_id)
+        claimed = session_dir / "complete.json"
+        try:
+            os.rename(session_dir / "meta.json", claimed)
+        except FileNotFoundError:
+            raise UploadSessionBusy(
+                f"Upload id '{upload_id}' is being completed."
+            ) from None
+
+        try:
+            with open(claimed, encoding="utf-8") as f:
+                session = json.load(f)
+            received = sorted(
+                int(path.stem) for path in (session_dir / "parts").glob("*.sha256")
+            )
+            missing = sorted(set(range(session["parts"])) - set(received))
+            if missing:
+                raise UploadSessionError(f"Missing parts: {missing}")
+
+            path = session_dir / "data"
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                while chunk := f.read(session["part_size"]):
+                    digest.update(chunk)
+
+            if session["sha256"] and digest.hexdigest() != session["sha256"].lower():
+                raise UploadSessionError("File checksum mismatch.")
+        except Exception:
+            os.rename(claimed, session_dir / "meta.json")
+            raise
+        return session, path, digest.hexdigest()
+
+    def discard(self, upload_id: str) -> None:
+        """
+        Remove a session and its data.
+
+        Args:
+            upload_id (str): The upload id.
+        """
+        shutil.rmtree(self._session_path(upload_id), ignore_errors=True)
@@ -6,6 +6,58 @@ import time
 
 from tools.logger import config_logger
 
+# One sink for the activity of every user, the records are tagged with the
+# user and department instead of going to a file per user. It is sized for
+# the whole user population and long prompts / answers are cut.
+LOGGER = config_logger(
+    log_name="user_activity.log",
+    logger_name="user_activity",
+    default_folder="./feedback",
+    write_mode="a",
+    level="debug",
+    max_length=int(os.getenv("USER_LOG_MAX_LENGTH", "2000")),
+    max_bytes=int(os.getenv("USER_LOG_MAX_BYTES", str(50 * 1024 * 1024))),
+    backup_count=int(os.getenv("USER_LOG_BACKUP_COUNT", "10")),
+)
+# User feedback has its own file, the chat traffic never rotates it out.
+FEEDBACK_LOGGER = config_logger(
+    log_name="user_feedback.log",
+    logger_name="user_feedback",
+    default_folder="./feedback",
+    write_mode="a",
+    level="debug",
+    max_bytes=50 * 1024 * 1024,
+    backup_count=10,
+)
+
+
+class UserActivityLogger(logging.LoggerAdapter):
+    """
+    Logger of one user, writes to the shared user activity sink.
+
+    Messages are prefixed with `[department/username]` and the records carry
+    `username` and `department` attributes for structured handlers.
+
+    Methods:
+        feedback(msg: str, *args, **kwargs) -> None:
+            Write to the feedback sink.
+    """
+
+    def process(self, msg, kwargs):
+        kwargs["extra"] = {**self.extra, **kwargs.get("extra", {})}
+        return f"[{self.extra['department']}/{self.extra['username']}] {msg}", kwargs
+
+    def feedback(self, msg: str, *args, **kwargs) -> None:
+        """
+        Write to the feedback sink, kept apart from the chat activity.
+
+        Args:
+            msg (str): The message, with lazy `%s` arguments.
+        """
+        msg, kwargs = self.process(msg, kwargs)
+        kwargs.setdefault("stacklevel", 2)
+        FEEDBACK_LOGGER.info(msg, *args, **kwargs)
+
 
 class UserHandler:
     """
@@ -50,9 +102,6 @@ class UserHandler:
 
             users_info_copy = copy.deepcopy(users_info)
             for department, user_info in users_info_copy.items():
-                users_info[department]["log"] = self._create_log(
-                    username=user_info["name"], department=department
-                )
                 now_time = time.time()
                 if user_info.__contains__("create_time"):
                     users_info[department]["reload_time"] = now_time
@@ -62,25 +111,23 @@ class UserHandler:
 
         return users_info
 
-    def _create_log(self, username: str, department: str) -> logging.Logger:
+    def _create_log(self, username: str, department: str) -> UserActivityLogger:
         """
         Create a logger for a user.
 
+        The logger opens no file of its own, so the number of open files does
+        not grow with the number of users.
+
         Args:
             username (str): The username.
             department (str): The department the user belongs to.
 
         Returns:
-            logging.Logger: Configured logger for the user.
-        """
-        log = config_logger(
-            log_name=f"{department}_{username}.log",
-            logger_name=f"{department}_{username}",
-            default_folder="./feedback",
-            write_mode="w",
-            level="debug",
+            UserActivityLogger: Logger tagged with the user.
+        """
+        return UserActivityLogger(
+            LOGGER, {"username": username, "department": department}
         )
-        return log
 
     def _save(
         self,
@@ -117,14 +164,10 @@ class UserHandler:
         username = username.lower()
         department = department.lower()
         now_time = time.time()
-        log = self._create_log(username=username, department=department)
         self.users_info.update(
             {department: {"name": username, "create_time": now_time}}
         )
-        if self.users_info[department].__contains__("log"):
-            del self.users_info[department]["log"]
         self._save(users_info=self.users_info)
-        self.users_info[department]["log"] = log
 
     def check(self, username: str, department: str) -> bool:
         """
@@ -144,7 +187,7 @@ class UserHandler:
                 return True
         return False
 
-    def get(self, username: str, department: str) -> dict:
+    def get(self, username: str, department: str) -> UserActivityLogger:
         """
         Get the logger for a user.
 
@@ -153,9 +196,12 @@ class UserHandler:
             department (str): The department the user belongs to.
 
         Returns:
-            dict: The logger for the user.
+            UserActivityLogger: The logger for the user.
         """
         username = username.lower()
         department = department.lower()
 
-        return self.users_info[department]["log"]
+        # Loggers are cheap adapters over the shared sink, none is kept per user.
+        return self._create_log(
+            username=self.users_info[department]["name"], department=department
+        )
@@ -1,32 +1,351 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List
 
 import aiofiles
-from fastapi import UploadFile
+from fastapi import Request
+from multipart.multipart import MultipartParser, parse_options_header
 
-import app
+from tools.metrics import UPLOAD_BYTES, UPLOAD_FILES
+from tools.task_store import TaskTracker
 
+MANIFEST_NAME = ".manifest.json"
+MANIFEST_LOCK_NAME = ".manifest.lock"
 
-async def async_write_file(path: Path, file: UploadFile, chunk_size: int) -> tuple:
-    async with aiofiles.open(path, "wb") as f:
-        while chunk := await file.read(chunk_size):
-            await f.write(chunk)
 
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds the per-file or per-request size limit."""
 
-async def async_write_multi_files(
-    files: List[UploadFile], save_dir: Path, chunk_size: int
-):
-    if not app.tasks_status.get(save_dir.name):
-        app.tasks_status.update({save_dir.name: dict()})
-    app.tasks_status[save_dir.name].update({"task": False})
-    for file in files:
-        path = Path(save_dir) / file.filename
+
+class UploadFormatError(ValueError):
+    """Raised when a multipart upload is malformed or contains a non PDF file."""
+
+
+@dataclass
+class StagedFile:
+    filename: str
+    path: Path
+    size: int = 0
+    sha256: str = ""
+
+
+@dataclass
+class StagedUpload:
+    fields: dict = field(default_factory=dict)
+    files: list[StagedFile] = field(default_factory=list)
+
+
+class _PartWriter:
+    """
+    Write one multipart file part to disk through a bounded queue.
+
+    The parser keeps reading the request body while earlier parts are still
+    being flushed: `finish()` only marks the end of the part, `wait()` is
+    awaited once the whole body is read. The SHA-256 and the size limit are
+    computed on the same bytes that are written.
+    """
+
+    def __init__(
+        self,
+        staged: StagedFile,
+        max_file_size: int,
+        semaphore: asyncio.Semaphore,
+        queue_size: int = 4,
+    ) -> None:
+        self.staged = staged
+        self.max_file_size = max_file_size
+        self.semaphore = semaphore
+        self.digest = hashlib.sha256()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.task = asyncio.create_task(self._drain())
+
+    async def _drain(self) -> None:
+        async with self.semaphore:
+            async with aiofiles.open(self.staged.path, "wb") as f:
+                while (chunk := await self.queue.get()) is not None:
+                    await f.write(chunk)
+
+    async def write(self, chunk: bytes) -> None:
+        self.staged.size += len(chunk)
+        if self.staged.size > self.max_file_size:
+            raise UploadTooLargeError(
+                f"File '{self.staged.filename}' exceeds {self.max_file_size} bytes."
+            )
+        self.digest.update(chunk)
+        await self.queue.put(chunk)
+
+    async def finish(self) -> None:
+        self.staged.sha256 = self.digest.hexdigest()
+        await self.queue.put(None)
+
+    async def wait(self) -> None:
+        await self.task
+
+    async def abort(self) -> None:
+        self.task.cancel()
         try:
-            await async_write_file(path=path, file=file, chunk_size=chunk_size)
-            app.tasks_status[save_dir.name].update({"filename": f"{file.filename}"})
-            app.tasks_status[save_dir.name].update({"is_saved": True})
-        except BaseException:
-            app.tasks_status[save_dir.name].update({"filename": f"{file.filename}"})
-            app.tasks_status[save_dir.name].update({"is_saved": False})
-
-    app.tasks_status[save_dir.name].update({"task": True})
+            await self.task
+        except (asyncio.CancelledError, Exception):
+            pass
+        self.staged.path.unlink(missing_ok=True)
+
+
+async def async_stream_multi_files(
+    request: Request,
+    staging_dir: Path,
+    max_file_size: int,
+    max_request_size: int,
+    max_concurrent_writes: int = 4,
+) -> StagedUpload:
+    """
+    Stream a multipart request body straight to disk.
+
+    File parts are written to `staging_dir` while the body is being received,
+    up to `max_concurrent_writes` of them at the same time, form fields are
+    collected as text. Size limits are checked before and
+    while reading, so an oversized request is rejected without being stored.
+
+    Args:
+        request (Request): The incoming multipart request.
+        staging_dir (Path): Folder for partially received files, must be on the same filesystem as the save folder.
+        max_file_size (int): Maximum size in bytes of a single file.
+        max_request_size (int): Maximum size in bytes of the whole request body.
+        max_concurrent_writes (int, optional): Maximum number of files flushed at the same time. Defaults to 4.
+
+    Returns:
+        StagedUpload: The form fields and the staged files.
+
+    Raises:
+        UploadTooLargeError: If a size limit is exceeded.
+        UploadFormatError: If the body is not multipart, a file is not a PDF or file names are empty or repeated.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and int(content_length) > max_request_size:
+        raise UploadTooLargeError(f"Request exceeds {max_request_size} bytes.")
+
+    content_type, params = parse_options_header(request.headers.get("content-type"))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadFormatError("Request must be 'multipart/form-data'.")
+
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    semaphore = asyncio.Semaphore(max_concurrent_writes)
+    upload = StagedUpload()
+    writers: list[_PartWriter] = []
+    events = []
+    part = {}
+
+    def on_part_begin():
+        part.clear()
+        part.update({"headers": {}, "name": b"", "value": b""})
+
+    def on_header_field(data, start, end):
+        part["name"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["name"].lower()] = part["value"]
+        part["name"], part["value"] = b"", b""
+
+    def on_headers_finished():
+        events.append(("begin", dict(part["headers"])))
+
+    def on_part_data(data, start, end):
+        events.append(("data", data[start:end]))
+
+    def on_part_end():
+        events.append(("end", None))
+
+    parser = MultipartParser(
+        params[b"boundary"],
+        {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+        },
+    )
+
+    received = 0
+    writer = None
+    field_name, field_data = None, []
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_request_size:
+                raise UploadTooLargeError(f"Request exceeds {max_request_size} bytes.")
+            parser.write(chunk)
+
+            for event, payload in events:
+                if event == "begin":
+                    _, options = parse_options_header(
+                        payload.get(b"content-disposition", b"")
+                    )
+                    field_name = options.get(b"name", b"").decode("utf-8")
+                    if b"filename" not in options:
+                        writer, field_data = None, []
+                        continue
+
+                    filename = Path(options[b"filename"].decode("utf-8")).name
+                    if not filename:
+                        raise UploadFormatError("Upload files must have a filename.")
+                    if any(item.filename == filename for item in upload.files):
+                        raise UploadFormatError(
+                            f"Upload files contain '{filename}' more than once."
+                        )
+                    if payload.get(b"content-type") != b"application/pdf":
+                        raise UploadFormatError(
+                            f"Upload files content invalid format: {filename}, only support PDF file."
+                        )
+                    staged = StagedFile(
+                        filename=filename, path=staging_dir / uuid.uuid4().hex
+                    )
+                    upload.files.append(staged)
+                    writer = _PartWriter(
+                        staged=staged,
+                        max_file_size=max_file_size,
+                        semaphore=semaphore,
+                    )
+                    writers.append(writer)
+                elif event == "data":
+                    if writer:
+                        await writer.write(payload)
+                    else:
+                        field_data.append(payload)
+                elif event == "end":
+                    if writer:
+                        await writer.finish()
+                    else:
+                        upload.fields[field_name] = b"".join(field_data).decode(
+                            "utf-8"
+                        )
+                    writer = None
+            events.clear()
+
+        parser.finalize()
+        for item in writers:
+            await item.wait()
+    except BaseException:
+        for item in writers:
+            await item.abort()
+        raise
+
+    return upload
+
+
+def _load_manifest(save_dir: Path) -> dict:
+    path = save_dir / MANIFEST_NAME
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return dict()
+
+
+def _save_manifest(save_dir: Path, manifest: dict) -> None:
+    with tempfile.NamedTemporaryFile(
+        "w",
+        dir=save_dir,
+        prefix=".manifest.",
+        suffix=".tmp",
+        delete=False,
+        encoding="utf-8",
+    ) as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    try:
+        os.replace(f.name, save_dir / MANIFEST_NAME)
+    except BaseException:
+        os.unlink(f.name)
+        raise
+
+
+@contextmanager
+def _manifest_lock(save_dir: Path):
+    # Commits of one folder run one at a time, also across workers, so no
+    # manifest update is lost between load and save.
+    with open(save_dir / MANIFEST_LOCK_NAME, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def commit_staged_files(
+    files: list[StagedFile], save_dir: Path, tracker: TaskTracker
+) -> None:
+    """
+    Move staged files into the save folder and record them in its dedup manifest.
+
+    A staged file is renamed into place, which costs no extra copy because the
+    staging folder lives on the same filesystem. Files whose SHA-256 already
+    exists in the manifest are dropped. A file replacing one of the same name
+    takes over its manifest entry.
+
+    Args:
+        files (list[StagedFile]): Files produced by `async_stream_multi_files`.
+        save_dir (Path): The per user folder the files belong to.
+        tracker (TaskTracker): Tracker recording the progress of the task.
+    """
+    save_dir.mkdir(parents=True, exist_ok=True)
+    tracker.update(save_dir.name, task=False)
+    with _manifest_lock(save_dir=save_dir):
+        manifest = _load_manifest(save_dir=save_dir)
+        try:
+            for file in files:
+                _commit_staged_file(
+                    file=file, save_dir=save_dir, manifest=manifest, tracker=tracker
+                )
+        finally:
+            # Files not reached when interrupted stay out of the save folder.
+            for file in files:
+                file.path.unlink(missing_ok=True)
+            _save_manifest(save_dir=save_dir, manifest=manifest)
+    tracker.update(save_dir.name, task=True)
+
+
+def _commit_staged_file(
+    file: StagedFile, save_dir: Path, manifest: dict, tracker: TaskTracker
+) -> None:
+    try:
+        if not file.filename or Path(file.filename).name != file.filename:
+            raise UploadFormatError(f"Invalid upload filename: '{file.filename}'")
+        known = manifest.get(file.sha256)
+        if known and (save_dir / known).exists():
+            file.path.unlink(missing_ok=True)
+            duplicate = True
+        else:
+            os.replace(file.path, save_dir / file.filename)
+            for sha256 in [key for key, name in manifest.items() if name == file.filename]:
+                del manifest[sha256]
+            manifest[file.sha256] = file.filename
+            duplicate = False
+            UPLOAD_BYTES.inc(file.size)
+        UPLOAD_FILES.labels("duplicate" if duplicate else "saved").inc()
+        tracker.update(
+            save_dir.name,
+            file={
+                "filename": file.filename,
+                "size": file.size,
+                "sha256": file.sha256,
+                "is_saved": True,
+                "duplicate": duplicate,
+            },
+        )
+    except Exception as e:
+        file.path.unlink(missing_ok=True)
+        UPLOAD_FILES.labels("error").inc()
+        tracker.update(
+            save_dir.name,
+            file={"filename": file.filename, "is_saved": False, "error": str(e)},
+        )